@@ -29,7 +29,7 @@ from xl import covers, player, trax, xdg, providers
 from xl import common
 from xl.nls import gettext as _
 import xlgui
-from xlgui.guiutil import pixbuf_from_data
+from xlgui.guiutil import get_cover_thumbnail
 from xlgui.widgets import dialogs, menu
 
 LOGGER = logging.getLogger(__name__)
@@ -87,10 +87,10 @@ class Bookmark:
             if not self.__title:
                 self.__title = item.get_tag_display('title')
             if use_covers:
-                image = covers.MANAGER.get_cover(item, set_only=True)
-                if image:
+                db_string = covers.MANAGER.get_db_string(item)
+                if db_string:
                     try:
-                        self.__cover_pixbuf = pixbuf_from_data(image, size=(16, 16))
+                        self.__cover_pixbuf = get_cover_thumbnail(db_string, (16, 16))
                     except GLib.Error:
                         LOGGER.warning('Could not load cover')
             else:
@@ -31,7 +31,7 @@ from xl import player as xl_player
 from xl import settings as xl_settings
 from xl.nls import gettext as _
 from xlgui import icons
-from xlgui.guiutil import pixbuf_from_data
+from xlgui.guiutil import get_cover_thumbnail, pixbuf_from_data
 
 from . import notifyprefs
 
@@ -226,11 +226,16 @@ class Notifier(PlaybackAdapter):
         if media_icon and self.settings.use_media_icons:
             icon_name = media_icon
         elif self.settings.show_covers:
-            cover_data = covers.MANAGER.get_cover(
-                track, set_only=True, use_default=True
-            )
             size = DEFAULT_ICON_SIZE if self.settings.resize_covers else None
-            new_icon = pixbuf_from_data(cover_data, size)
+            new_icon = None
+            db_string = covers.MANAGER.get_db_string(track)
+            if size is not None and db_string:
+                new_icon = get_cover_thumbnail(db_string, size)
+            if new_icon is None:
+                cover_data = covers.MANAGER.get_cover(
+                    track, set_only=True, use_default=True
+                )
+                new_icon = pixbuf_from_data(cover_data, size)
             self.notification.set_image_from_pixbuf(new_icon)
         return icon_name
 
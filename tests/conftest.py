@@ -1,12 +1,21 @@
+import atexit
 import os
 import shutil
 import tempfile
 from typing import NamedTuple, Tuple
 
+# Keep the settings, covers and databases written by the tests away from
+# the user's own. This must happen before xl.xdg is imported.
+_xdg_home = tempfile.mkdtemp(prefix="exaile-tests-")
+atexit.register(shutil.rmtree, _xdg_home, ignore_errors=True)
+for _name in ('XDG_CONFIG_HOME', 'XDG_DATA_HOME', 'XDG_CACHE_HOME'):
+    os.environ[_name] = os.path.join(_xdg_home, _name.split('_')[1].lower())
+
 from gi.repository import Gio
 
 import pytest
 
+from xl.trax import track
 from xl.trax.track import Track
 
 import logging
@@ -25,6 +34,7 @@ def exaile_test_cleanup():
     Track._Track__the_cuts = ['the', 'a']
 
     Track._Track__tracksdict.clear()
+    track._HYDRATED.clear()
 
 
 #
@@ -0,0 +1,126 @@
+import os.path
+import shutil
+import tempfile
+
+from gi.repository import Gio
+
+from xl import collection, settings
+from xl.trax import track
+
+
+def test_transfer_queue(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        coll = collection.Collection('transfer')
+        lib = collection.Library(Gio.File.new_for_path(tmpdir).get_uri())
+        lib.set_collection(coll)
+        queue = collection.TransferQueue(lib, workers=2)
+        data = [test_tracks.get(ext) for ext in ('mp3', 'ogg', 'flac')]
+        tracks = [track.Track(d.uri) for d in data]
+
+        queue.enqueue(tracks)
+        queue.transfer()
+        progress = queue.get_progress()
+        assert progress.files_done == 3
+        assert progress.files_skipped == 0
+        assert (
+            progress.bytes_done
+            == progress.bytes_total
+            == sum(os.path.getsize(d.filename) for d in data)
+        )
+        assert len(coll) == 3
+        assert not queue.queue
+
+        # unchanged files are not copied again
+        queue.enqueue(tracks)
+        queue.transfer()
+        assert queue.get_progress().files_skipped == 3
+        assert len(coll) == 3
+
+
+def test_cancel_rescan_of_unchanged_files(test_tracks, monkeypatch):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        for ext in ('mp3', 'ogg', 'flac'):
+            shutil.copy(test_tracks.get(ext).filename, tmpdir)
+        coll = collection.Collection('rescan')
+        lib = collection.Library(Gio.File.new_for_path(tmpdir).get_uri())
+        lib.set_collection(coll)
+        lib.rescan()
+        assert len(coll) == 3
+
+        # stop the second scan once an unchanged file is queued
+        add_file = collection._LibraryScanner.add_file
+
+        def add_file_and_stop(self, *args):
+            add_file(self, *args)
+            if len(self.pending) > 1:
+                coll.stop_scan()
+
+        monkeypatch.setattr(collection._LibraryScanner, 'add_file', add_file_and_stop)
+        lib.rescan()
+        assert not lib.scanning
+        assert len(coll) == 3
+
+
+def test_rescan_rechecks_compilations(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        for ext in ('mp3', 'ogg'):
+            shutil.copy(test_tracks.get(ext).filename, tmpdir)
+        coll = collection.Collection('compilations')
+        lib = collection.Library(Gio.File.new_for_path(tmpdir).get_uri())
+        coll.add_library(lib)
+        settings.set_option('collection/file_based_compilations', False)
+        try:
+            lib.rescan()
+            tracks = list(coll)
+            for tr, artist in zip(tracks, ('foo', 'bar')):
+                tr.set_tags(album='baz', artist=artist)
+
+            # the files are unchanged, but the setting is not
+            settings.set_option('collection/file_based_compilations', True)
+            lib.rescan()
+        finally:
+            settings.MANAGER.remove_option('collection/file_based_compilations')
+        assert all(tr.get_tag_raw('__compilation') for tr in tracks)
+        assert coll.serialize_libraries()[0]['file_based_compilations'] is True
+
+
+def test_transfer_queue_unreadable_hash(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        coll = collection.Collection('transfer')
+        lib = collection.Library(Gio.File.new_for_path(tmpdir).get_uri())
+        lib.set_collection(coll)
+        tracks = [track.Track(test_tracks.get(ext).uri) for ext in ('mp3', 'ogg')]
+        queue = collection.TransferQueue(lib, workers=2)
+        queue.enqueue(tracks)
+        queue.transfer()
+
+        # files whose hash can't be computed are copied again
+        queue = collection.TransferQueue(lib, workers=2, compare='hash')
+        queue._hash = lambda gloc: None
+        queue.enqueue(tracks)
+        queue.transfer()
+        assert queue.get_progress().files_skipped == 0
+        assert queue.get_progress().files_done == 2
+
+
+def test_transfer_queue_same_name(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        filename = test_tracks.get('mp3').filename
+        tracks = []
+        for folder in ('a', 'b'):
+            os.mkdir(os.path.join(tmpdir, folder))
+            path = shutil.copy(filename, os.path.join(tmpdir, folder))
+            tracks.append(track.Track(Gio.File.new_for_path(path).get_uri()))
+        os.mkdir(os.path.join(tmpdir, 'library'))
+        coll = collection.Collection('transfer')
+        lib = collection.Library(
+            Gio.File.new_for_path(os.path.join(tmpdir, 'library')).get_uri()
+        )
+        lib.set_collection(coll)
+
+        # only the first of the files with the same name is copied
+        queue = collection.TransferQueue(lib, workers=2)
+        queue.enqueue(tracks)
+        queue.transfer()
+        assert queue.get_progress().files_done == 1
+        assert len(coll) == 1
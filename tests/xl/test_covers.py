@@ -0,0 +1,121 @@
+import os
+import tempfile
+import threading
+
+from xl import settings
+from xl.covers import (
+    Cacher,
+    CoverManager,
+    CoverStore,
+    LocalFileCoverFetcher,
+    ThumbnailCache,
+)
+
+
+def test_thumbnail_cache():
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        cache = ThumbnailCache(tmpdir, max_size=25)
+        cache.add('cache:a', (90, 90), b'a' * 10)
+        cache.add('cache:a', (90, 90), b'A' * 10, fill=True)
+        assert cache.get('cache:a', (90, 90)) == b'a' * 10
+        assert cache.get('cache:a', (48, 48)) is None
+
+        # the least recently used entry is evicted
+        cache.add('cache:b', (90, 90), b'b' * 10)
+        assert cache.get('cache:a', (90, 90), fill=True) is None
+        assert cache.get('cache:a', (90, 90)) == b'a' * 10
+
+        # entries survive a restart
+        cache = ThumbnailCache(tmpdir, max_size=25)
+        assert cache.get('cache:b', (90, 90)) == b'b' * 10
+        cache.remove('cache:a')
+        assert cache.get('cache:a', (90, 90)) is None
+        assert cache.get('cache:b', (90, 90)) == b'b' * 10
+
+
+def test_cover_store():
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        store = CoverStore(os.path.join(tmpdir, 'covers.sqlite'))
+        assert store.get_version() == 0
+        store.save({'a\0b': ('cache:x', True), 'c': ('tag:foo', False)}, 2)
+        store.save({'c': None, 'd': ('cache:y', False)}, 2)
+        assert sorted(store.load()) == [
+            ('a\0b', 'cache:x', True),
+            ('d', 'cache:y', False),
+        ]
+        assert store.get_version() == 2
+
+        store.save({'e': ('cache:z', False)}, 2, replace=True)
+        assert list(store.load()) == [('e', 'cache:z', False)]
+
+
+def test_collect_garbage():
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        cache = Cacher(tmpdir)
+        user = cache.add(b'u' * 1024 * 1024)
+        old = cache.add(b'o' * 1024 * 1024)
+        new = cache.add(b'n' * 1024 * 1024)
+        unused = cache.add(b'x')
+        os.utime(os.path.join(tmpdir, user), (0, 0))
+        os.utime(os.path.join(tmpdir, old), (1, 1))
+
+        man = CoverManager.__new__(CoverManager)
+        man._CoverManager__cache = cache
+        man.thumbnails = ThumbnailCache(os.path.join(tmpdir, 'thumbs'), 1024)
+        man._db_lock = threading.RLock()
+        man._changes = {}
+        man._user_set = {'u'}
+        man.db = {
+            'version': CoverManager.DB_VERSION,
+            'u': 'cache:' + user,
+            'o': 'cache:' + old,
+            'n': 'cache:' + new,
+            'n2': 'cache:' + new,
+        }
+        man._count_refs()
+        man.timeout_save = lambda: None
+
+        settings.set_option('covers/cache_size', 2)
+        try:
+            assert man.collect_garbage() == 2
+        finally:
+            settings.MANAGER.remove_option('covers/cache_size')
+        assert sorted(e[0] for e in cache.entries()) == sorted([user, new])
+        assert 'o' not in man.db and man._changes == {'o': None}
+
+        # the file goes away with its last reference
+        man._unref(man.db.pop('n'))
+        assert cache.get(new) is not None
+        man._unref(man.db.pop('n2'))
+        assert cache.get(new) is None
+
+
+def test_thumbnail_stamp():
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        man = CoverManager.__new__(CoverManager)
+        man.methods = {'localfile': LocalFileCoverFetcher()}
+        path = os.path.join(tmpdir, 'cover.jpg')
+        db_string = 'localfile:file://' + path
+        with open(path, 'wb') as f:
+            f.write(b'a')
+        os.utime(path, (1, 1))
+
+        cache = ThumbnailCache(os.path.join(tmpdir, 'thumbs'), max_size=1024)
+        stamp = man.get_thumbnail_stamp(db_string)
+        cache.add(db_string, (90, 90), b'a', stamp=stamp)
+        assert man.get_thumbnail_stamp(db_string) == stamp
+        assert cache.get(db_string, (90, 90), stamp=stamp) == b'a'
+
+        # the thumbnail of the old file is not found anymore
+        with open(path, 'wb') as f:
+            f.write(b'bb')
+        os.utime(path, (1, 1))
+        assert man.get_thumbnail_stamp(db_string) != stamp
+        assert (
+            cache.get(db_string, (90, 90), stamp=man.get_thumbnail_stamp(db_string))
+            is None
+        )
+
+        assert man.get_thumbnail_stamp('cache:abc') == ''
+        assert man.get_thumbnail_stamp('localfile:file://' + path + '.gone') is None
+        assert man.get_thumbnail_stamp('unknown:abc') is None
@@ -96,3 +96,101 @@ def test_thread_events():
     ncb.destroy()
 
     _finish_events()
+
+
+class BatchCallback:
+    def __init__(self):
+        self.batches = []
+        self.single = []
+        event.add_callback(self.on_batch, 'tracks_tags_changed')
+        event.add_callback(self.on_single, 'track_tags_changed')
+
+    def destroy(self):
+        event.remove_callback(self.on_batch, 'tracks_tags_changed')
+        event.remove_callback(self.on_single, 'track_tags_changed')
+
+    def on_batch(self, type, obj, data):
+        self.batches.append(data)
+
+    def on_single(self, type, obj, data):
+        self.single.append((obj, data))
+
+
+class SingleCallback:
+    def __init__(self):
+        self.single = []
+        event.add_callback(self.on_single, 'track_tags_changed')
+
+    def destroy(self):
+        event.remove_callback(self.on_single, 'track_tags_changed')
+
+    def on_single(self, type, obj, data):
+        self.single.append((obj, data))
+
+
+def test_batch_events():
+    _init_events()
+    on_ui_thread[0] = True
+    bcb = BatchCallback()
+    scb = SingleCallback()
+    a, b = NormalCallback(), NormalCallback()
+
+    with event.batch():
+        event.log_event('track_tags_changed', a, {'artist'})
+        with event.batch():
+            event.log_event('track_tags_changed', b, {'title'})
+        event.log_event('track_tags_changed', a, {'album'})
+        assert not bcb.batches and not scb.single
+        # other events are not held back
+        event.log_event('test', scb, None)
+        assert a.called
+
+    assert bcb.batches == [{a: {'artist', 'album'}, b: {'title'}}]
+    assert bcb.single == []
+    assert scb.single == [(a, {'artist', 'album'}), (b, {'title'})]
+
+    # outside of a batch, events are delivered one by one
+    event.log_event('track_tags_changed', a, {'genre'})
+    assert len(bcb.batches) == 1
+    assert bcb.single == [(a, {'genre'})]
+
+    for cb in (bcb, scb, a, b):
+        cb.destroy()
+
+    _finish_events()
+
+
+def test_dead_callbacks_are_pruned():
+    _init_events()
+    on_ui_thread[0] = True
+    ncb = NormalCallback()
+    other = NormalCallback()
+    del ncb
+
+    event.log_event('test', other, None)
+    assert other.called
+    assert len(event.EVENT_MANAGER.all_callbacks['test'][event._NONE]) == 1
+
+    other.destroy()
+    _finish_events()
+
+
+def test_profiling():
+    _init_events()
+    on_ui_thread[0] = True
+    ncb = NormalCallback()
+    event.EVENT_MANAGER.start_profiling()
+
+    event.log_event('test', ncb, None)
+    event.log_event('test', ncb, None)
+    event.log_event('other', ncb, None)
+
+    profile = event.EVENT_MANAGER.stop_profiling()
+    assert profile['test'].emits == 2
+    assert profile['test'].calls == 2
+    assert list(profile['test'].callbacks) == ['%s.NormalCallback.on_cb' % __name__]
+    assert profile['other'].calls == 0
+    assert event.EVENT_MANAGER.profile is None
+
+    ncb.destroy()
+    _finish_events()
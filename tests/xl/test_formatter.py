@@ -0,0 +1,39 @@
+from xl import formatter, settings
+from xl.trax import track
+
+
+def test_compiled_template():
+    f = formatter.Formatter('$a-${b:prefix=<, pad=3, padstring=0}-$$-$c-$a')
+    f._substitutions = {'a': 'A', 'b': lambda: '7', 'c': None}
+    assert f.format() == 'A-<007-$-$c-A'
+    assert [field.needle for field in f.compile().fields] == [
+        'a',
+        'b:prefix=<, pad=3, padstring=0',
+        'c',
+    ]
+
+    f.props.format = '$c$a'
+    assert f.format() == '$cA'
+
+
+def test_track_formatter_cache():
+    tr = track.Track('/foo', scan=False)
+    tr.set_tags(artist='foo', tracknumber='3/12')
+    f = formatter.TrackFormatter('$tracknumber ${artist:prefix=by }', cache=True)
+    assert f.format(tr) == '3 by foo'
+    tr.set_tags(artist='bar')
+    assert f.format(tr) == '3 by bar'
+    f.props.format = '$artist'
+    assert f.format(tr) == 'bar'
+
+
+def test_track_formatter_cache_skips_volatile_fields():
+    tr = track.Track('/foo', scan=False)
+    tr.set_tags(artist='foo', __rating=60)
+    f = formatter.TrackFormatter('$artist $__rating', cache=True)
+    assert f.format(tr) == 'foo ★★★☆☆'
+    settings.set_option('rating/maximum', 10)
+    try:
+        assert f.format(tr) == 'foo ★★★★★★☆☆☆☆'
+    finally:
+        settings.MANAGER.remove_option('rating/maximum')
@@ -0,0 +1,75 @@
+import os.path
+import tempfile
+
+from xl.settings import SettingsManager
+
+
+def test_volatile_options_saved_separately():
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        location = os.path.join(tmpdir, "settings.ini")
+        volatile = os.path.join(tmpdir, "state.ini")
+
+        settings = SettingsManager(location, None, volatile, ('gui/mainw_*',))
+        settings.set_option('gui/mainw_width', 640)
+        settings.set_option('gui/use_tray', True)
+        settings.save(wait=True)
+        assert settings.flush_count == 2
+        assert settings.bytes_written == os.path.getsize(location) + os.path.getsize(
+            volatile
+        )
+        with open(volatile) as f:
+            assert 'mainw_width' in f.read()
+        with open(location) as f:
+            assert 'mainw_width' not in f.read()
+
+        # only the file with changes is written again
+        mtime = os.path.getmtime(location)
+        settings.set_option('gui/mainw_width', 800)
+        settings.save(wait=True)
+        assert settings.flush_count == 3
+        assert os.path.getmtime(location) == mtime
+
+        settings = SettingsManager(location, None, volatile, ('gui/mainw_*',))
+        assert settings.get_option('gui/mainw_width') == 800
+        assert settings.get_option('gui/use_tray') is True
+
+
+def test_value_cache():
+    settings = SettingsManager(None)
+    settings.set_option('collection/strip_list', ['the'])
+    value = settings.get_option('collection/strip_list')
+    value.append('a')
+    assert settings.get_option('collection/strip_list') == ['the']
+
+    settings.set_option('collection/strip_list', ['an'])
+    assert settings.get_option('collection/strip_list') == ['an']
+    settings.remove_option('collection/strip_list')
+    assert settings.get_option('collection/strip_list', []) == []
+
+
+def test_bind_option():
+    settings = SettingsManager(None)
+    bound = settings.bind_option('rating/maximum', 5)
+    assert bound.value == 5
+    settings.set_option('rating/maximum', 10)
+    assert bound.value == 10
+    settings.remove_option('rating/maximum')
+    assert bound.value == 5
+
+
+def test_volatile_options_migrated():
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        location = os.path.join(tmpdir, "settings.ini")
+        volatile = os.path.join(tmpdir, "state.ini")
+
+        settings = SettingsManager(location)
+        settings.set_option('gui/mainw_width', 640)
+        settings.save(wait=True)
+
+        # the first run with a volatile store moves them out of the main file
+        settings = SettingsManager(location, None, volatile, ('gui/mainw_*',))
+        settings.save(wait=True)
+        with open(location) as f:
+            assert 'mainw_width' not in f.read()
+        with open(volatile) as f:
+            assert 'mainw_width' in f.read()
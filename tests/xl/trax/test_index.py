@@ -0,0 +1,188 @@
+from xl import event, playlist
+from xl.trax import search, track
+from xl.trax.index import TagIndex
+from xl.trax.trackdb import TrackDB
+
+import pytest
+
+
+@pytest.fixture
+def trackdb(test_tracks):
+    db = TrackDB()
+    tracks = [
+        track.Track(test_tracks.get(ext).uri, scan=False)
+        for ext in ('mp3', 'ogg', 'flac')
+    ]
+    tracks[0].set_tags(artist='Foo Fighters', album='Wasting Light', title='Rope')
+    tracks[1].set_tags(artist=['Bar', 'Foo'], title='Walk')
+    tracks[2].set_tags(artist='Baz', albumartist='Various', title='Dear Rosemary')
+    for tr, (rating, playcount, bpm) in zip(
+        tracks, [(80, 3, '120'), (40, 0, None), (100, 12, 'fast')]
+    ):
+        tr.set_tags(__rating=rating, __playcount=playcount, bpm=bpm)
+    tracks[0].set_tags(__last_played=1000.5)
+    db.add_tracks(tracks)
+    return db, tracks
+
+
+def search_db(db, query, **kwargs):
+    return {r.track for r in search.search_tracks_from_string(db, query, **kwargs)}
+
+
+def scan(tracks, query, **kwargs):
+    return {
+        r.track for r in search.search_tracks_from_string(list(tracks), query, **kwargs)
+    }
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        'artist==Foo',
+        'artist==foo',
+        'artist="foo fighters"',
+        'artist=fo',
+        'title=ro',
+        'title=rope',
+        'album==__null__',
+        'albumartist==Various',
+        'albumartist=bar',
+        'foo',
+        'FOO ! title=walk',
+        'walk | light',
+        'artist~^Ba',
+        '__playcount<1 rose',
+        '__rating>40',
+        '__rating<80',
+        '( __rating>60 | __rating==60 )',
+        '( __playcount>0 __playcount<10 )',
+        '__playcount==12',
+        '__playcount==12.00001',
+        '__last_played>1000',
+        '__last_played<2000',
+        '__last_played==__null__',
+        'bpm>100',
+        'bpm<130',
+        'bpm<fast',
+        '! __rating<50',
+    ],
+)
+def test_index_matches_scan(trackdb, query):
+    db, tracks = trackdb
+    for case_sensitive in (True, False):
+        kwargs = dict(
+            case_sensitive=case_sensitive,
+            keyword_tags=['artist', 'albumartist', 'album', 'title'],
+        )
+        assert search_db(db, query, **kwargs) == scan(tracks, query, **kwargs)
+
+
+def test_candidates(trackdb):
+    db, tracks = trackdb
+    index = db.get_tag_index()
+    assert index.exact('artist', 'foo') == {tracks[1]}
+    assert index.substring('title', 'ros') == {tracks[2]}
+    assert index.substring('__loc', 'foo') is None
+    matcher = search.TracksMatcher('artist=foo title~R')
+    assert matcher.candidates(index) == {tracks[0], tracks[1]}
+
+
+def test_index_follows_changes(trackdb, test_tracks):
+    db, tracks = trackdb
+    index = db.get_tag_index()
+    assert index.exact('title', 'rope') == {tracks[0]}
+
+    tracks[0].set_tags(title='Arlandria')
+    assert index.exact('title', 'rope') == set()
+    assert index.substring('title', 'landr') == {tracks[0]}
+
+    db.remove(tracks[0])
+    assert tracks[0] not in index
+    assert index.substring('title', 'landr') == set()
+
+    new = track.Track(test_tracks.get('wav').uri, scan=False)
+    new.set_tags(title='Rope')
+    db.add(new)
+    assert index.exact('title', 'rope') == {new}
+    assert search_db(db, 'title==Rope') == {new}
+
+
+def test_index_follows_batched_changes(trackdb):
+    db, tracks = trackdb
+    index = db.get_tag_index()
+    assert index.exact('title', 'rope') == {tracks[0]}
+    with event.batch():
+        tracks[0].set_tags(title='Arlandria')
+        tracks[1].set_tags(title='Rope')
+        assert index.exact('title', 'rope') == {tracks[0]}
+    assert index.exact('title', 'rope') == {tracks[1]}
+
+
+def test_explicit_index_keeps_order(trackdb):
+    db, tracks = trackdb
+    ordered = list(reversed(tracks))
+    results = search.search_tracks_from_string(
+        ordered, 'artist=ba', index=db.get_tag_index(), case_sensitive=False
+    )
+    assert [r.track for r in results] == [tracks[2], tracks[1]]
+
+
+def test_numeric_candidates(trackdb):
+    db, tracks = trackdb
+    index = db.get_tag_index()
+    assert index.greater('__rating', '40') == {tracks[0], tracks[2]}
+    assert index.less('bpm', '200') == {tracks[0], tracks[1]}
+    assert index.less('__last_played', '1') == {tracks[1], tracks[2]}
+
+    tracks[1].set_tags(__rating=90)
+    assert index.greater('__rating', '85') == {tracks[1], tracks[2]}
+    db.remove(tracks[2])
+    assert index.greater('__rating', '85') == {tracks[1]}
+
+
+def test_explain_uses_index(trackdb):
+    db, tracks = trackdb
+    matcher = search.TracksMatcher('artist==foo title~a', case_sensitive=False)
+    lines = matcher.explain(db).splitlines()
+    assert lines[1].startswith('Index: 1 of 3 tracks are candidates')
+    assert lines[2].startswith('Matched 1 tracks')
+    # the condition answered by the index is checked last
+    assert lines[4].startswith("  title~'a'")
+    assert lines[5].startswith("  artist=='foo'")
+    assert 'indexed' in lines[5]
+
+
+def test_standalone_index(trackdb):
+    _db, tracks = trackdb
+    index = TagIndex()
+    index.add(tracks[:2])
+    assert index.substring('artist', 'foo') == {tracks[0], tracks[1]}
+    index.remove([tracks[0], tracks[2]])
+    assert index.substring('artist', 'foo') == {tracks[1]}
+    tracks[1].set_tags(artist='Baz')
+    assert index.substring('artist', 'foo') == set()
+
+
+def test_playlist_index(trackdb):
+    _db, tracks = trackdb
+    pl = playlist.Playlist('test', tracks)
+    index = pl.get_tag_index()
+    assert len(index) == 3
+    assert search_db(pl, 'artist=Foo') == {tracks[0], tracks[1]}
+
+    # the index follows the playlist, counting duplicates
+    pl.append(tracks[0])
+    del pl[0]
+    assert search_db(pl, 'artist=Foo') == {tracks[0], tracks[1]}
+    pl.pop()
+    assert tracks[0] not in index
+    assert search_db(pl, 'artist=Foo') == {tracks[1]}
+    pl[:] = list(reversed(tracks))
+    assert len(index) == 3
+
+
+def test_indexed_search_keeps_order(trackdb):
+    _db, tracks = trackdb
+    pl = playlist.Playlist('test', [tracks[2], tracks[0], tracks[1], tracks[2]])
+    results = search.search_tracks_from_string(pl, 'artist=ba', case_sensitive=False)
+    assert [r.track for r in results] == [tracks[2], tracks[1], tracks[2]]
@@ -48,3 +48,24 @@ def test_migration_to_sqlite():
 
         with common.open_shelf(dbpath) as db:
             assert list(db.items()) == [('key', ({'tag': 'value'}, 2, {}))]
+
+
+def test_migration_to_track_tables():
+    from xl.trax.trackdb import TrackDB
+
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        dbpath = os.path.join(tmpdir, "music.db")
+
+        with common.open_shelf(dbpath) as db:
+            db['_dbversion'] = 2.0
+            db['_key'] = 2
+            db['tracks-0'] = ({'__loc': 'file:///a.mp3', 'artist': ['a']}, 0, {})
+            db['tracks-1'] = ({'__loc': 'file:///a.mp3', 'artist': ['b']}, 1, {})
+
+        trackdb = TrackDB(location=dbpath)
+        assert list(trackdb.tracks) == ['file:///a.mp3']
+        assert trackdb.get_track_by_loc('file:///a.mp3').get_tag_raw('artist') == ['a']
+
+        with common.open_shelf(dbpath) as db:
+            assert db['_dbversion'] == 3.0
+            assert not [k for k in db if k.startswith('tracks-')]
@@ -421,3 +421,139 @@ class TestSearchTracks:
         assert next(gen).track == tracks[2]
         with pytest.raises(StopIteration):
             next(gen)
+
+
+class TestParseQuery:
+    @pytest.mark.parametrize(
+        'query, expected',
+        [
+            ('', ('and',)),
+            ('foo bar', ('and', ('keyword', 'foo'), ('keyword', 'bar'))),
+            (
+                '! foo | bar',
+                ('and', ('or', ('not', ('keyword', 'foo')), ('keyword', 'bar'))),
+            ),
+            (
+                'a | b | c',
+                ('and', ('or', ('keyword', 'a'), ('keyword', 'b'), ('keyword', 'c'))),
+            ),
+            (
+                '( artist==foo __rating>3 )',
+                ('and', ('and', ('==', 'artist', 'foo'), ('>', '__rating', '3'))),
+            ),
+            ('album==__null__', ('and', ('==', 'album', None))),
+            ('foo foo | foo', ('and', ('keyword', 'foo'))),
+            # incomplete queries while typing
+            ('( foo', ('and', ('and', ('keyword', 'foo')))),
+            ('foo |', ('and', ('keyword', 'foo'))),
+            ('foo !', ('and', ('keyword', 'foo'))),
+        ],
+    )
+    def test_parse(self, query, expected):
+        assert search.parse_query(query) == expected
+
+    def test_cached(self):
+        assert search.parse_query('foo bar') is search.parse_query('foo bar')
+
+
+class TestQueryPlan:
+    def test_group(self):
+        tr = track.Track('file:///foo')
+        tr.set_tag_raw('__rating', 50)
+        assert not search.match_track_from_string(tr, '( __rating>1 __rating<3 )')
+        assert search.match_track_from_string(tr, '( __rating>1 __rating<60 )')
+
+    def test_cheap_conditions_first(self):
+        matcher = search.TracksMatcher('title~fo+ album==foo artist=foo')
+        assert [type(ma) for ma in matcher.matchers] == [
+            search._ExactMatcher,
+            search._InMatcher,
+            search._RegexMatcher,
+        ]
+
+    def test_shared_condition(self):
+        matcher = search.TracksMatcher(
+            '( foo bar ) | ( foo baz )', keyword_tags=['artist']
+        )
+        shared = matcher.matchers[0].left.matchers[0].matchers[0]
+        assert isinstance(shared, search._SharedMatcher)
+        assert shared is matcher.matchers[0].right.matchers[0].matchers[0]
+
+        with patch.object(
+            search._ManyMultiMetaMatcher, 'match', autospec=True, return_value=False
+        ) as mock_method:
+            assert not matcher.match(get_search_result_track())
+        # 'foo' is checked once, then 'bar' and 'baz' are not needed
+        assert mock_method.call_count == 1
+
+    def test_explain(self):
+        tracks = [track.Track('file:///%s' % x) for x in ('foo', 'bar')]
+        tracks[0].set_tag_raw('artist', 'foo')
+        matcher = search.TracksMatcher('artist=fo', keyword_tags=['artist'])
+        lines = matcher.explain(tracks).splitlines()
+        assert lines[0] == "Query: 'artist=fo'"
+        assert lines[1].startswith('Matched 1 tracks')
+        assert lines[3].startswith("  artist='fo' (")
+        assert lines[3].endswith('ms')
+        assert ': 2 calls, 1 matches' in lines[3]
+
+
+class TestRefinement:
+    @pytest.mark.parametrize(
+        'query, previous',
+        [
+            ('beatl', 'beat'),
+            ('beat les', 'beat'),
+            ('artist=beatles', 'artist=beat'),
+            ('__rating>80', '__rating>60'),
+            ('__rating<20', '__rating<60'),
+            ('foo', 'foo | bar'),
+            ('( foo bar ) | foo', 'foo'),
+            ('! fo', '! foo'),
+            ('foo', ''),
+        ],
+    )
+    def test_refinement(self, query, previous):
+        assert search.is_refinement(query, previous)
+
+    @pytest.mark.parametrize(
+        'query, previous',
+        [
+            ('beat', 'beatl'),
+            ('foo | bar', 'foo'),
+            ('title=beatles', 'artist=beat'),
+            ('__rating>60', '__rating>80'),
+            ('artist~beatles', 'artist~beat'),
+            ('', 'foo'),
+        ],
+    )
+    def test_not_refinement(self, query, previous):
+        assert not search.is_refinement(query, previous)
+
+
+class TestSearchSession:
+    def setup_method(self):
+        self.tracks = [track.Track('file:///%s' % x) for x in ('a', 'b', 'c')]
+        for tr, artist in zip(self.tracks, ('beach boys', 'beatles', 'the beat')):
+            tr.set_tag_raw('artist', artist)
+        self.session = search.SearchSession(self.tracks, keyword_tags=['artist'])
+
+    def search(self, query):
+        return [srtr.track for srtr in self.session.search(query)]
+
+    def test_refine(self):
+        assert self.search('bea') == self.tracks
+        with patch.object(search, 'search_tracks', wraps=search.search_tracks) as mock:
+            assert self.search('beat') == self.tracks[1:]
+            assert self.search('beatl') == self.tracks[1:2]
+        # only the previous results were searched
+        assert [len(c.args[0]) for c in mock.call_args_list] == [3, 2]
+
+    def test_widen(self):
+        assert self.search('beatl') == self.tracks[1:2]
+        assert self.search('beat') == self.tracks[1:]
+
+    def test_tags_changed(self):
+        assert self.search('beatl') == self.tracks[1:2]
+        self.tracks[0].set_tag_raw('artist', 'beatles tribute')
+        assert self.search('beatles') == self.tracks[:2]
@@ -10,6 +10,7 @@ from unittest.mock import Mock, patch
 
 import pytest
 
+from xl import metadata
 from xl.metadata import CoverImage
 import xl.trax.track as track
 import xl.settings as settings
@@ -81,9 +82,19 @@ def random_str(l=8):
 
 class TestTrack:
     def verify_tags_exist(self, tr, test_track, deleted=None):
-        internal_tags = {'__length', '__modified', '__basedir', '__basename', '__loc'}
+        internal_tags = {
+            '__length',
+            '__modified',
+            '__filesize',
+            '__basedir',
+            '__basename',
+            '__loc',
+        }
         if test_track.ext not in ['aac', 'spx']:
             internal_tags.add('__bitrate')
+        # the format class is remembered when several share the extension
+        if isinstance(metadata.formats.get(test_track.ext), list):
+            internal_tags.add('__format')
 
         disk_tags = {'album', 'tracknumber', 'artist', 'title'}
         normal_tags = internal_tags | disk_tags
@@ -472,6 +483,39 @@ class TestTrack:
         tr.set_tag_raw('coverart', val)
         assert tr.get_tag_sort('coverart') == ret
 
+    def test_get_sort_tag_cached(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', 'The Foo')
+        assert tr.get_tag_sort('artist') == tr.get_tag_sort('artist')
+        assert ('artist', False) in tr._sort_keys[1]
+
+        tr.set_tag_raw('artist', 'Bar')
+        assert tr.get_tag_sort('artist') == 'bar bar Bar Bar'
+
+    def test_tag_generation(self):
+        tr = track.Track('/foo')
+        generation = tr._tag_generation
+        tr.set_tag_raw('artist', 'foo')
+        assert tr._tag_generation == generation + 1
+        tr.set_tag_raw('artist', 'foo')
+        assert tr._tag_generation == generation + 1
+
+    def test_get_sort_tag_cuts_change(self):
+        tr = track.Track('/foo')
+        tr.set_tag_raw('artist', 'The Foo')
+        old = settings.get_option('collection/strip_list', [])
+        try:
+            settings.set_option('collection/strip_list', [])
+            track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+            assert tr.get_tag_sort('artist').startswith('the foo')
+
+            settings.set_option('collection/strip_list', ['the'])
+            track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+            assert tr.get_tag_sort('artist').startswith('foo')
+        finally:
+            settings.set_option('collection/strip_list', old)
+            track.Track._the_cuts_cb(None, None, 'collection/strip_list')
+
     ## Display Tags
     def test_get_display_tag_loc(self):
         import sys
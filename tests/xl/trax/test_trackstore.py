@@ -0,0 +1,150 @@
+import os.path
+import sqlite3
+import tempfile
+
+from xl import common
+from xl.trax import track
+from xl.trax.trackdb import TrackDB
+from xl.trax.trackstore import TrackStore
+
+
+def test_roundtrip():
+    store = TrackStore(sqlite3.connect(':memory:'))
+    tags = {
+        '__loc': 'file:///foo.mp3',
+        'artist': ['foo', 'bar'],
+        'title': ['baz'],
+        '__length': 12.5,
+        '__playcount': 3,
+        '__compilation': ('/music', 'album'),
+        '__rating': None,
+    }
+    store.save([(3, tags, {'extra': 1})])
+    assert list(store.load()) == [(3, 'file:///foo.mp3', tags, {'extra': 1})]
+    assert store.load_tags(3) == tags
+    assert store.load_tags(4) is None
+
+
+def test_indexed_columns():
+    store = TrackStore(sqlite3.connect(':memory:'))
+    store.save(
+        [
+            (1, {'__loc': 'file:///a', 'artist': ['foo'], '__modified': 5}, {}),
+            (2, {'__loc': 'file:///b', 'artist': ['bar']}, {}),
+        ]
+    )
+    assert store.find_keys('artist', ['foo']) == [1]
+    assert store.find_keys('loc', 'file:///b') == [2]
+    assert store.find_keys('modified', 5) == [1]
+
+
+def test_replace_and_delete():
+    store = TrackStore(sqlite3.connect(':memory:'))
+    store.save([(1, {'__loc': 'file:///a', 'artist': ['foo'], 'genre': ['x']}, {})])
+    store.save([(1, {'__loc': 'file:///a', 'artist': ['bar']}, {})])
+    assert store.load_tags(1) == {'__loc': 'file:///a', 'artist': ['bar']}
+    store.delete([1, 2])
+    assert len(store) == 0
+
+
+def test_trackdb_incremental_save(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        dbpath = os.path.join(tmpdir, "music.db")
+
+        db = TrackDB(location=dbpath)
+        tracks = [
+            track.Track(test_tracks.get(ext).uri, scan=False)
+            for ext in ('mp3', 'ogg', 'flac')
+        ]
+        for tr, artist in zip(tracks, ('foo', 'bar', 'baz')):
+            tr.set_tags(artist=artist)
+        db.add_tracks(tracks)
+        db.save_to_location()
+        db.remove(tracks[1])
+        tracks[2].set_tags(artist='quux')
+        db.save_to_location()
+
+        with common.open_shelf(dbpath) as pdata:
+            store = TrackStore(pdata.dict.conn)
+            artists = {loc: tags['artist'] for _k, loc, tags, _a in store.load()}
+        assert artists == {
+            tracks[0].get_loc_for_io(): ['foo'],
+            tracks[2].get_loc_for_io(): ['quux'],
+        }
+
+
+def test_trackdb_lazy_load(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        dbpath = os.path.join(tmpdir, "music.db")
+
+        db = TrackDB(location=dbpath)
+        tr = track.Track(test_tracks.get('mp3').uri, scan=False)
+        tr.set_tags(artist='foo')
+        db.add(tr)
+        db.save_to_location()
+        loc = tr.get_loc_for_io()
+        del db, tr
+        track.Track._Track__tracksdict.clear()
+
+        db = TrackDB(location=dbpath, lazy=True)
+        tr = db.get_track_by_loc(loc)
+        assert tr._Track__tagdict is None
+        assert tr.get_loc_for_io() == loc
+        assert tr.get_tag_raw('artist') == ['foo']
+        assert tr._Track__tagdict is not None
+
+        # unchanged tracks can be dropped and reloaded
+        tr._dehydrate()
+        assert tr._Track__tagdict is None
+        assert tr.get_tag_raw('artist') == ['foo']
+
+        # changed tracks keep their tags until saved
+        tr.set_tags(artist='bar')
+        tr._dehydrate()
+        assert tr.get_tag_raw('artist') == ['bar']
+        db.save_to_location()
+        tr._dehydrate()
+        assert tr.get_tag_raw('artist') == ['bar']
+
+
+def test_hydration_cache_evicts():
+    cache = track._HydrationCache(maxentries=2)
+    tracks = [
+        track.Track._restore('file:///%s' % x, key=x, loader=lambda k: None)
+        for x in 'abc'
+    ]
+    for tr in tracks:
+        tr.get_tag_raw('artist')
+        cache.add(tr)
+    assert tracks[0]._Track__tagdict is None
+    assert tracks[2]._Track__tagdict is not None
+    assert len(cache) == 2
+
+
+def test_trackdb_lazy_move(test_tracks):
+    with tempfile.TemporaryDirectory(prefix="exaile-") as tmpdir:
+        dbpath = os.path.join(tmpdir, "music.db")
+
+        db = TrackDB(location=dbpath)
+        tr = track.Track(test_tracks.get('mp3').uri, scan=False)
+        tr.set_tags(artist='foo')
+        db.add(tr)
+        db.save_to_location()
+        loc = tr.get_loc_for_io()
+        del db, tr
+        track.Track._Track__tracksdict.clear()
+
+        db = TrackDB(location=dbpath, lazy=True)
+        assert db.get_track_by_loc(loc).get_tag_raw('artist') == ['foo']
+        assert db._lazy_db is not None
+        db.close()
+        assert db._lazy_db is None
+
+        # a new location gets all tracks, not only the changed ones
+        newpath = os.path.join(tmpdir, "moved.db")
+        db.set_location(newpath)
+        assert db._lazy_db is None
+        db.save_to_location()
+        with common.open_shelf(newpath) as pdata:
+            store = TrackStore(pdata.dict.conn)
+            assert [tags['artist'] for _k, _l, tags, _a in store.load()] == [['foo']]
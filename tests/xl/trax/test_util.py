@@ -3,6 +3,7 @@ from unittest.mock import patch
 from gi.repository import Gio
 
 import xl.collection
+import xl.metadata
 import xl.trax.search
 import xl.trax.track
 import xl.trax.util
@@ -40,6 +41,29 @@ class TestGetTracksFromUri:
             xl.trax.util.get_tracks_from_uri(uri)
 
 
+class TestGetTracksFromUris:
+    def test_order(self, test_tracks):
+        uris = [test_tracks.get(ext).uri for ext in ('mp3', 'ogg', 'flac')]
+        missing = Gio.File.new_for_path('__nonexistent_file__').get_uri()
+        tracks = xl.trax.util.get_tracks_from_uris(uris[:1] + [missing] + uris[1:])
+        assert [tr.get_loc_for_io() for tr in tracks] == uris
+        assert all(tr.get_tag_raw('title') for tr in tracks)
+
+
+def test_read_tags_many(test_tracks):
+    uris = [test_tracks.get(ext).uri for ext in ('mp3', 'ogg', 'flac', 'wv')]
+    missing = Gio.File.new_for_path('__nonexistent_file__').get_uri()
+    results = {
+        result.uri: result
+        for result in xl.metadata.read_tags_many(uris + [missing], workers=2)
+    }
+    assert set(results) == set(uris + [missing])
+    for uri in uris:
+        assert results[uri].error is None
+        assert results[uri].tags['__modified']
+    assert results[missing].error is not None
+
+
 class TestSortTracks:
     def setup_method(self):
         self.tracks = [
@@ -81,3 +105,27 @@ class TestSortResultTracks:
         assert xl.trax.util.sort_result_tracks(self.fields, self.tracks, True) == list(
             reversed(self.result)
         )
+
+
+def test_read_tags_remembers_format(test_tracks):
+    uri = test_tracks.get('aac').uri
+    f, tags = xl.metadata.read_tags(uri)
+    assert type(f).__name__ == tags['__format'] == 'MP4Format'
+    # a wrong hint only costs a failed attempt
+    f = xl.metadata.get_format(uri, hint='AACFormat')
+    assert type(f).__name__ == 'MP4Format'
+
+    f, tags = xl.metadata.read_tags(test_tracks.get('mp3').uri)
+    assert '__format' not in tags
+
+
+def test_get_tracks_from_uris_reread(test_tracks):
+    uri = test_tracks.get('mp3').uri
+    tr = xl.trax.util.get_tracks_from_uris([uri])[0]
+    tr.set_tag_raw('title', 'changed')
+    # known tracks are returned as they are, unless asked to read them again
+    assert xl.trax.util.get_tracks_from_uris([uri])[0].get_tag_raw('title') == [
+        'changed'
+    ]
+    xl.trax.util.get_tracks_from_uris([uri], reread=True)
+    assert tr.get_tag_raw('title') != ['changed']
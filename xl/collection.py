@@ -35,9 +35,23 @@ collection.
 """
 
 from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import hashlib
 import logging
+import os
 import threading
-from typing import Deque, Dict, Iterable, List, MutableSequence, Optional, Set, Tuple
+import time
+from typing import (
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    MutableSequence,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from gi.repository import (
     GLib,
@@ -45,12 +59,17 @@ from gi.repository import (
     Gio,
 )
 
-from xl import common, event, settings, trax
+from xl import common, event, metadata, settings, trax
 
 logger = logging.getLogger(__name__)
 
 COLLECTIONS: Set['Collection'] = set()
 
+# checked for every track added during a scan
+_FILE_BASED_COMPILATIONS = settings.bind_option(
+    'collection/file_based_compilations', True
+)
+
 
 def get_collection_by_loc(loc: str) -> Optional['Collection']:
     """
@@ -65,6 +84,14 @@ def get_collection_by_loc(loc: str) -> Optional['Collection']:
     return None
 
 
+def _library_prefix(location: str) -> str:
+    """
+    Returns the prefix shared by the URIs of all tracks inside the
+    library at *location*
+    """
+    return Gio.File.new_for_uri(location).get_uri().rstrip('/') + '/'
+
+
 class CollectionScanThread(common.ProgressThread):
     """
     Scans the collection
@@ -130,7 +157,7 @@ class Collection(trax.TrackDB):
     5
     """
 
-    def __init__(self, name, location=None, pickle_attrs=[]):
+    def __init__(self, name, location=None, pickle_attrs=[], lazy=False):
         global COLLECTIONS
         self.libraries: Dict[str, Library] = {}
         self._scanning = False
@@ -139,9 +166,55 @@ class Collection(trax.TrackDB):
         self._running_total_count = 0
         self._frozen = False
         self._libraries_dirty = False
+        # library location -> locations of its tracks, see get_library_locations
+        self._library_locations: Optional[Dict[str, Set[str]]] = None
         pickle_attrs += ['_serial_libraries']
-        trax.TrackDB.__init__(self, name, location=location, pickle_attrs=pickle_attrs)
+        trax.TrackDB.__init__(
+            self, name, location=location, pickle_attrs=pickle_attrs, lazy=lazy
+        )
         COLLECTIONS.add(self)
+        event.add_callback(self._on_tracks_added, 'tracks_added', self)
+        event.add_callback(self._on_tracks_removed, 'tracks_removed', self)
+
+    def load_from_location(self, location: Optional[str] = None):
+        trax.TrackDB.load_from_location(self, location)
+        # the library locations refer to the tracks that were replaced
+        self._library_locations = None
+
+    def get_library_locations(self, library: 'Library') -> Set[str]:
+        """
+        Returns the locations of the tracks in this collection that are
+        inside *library*.
+
+        The locations of all libraries are collected in a single pass over
+        the collection on first use and kept up to date from then on.
+
+        :returns: a set that must not be modified
+        """
+        if self._library_locations is None:
+            prefixes = {loc: _library_prefix(loc) for loc in self.libraries}
+            library_locations = {loc: set() for loc in prefixes}
+            for trloc in self.tracks:
+                for loc, prefix in prefixes.items():
+                    if trloc.startswith(prefix):
+                        library_locations[loc].add(trloc)
+            self._library_locations = library_locations
+        return self._library_locations.get(library.location, set())
+
+    def _on_tracks_added(self, type, collection, locations):
+        library_locations = self._library_locations
+        if library_locations is None:
+            return
+        for loc, trlocs in library_locations.items():
+            prefix = _library_prefix(loc)
+            trlocs.update(trloc for trloc in locations if trloc.startswith(prefix))
+
+    def _on_tracks_removed(self, type, collection, locations):
+        library_locations = self._library_locations
+        if library_locations is None:
+            return
+        for trlocs in library_locations.values():
+            trlocs.difference_update(locations)
 
     def freeze_libraries(self) -> None:
         """
@@ -177,6 +250,7 @@ class Collection(trax.TrackDB):
         if loc not in self.libraries:
             self.libraries[loc] = library
             library.set_collection(self)
+            self._library_locations = None
         self.serialize_libraries()
         self._dirty = True
 
@@ -195,6 +269,7 @@ class Collection(trax.TrackDB):
             if v == library:
                 del self.libraries[k]
                 break
+        self._library_locations = None
 
         to_rem = []
         if "://" not in library.location:
@@ -320,6 +395,7 @@ class Collection(trax.TrackDB):
             l['realtime'] = v.monitored
             l['scan_interval'] = v.scan_interval
             l['startup_scan'] = v.startup_scan
+            l['file_based_compilations'] = v._scanned_compilations
             _serial_libraries.append(l)
         return _serial_libraries
 
@@ -330,14 +406,14 @@ class Collection(trax.TrackDB):
         Should only be called once, from the constructor.
         """
         for l in _serial_libraries:
-            self.add_library(
-                Library(
-                    l['location'],
-                    l.get('monitored', l.get('realtime')),
-                    l['scan_interval'],
-                    l.get('startup_scan', True),
-                )
+            library = Library(
+                l['location'],
+                l.get('monitored', l.get('realtime')),
+                l['scan_interval'],
+                l.get('startup_scan', True),
             )
+            library._scanned_compilations = l.get('file_based_compilations')
+            self.add_library(library)
 
     _serial_libraries = property(serialize_libraries, unserialize_libraries)
 
@@ -346,8 +422,8 @@ class Collection(trax.TrackDB):
         close the collection. does any work like saving to disk,
         closing network connections, etc.
         """
-        # TODO: make close() part of trackdb
         COLLECTIONS.remove(self)
+        trax.TrackDB.close(self)
 
     def delete_tracks(self, tracks: Iterable[trax.Track]) -> None:
         for tr in tracks:
@@ -439,9 +515,9 @@ class LibraryMonitor(GObject.Object):
     def __process_change_queue(self, gfile):
         if gfile in self.__queue:
             if gfile.query_exists():  # Make sure path still exists.
-                added_tracks = trax.util.get_tracks_from_uri(gfile.get_uri())
-                for tr in added_tracks:
-                    tr.read_tags()
+                added_tracks = trax.util.get_tracks_from_uris(
+                    [gfile.get_uri()], reread=True
+                )
                 self.__library.collection.add_tracks(added_tracks)
             del self.__queue[gfile]
 
@@ -559,6 +635,9 @@ class Library:
         self.scan_id = None
         self.scanning = False
         self._startup_scan = startup_scan
+        #: value of collection/file_based_compilations during the last
+        #: complete scan, None if unknown
+        self._scanned_compilations: Optional[bool] = None
         self.monitor = LibraryMonitor(self)
         self.monitor.props.monitored = monitored
 
@@ -669,7 +748,7 @@ class Library:
         :param tr: the track to check
         """
         # check for compilations
-        if not settings.get_option('collection/file_based_compilations', True):
+        if not _FILE_BASED_COMPILATIONS.value:
             return
 
         def joiner(value):
@@ -764,56 +843,21 @@ class Library:
         libloc = Gio.File.new_for_uri(self.location)
 
         count = 0
-        dirtracks = deque()
-        compilations = deque()
-        ccheck = {}
-        for fil in common.walk(libloc):
+        scanner = _LibraryScanner(self, force_update)
+        for fil, info in common.walk_info(libloc):
             count += 1
-            type = fil.query_info(
-                "standard::type", Gio.FileQueryInfoFlags.NONE, None
-            ).get_file_type()
+            if info is None:
+                info = fil.query_info(
+                    "standard::type", Gio.FileQueryInfoFlags.NONE, None
+                )
+            type = info.get_file_type()
             if type == Gio.FileType.DIRECTORY:
-                if dirtracks:
-                    for tr in dirtracks:
-                        self._check_compilation(ccheck, compilations, tr)
-                    for basedir, album in compilations:
-                        base = basedir.replace('"', '\\"')
-                        alb = album.replace('"', '\\"')
-                        items = [
-                            tr
-                            for tr in dirtracks
-                            if tr.get_tag_raw('__basedir') == base and
-                            # FIXME: this is ugly
-                            alb in "".join(tr.get_tag_raw('album') or []).lower()
-                        ]
-                        for item in items:
-                            item.set_tag_raw('__compilation', (basedir, album))
-                dirtracks = deque()
-                compilations = deque()
-                ccheck = {}
+                scanner.add_directory()
             elif type == Gio.FileType.REGULAR:
-                tr = self.update_track(fil, force_update=force_update)
-                if not tr:
-                    continue
-
-                if dirtracks is not None:
-                    dirtracks.append(tr)
-                    # do this so that if we have, say, a 4000-song folder
-                    # we dont get bogged down trying to keep track of them
-                    # for compilation detection. Most albums have far fewer
-                    # than 110 tracks anyway, so it is unlikely that this
-                    # restriction will affect the heuristic's accuracy.
-                    # 110 was chosen to accommodate "top 100"-style
-                    # compilations.
-                    if len(dirtracks) > 110:
-                        logger.debug(
-                            "Too many files, skipping "
-                            "compilation detection heuristic for %s",
-                            fil.get_uri(),
-                        )
-                        dirtracks = None
+                scanner.add_file(fil, info)
 
             if self.collection and self.collection._scan_stopped:
+                scanner.cancel()
                 self.scanning = False
                 logger.info("Scan canceled")
                 return False
@@ -822,30 +866,27 @@ class Library:
             if notify_interval is not None and count % notify_interval == 0:
                 event.log_event('tracks_scanned', self, count)
 
+        scanner.finish()
+        self._scanned_compilations = _FILE_BASED_COMPILATIONS.value
+
         # final progress update
         if notify_interval is not None:
             event.log_event('tracks_scanned', self, count)
 
-        removals = deque()
-        for tr in self.collection.tracks.values():
-            tr = tr._track
-            loc = tr.get_loc_for_io()
-            if not loc:
+        # Only tracks of this library that the walk did not see can be gone
+        removals = []
+        missing = self.collection.get_library_locations(self) - scanner.locations
+        for loc in missing:
+            tr = self.collection.get_track_by_loc(loc)
+            if tr is None:
                 continue
             gloc = Gio.File.new_for_uri(loc)
-            try:
-                if not gloc.has_prefix(libloc):
-                    continue
-            except UnicodeDecodeError:
-                logger.exception("Error decoding file location")
-                continue
-
             if not (gloc.query_exists(None) or tr.is_supported()):
+                logger.debug("Removing %s", tr)
                 removals.append(tr)
 
-        for tr in removals:
-            logger.debug("Removing %s", tr)
-            self.collection.remove(tr)
+        if removals:
+            self.collection.remove_tracks(removals)
 
         logger.info("Scan completed: %s", self.location)
         self.scanning = False
@@ -857,10 +898,7 @@ class Library:
         collection
         """
         oldgloc = Gio.File.new_for_uri(loc)
-
-        newgloc = Gio.File.new_for_uri(self.location).resolve_relative_path(
-            oldgloc.get_basename()
-        )
+        newgloc = self.get_destination(oldgloc)
 
         if move:
             oldgloc.move(newgloc)
@@ -870,6 +908,14 @@ class Library:
         if tr._scan_valid:
             self.collection.add(tr)
 
+    def get_destination(self, gloc: Gio.File) -> Gio.File:
+        """
+        Returns where `add` puts a file in the library
+        """
+        return Gio.File.new_for_uri(self.location).resolve_relative_path(
+            gloc.get_basename()
+        )
+
     def delete(self, loc: str) -> None:
         """
         Deletes a file from the disk
@@ -886,13 +932,287 @@ class Library:
                 logger.warning("Could not delete file %s.", loc)
 
 
+class _LibraryScanner:
+    """
+    Reads the tags of the files found by `Library.rescan` on a pool of
+    worker threads.
+
+    Files are handed to the workers in walk order and their results are
+    merged back in the same order on the scanning thread, so tracks and the
+    collection are only ever modified from one thread. At most
+    `max_pending` files are in flight at any time, which bounds memory use
+    when the walk is much faster than reading tags.
+    """
+
+    #: New tracks are added to the collection in batches of this size
+    batch_size = 200
+
+    def __init__(self, library: Library, force_update: bool = False):
+        self.library = library
+        self.collection = library.collection
+        self.force_update = force_update
+
+        workers = settings.get_option('collection/scan_workers', 0)
+        if workers <= 0:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='LibraryScan'
+        )
+        self.max_pending = workers * 4
+
+        # Scanned files as (uri, track, future) and directory boundaries
+        # as None, in walk order
+        self.pending: Deque[Optional[Tuple[str, Optional[trax.Track], Future]]]
+        self.pending = deque()
+        self.dirtracks: Optional[Deque[trax.Track]] = deque()
+        self.dirchanged = False
+        # Compilations are normally only detected in directories with
+        # changed files; a different setting needs all of them checked.
+        self.recheck_compilations = (
+            library._scanned_compilations != _FILE_BASED_COMPILATIONS.value
+        )
+        self.new_tracks: List[trax.Track] = []
+        #: locations of all files seen by the walk
+        self.locations: Set[str] = set()
+
+    def add_directory(self) -> None:
+        """
+        Marks the start of a new directory in the walk
+        """
+        self.pending.append(None)
+        self._drain(self.max_pending)
+
+    def add_file(self, gloc: Gio.File, info: Optional[Gio.FileInfo] = None) -> None:
+        """
+        Queues a file for reading
+
+        :param info: the file information from `common.walk_info`
+        """
+        uri = gloc.get_uri()
+        if not uri:  # we get segfaults if this check is removed
+            return
+        self.locations.add(uri)
+
+        tr = self.collection.get_track_by_loc(uri)
+        modified = None
+        hint = None
+        if tr is not None:
+            hint = tr.get_tag_raw('__format')
+            if not self.force_update:
+                if info is None:
+                    modified = tr.get_tag_raw('__modified') or 0
+                elif self._unchanged(tr, info):
+                    # known and unchanged, don't even open the file
+                    self.pending.append((uri, tr, None))
+                    self._drain(self.max_pending)
+                    return
+
+        future = self.executor.submit(metadata.read_tags, uri, modified, info, hint)
+        self.pending.append((uri, tr, future))
+        self._drain(self.max_pending)
+
+    @staticmethod
+    def _unchanged(tr: trax.Track, info: Gio.FileInfo) -> bool:
+        """
+        Whether the file behind a track matches what the collection knows
+        about it, judging only by its modification time and size
+        """
+        modified = tr.get_tag_raw('__modified')
+        if not modified:
+            return False
+        if modified < info.get_modification_date_time().to_unix():
+            return False
+        # tracks scanned before sizes were recorded only have the mtime
+        size = tr.get_tag_raw('__filesize')
+        return size is None or size == info.get_size()
+
+    def finish(self) -> None:
+        """
+        Waits for all queued files and adds the new tracks to the collection
+        """
+        self.pending.append(None)
+        self._drain(0)
+        self._add_new_tracks()
+        self.executor.shutdown()
+
+    def cancel(self) -> None:
+        """
+        Drops all queued files; tracks merged so far are kept
+        """
+        for item in self.pending:
+            # unchanged files are queued without a future
+            if item is not None and item[2] is not None:
+                item[2].cancel()
+        self.pending.clear()
+        self._add_new_tracks()
+        self.executor.shutdown()
+
+    def _drain(self, limit: int) -> None:
+        pending = self.pending
+        if len(pending) <= limit:
+            return
+        # Merge a good chunk at once, so that its events can be coalesced
+        limit //= 2
+        with event.batch():
+            while len(pending) > limit:
+                item = pending.popleft()
+                if item is None:
+                    self._end_directory()
+                else:
+                    self._merge(*item)
+
+    def _merge(
+        self, uri: str, tr: Optional[trax.Track], future: Optional[Future]
+    ) -> None:
+        if future is None:
+            # unchanged track, see add_file
+            self._add_dirtrack(tr, changed=False)
+            return
+
+        new = tr is None
+        if new:
+            tr = trax.Track(uri, scan=False)
+            if not tr._init:
+                # Track already existed. This fixes trax.get_tracks_from_uri
+                # on windows, unknown why fix isn't needed on linux.
+                self.new_tracks.append(tr)
+                new = False
+
+        try:
+            f, ntags = future.result()
+            # notify isn't needed for new tracks
+            tr._apply_file(f, ntags, notify_changed=not new)
+        except Exception:
+            tr._scan_valid = False
+            logger.exception("Error reading tags for %s", uri)
+
+        if new and tr._scan_valid:
+            self.new_tracks.append(tr)
+
+        if tr.is_supported():
+            self._add_dirtrack(tr, changed=True)
+
+    def _add_dirtrack(self, tr: trax.Track, changed: bool) -> None:
+        if changed:
+            self.dirchanged = True
+        if self.dirtracks is not None:
+            self.dirtracks.append(tr)
+            # do this so that if we have, say, a 4000-song folder
+            # we dont get bogged down trying to keep track of them
+            # for compilation detection. Most albums have far fewer
+            # than 110 tracks anyway, so it is unlikely that this
+            # restriction will affect the heuristic's accuracy.
+            # 110 was chosen to accommodate "top 100"-style
+            # compilations.
+            if len(self.dirtracks) > 110:
+                logger.debug(
+                    "Too many files, skipping "
+                    "compilation detection heuristic for %s",
+                    tr.get_loc_for_io(),
+                )
+                self.dirtracks = None
+
+    def _end_directory(self) -> None:
+        dirtracks = self.dirtracks
+        # compilations in directories without changes were already detected
+        # by an earlier scan, unless the compilation setting changed since.
+        # Tag changes that keep the mtime and size are only picked up by a
+        # rescan with force_update.
+        if dirtracks and (self.dirchanged or self.recheck_compilations):
+            compilations = deque()
+            ccheck = {}
+            for tr in dirtracks:
+                self.library._check_compilation(ccheck, compilations, tr)
+            for basedir, album in compilations:
+                base = basedir.replace('"', '\\"')
+                alb = album.replace('"', '\\"')
+                items = [
+                    tr
+                    for tr in dirtracks
+                    if tr.get_tag_raw('__basedir') == base and
+                    # FIXME: this is ugly
+                    alb in "".join(tr.get_tag_raw('album') or []).lower()
+                ]
+                for item in items:
+                    item.set_tag_raw('__compilation', (basedir, album))
+        self.dirtracks = deque()
+        self.dirchanged = False
+
+        if len(self.new_tracks) >= self.batch_size:
+            self._add_new_tracks()
+
+    def _add_new_tracks(self) -> None:
+        if self.new_tracks:
+            self.collection.add_tracks(self.new_tracks)
+            self.new_tracks = []
+
+
+class TransferProgress(NamedTuple):
+    """
+    Progress of a `TransferQueue.transfer`
+    """
+
+    #: bytes copied or skipped so far
+    bytes_done: int
+    #: bytes of all queued files
+    bytes_total: int
+    #: number of files finished, including skipped ones
+    files_done: int
+    #: number of files that were already identical in the library
+    files_skipped: int
+    #: bytes copied per second
+    throughput: float
+    #: estimated number of seconds left, None if unknown
+    eta: Optional[float]
+
+
+class _Transfer:
+    """
+    One file copied by a `TransferQueue`
+    """
+
+    __slots__ = ['source', 'destination', 'size', 'copied']
+
+    def __init__(self, source: Gio.File, destination: Gio.File, size: int):
+        self.source = source
+        self.destination = destination
+        self.size = size
+        #: bytes copied so far
+        self.copied = 0
+
+
 class TransferQueue:
-    def __init__(self, library: Library):
+    """
+    Copies tracks into a library, e.g. to sync them to a device.
+
+    Several files are copied at once, files that are already in the library
+    are skipped, and the tags of the copied files are read concurrently
+    once all copies are done.
+    """
+
+    #: Seconds between progress events
+    progress_interval = 0.25
+
+    def __init__(
+        self, library: Library, workers: Optional[int] = None, compare: str = 'mtime'
+    ):
+        """
+        :param workers: number of files copied at once; defaults to the
+            ``collection/transfer_workers`` setting
+        :param compare: how to tell if a file is already in the library:
+            ``'mtime'`` compares sizes and modification times, ``'hash'``
+            compares the contents, and ``None`` always copies
+        """
         self.library = library
         self.queue: List[trax.Track] = []
         self.current_pos = -1
         self.transferring = False
+        self.workers = workers
+        self.compare = compare
         self._stop = False
+        self._cancellable = Gio.Cancellable()
+        self._lock = threading.Lock()
+        self._progress = TransferProgress(0, 0, 0, 0, 0.0, None)
 
     def enqueue(self, tracks: Iterable[trax.Track]) -> None:
         self.queue.extend(tracks)
@@ -909,6 +1229,12 @@ class TransferQueue:
             except ValueError:
                 pass
 
+    def get_progress(self) -> TransferProgress:
+        """
+        Returns the progress of the current (or last) transfer
+        """
+        return self._progress
+
     def transfer(self) -> None:
         """
         Transfer the queued tracks to the library.
@@ -916,18 +1242,10 @@ class TransferQueue:
         This is NOT asynchronous
         """
         self.transferring = True
-        self.current_pos += 1
+        self.current_pos = 0
+        self._cancellable = Gio.Cancellable()
         try:
-            while self.current_pos < len(self.queue) and not self._stop:
-                track = self.queue[self.current_pos]
-                loc = track.get_loc_for_io()
-                self.library.add(loc)
-
-                # TODO: make this be based on filesize not count
-                progress = self.current_pos * 100 / len(self.queue)
-                event.log_event('track_transfer_progress', self, progress)
-
-                self.current_pos += 1
+            self._transfer()
         finally:
             self.queue = []
             self.transferring = False
@@ -935,9 +1253,193 @@ class TransferQueue:
             self._stop = False
             event.log_event('track_transfer_progress', self, 100)
 
+    def _transfer(self) -> None:
+        workers = self.workers
+        if workers is None:
+            workers = settings.get_option('collection/transfer_workers', 2)
+        workers = max(1, workers)
+
+        transfers = []
+        skipped = []
+        destinations = set()
+        bytes_total = bytes_skipped = 0
+        for track in self.queue:
+            if self._stop:
+                # don't start copies that would be cancelled right away
+                transfers = []
+                break
+            source = Gio.File.new_for_uri(track.get_loc_for_io())
+            try:
+                info = source.query_info(
+                    "time::modified,standard::size", Gio.FileQueryInfoFlags.NONE, None
+                )
+            except GLib.Error:
+                logger.warning("Cannot transfer %s", source.get_uri(), exc_info=True)
+                continue
+            item = _Transfer(
+                source, self.library.get_destination(source), info.get_size()
+            )
+            destination = item.destination.get_uri()
+            if destination in destinations:
+                # files with the same name from different folders would
+                # overwrite each other
+                logger.warning(
+                    "Not transferring %s, another file is copied to %s",
+                    source.get_uri(),
+                    destination,
+                )
+                continue
+            destinations.add(destination)
+            bytes_total += item.size
+            if self._is_identical(item, info):
+                skipped.append(item.destination.get_uri())
+                bytes_skipped += item.size
+            else:
+                transfers.append(item)
+
+        start = time.monotonic()
+        copied = []
+        done = 0
+
+        def update(final=False):
+            with self._lock:
+                bytes_copied = sum(item.copied for item in transfers)
+            elapsed = time.monotonic() - start
+            throughput = bytes_copied / elapsed if elapsed > 0 else 0.0
+            bytes_done = bytes_skipped + bytes_copied
+            eta = None
+            if throughput > 0:
+                eta = (bytes_total - bytes_done) / throughput
+            self._progress = TransferProgress(
+                bytes_done,
+                bytes_total,
+                len(skipped) + done,
+                len(skipped),
+                throughput,
+                eta,
+            )
+            if not final and bytes_total:
+                progress = bytes_done * 100 / bytes_total
+                # 100 means done
+                event.log_event('track_transfer_progress', self, min(progress, 99.9))
+
+        update()
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='TrackTransfer'
+        ) as executor:
+            pending = {executor.submit(self._copy, item): item for item in transfers}
+            try:
+                while pending and not self._stop:
+                    finished, _notfinished = wait(
+                        pending, self.progress_interval, FIRST_COMPLETED
+                    )
+                    for future in finished:
+                        item = pending.pop(future)
+                        done += 1
+                        self.current_pos = len(skipped) + done
+                        if future.result():
+                            copied.append(item.destination.get_uri())
+                    update()
+            finally:
+                if pending:
+                    self._cancellable.cancel()
+                    for future in pending:
+                        future.cancel()
+        update(final=True)
+
+        # Read the tags of all new files at once, and add them in one go
+        tracks = [trax.Track(uri, scan=False) for uri in copied]
+        trax.util.read_tracks_tags(tracks)
+        collection = self.library.collection
+        known = [
+            trax.Track(uri, scan=False)
+            for uri in skipped
+            if collection.get_track_by_loc(uri) is None
+        ]
+        trax.util.read_tracks_tags(known, force=False)
+        collection.add_tracks(tr for tr in tracks + known if tr._scan_valid)
+
+    def _is_identical(self, item: _Transfer, info: Gio.FileInfo) -> bool:
+        """
+        Whether the destination of *item* already has the same contents
+        """
+        if self.compare is None:
+            return False
+        try:
+            dinfo = item.destination.query_info(
+                "time::modified,standard::size", Gio.FileQueryInfoFlags.NONE, None
+            )
+        except GLib.Error:
+            return False  # probably doesn't exist
+        if dinfo.get_size() != item.size:
+            return False
+        if self.compare == 'hash':
+            # a file that can't be read, e.g. because the transfer was
+            # cancelled, is never identical
+            digest = self._hash(item.source)
+            return digest is not None and digest == self._hash(item.destination)
+        mtime = info.get_modification_date_time()
+        dmtime = dinfo.get_modification_date_time()
+        if mtime is None or dmtime is None:
+            return False
+        # copies keep the modification time of the source; allow for the
+        # 2 second resolution of FAT file systems
+        return dmtime.to_unix() >= mtime.to_unix() - 2
+
+    def _hash(self, gloc: Gio.File) -> Optional[bytes]:
+        digest = hashlib.sha1()
+        try:
+            stream = gloc.read(self._cancellable)
+            try:
+                while True:
+                    data = stream.read_bytes(65536, self._cancellable).get_data()
+                    if not data:
+                        break
+                    digest.update(data)
+            finally:
+                stream.close(None)
+        except GLib.Error:
+            return None
+        return digest.digest()
+
+    def _copy(self, item: _Transfer) -> bool:
+        """
+        Copies one file; runs on a worker thread
+
+        :returns: whether the file was copied
+        """
+
+        def on_progress(current, total, *_args):
+            with self._lock:
+                item.copied = current
+
+        try:
+            item.source.copy(
+                item.destination,
+                Gio.FileCopyFlags.OVERWRITE | Gio.FileCopyFlags.ALL_METADATA,
+                self._cancellable,
+                on_progress,
+                None,
+            )
+        except GLib.Error as e:
+            if e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                # don't leave a partial copy behind
+                try:
+                    item.destination.delete(None)
+                except GLib.Error:
+                    pass
+            else:
+                logger.warning(
+                    "Could not copy %s: %s", item.source.get_uri(), e.message
+                )
+            return False
+        with self._lock:
+            item.copied = item.size
+        return True
+
     def cancel(self) -> None:
         """
-        Cancel the current transfer
+        Cancel the current transfer, including the files being copied
         """
-        # TODO: make this stop mid-file as well?
         self._stop = True
+        self._cancellable.cancel()
@@ -39,7 +39,7 @@ import shelve
 import subprocess
 import sys
 import threading
-from typing import Deque, Generic, Iterable, List, TypeVar
+from typing import Deque, Generic, Iterable, List, Optional, Tuple, TypeVar
 import urllib.parse
 import urllib.request
 import weakref
@@ -518,17 +518,37 @@ def walk(root: Gio.File) -> Iterable[Gio.File]:
         directory to walk through
     :returns: a generator object
     """
-    queue: Deque[Gio.File] = deque()
-    queue.append(root)
+    for fil, _info in walk_info(root):
+        yield fil
+
+
+#: Attributes of the Gio.FileInfo objects yielded by walk_info
+WALK_ATTRIBUTES = (
+    "standard::type,"
+    "standard::is-symlink,standard::name,"
+    "standard::symlink-target,standard::size,time::modified"
+)
+
+
+def walk_info(
+    root: Gio.File,
+) -> Iterable[Tuple[Gio.File, Optional[Gio.FileInfo]]]:
+    """
+    Like `walk`, but also yields the information that was fetched
+    while listing each file, so callers don't have to query it again.
+
+    :returns: a generator of (file, info) tuples; info has the
+        attributes listed in `WALK_ATTRIBUTES`, and is None for *root*
+    """
+    queue: Deque[Tuple[Gio.File, Optional[Gio.FileInfo]]] = deque()
+    queue.append((root, None))
 
     while len(queue) > 0:
-        dir = queue.pop()
-        yield dir
+        dir, dirinfo = queue.pop()
+        yield dir, dirinfo
         try:
             for fileinfo in dir.enumerate_children(
-                "standard::type,"
-                "standard::is-symlink,standard::name,"
-                "standard::symlink-target,time::modified",
+                WALK_ATTRIBUTES,
                 Gio.FileQueryInfoFlags.NONE,
                 None,
             ):
@@ -545,9 +565,9 @@ def walk(root: Gio.File) -> Iterable[Gio.File]:
                         continue
                 type = fileinfo.get_file_type()
                 if type == Gio.FileType.DIRECTORY:
-                    queue.append(fil)
+                    queue.append((fil, fileinfo))
                 elif type == Gio.FileType.REGULAR:
-                    yield fil
+                    yield fil, fileinfo
         except GLib.Error:  # why doesn't gio offer more-specific errors?
             logger.exception("Unhandled exception while walking on %s.", dir)
 
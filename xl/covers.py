@@ -32,11 +32,14 @@ as album art.
 
 from gi.repository import GLib
 from gi.repository import Gio
+from collections import Counter, OrderedDict
 import logging
 import hashlib
 import os
 import pickle
-from typing import Optional
+import sqlite3
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from xl.nls import gettext as _
 from xl import common, event, providers, settings, trax, xdg
@@ -106,9 +109,261 @@ class Cacher:
         path = os.path.join(self.cache_dir, key)
         if os.path.exists(path):
             with open(path, "rb") as fp:
-                return fp.read()
+                data = fp.read()
+            try:
+                # the modification time tracks the last use, see entries()
+                os.utime(path)
+            except OSError:
+                pass
+            return data
         return None
 
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """
+        Lists the entries in the cache.
+
+        :returns: (key, size, time of last use) of each entry
+        """
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.name, stat.st_size, stat.st_mtime))
+        except OSError:
+            pass
+        return entries
+
+
+class CoverStore:
+    """
+    Stores the cover db of a `CoverManager` in a SQLite database.
+
+    Only the entries that changed are written, instead of the whole db.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS Covers (
+                key TEXT PRIMARY KEY NOT NULL,
+                db_string TEXT NOT NULL,
+                user_set INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+            """)
+
+    def get_version(self) -> int:
+        """
+        Returns the version of the stored db, 0 if nothing was stored yet
+        """
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def load(self) -> Iterator[Tuple[str, str, bool]]:
+        """
+        :returns: generator of (key, db_string, user_set)
+        """
+        for key, db_string, user_set in self.conn.execute(
+            "SELECT key, db_string, user_set FROM Covers"
+        ):
+            yield key, db_string, bool(user_set)
+
+    def save(
+        self,
+        changes: Dict[str, Optional[Tuple[str, bool]]],
+        version: int,
+        replace: bool = False,
+    ) -> None:
+        """
+        Writes changed entries in one transaction
+
+        :param changes: key -> (db_string, user_set), or None to delete
+        :param version: the version of the db
+        :param replace: whether to drop all other entries
+        """
+        conn = self.conn
+        conn.execute("BEGIN")
+        try:
+            if replace:
+                conn.execute("DELETE FROM Covers")
+            conn.executemany(
+                "DELETE FROM Covers WHERE key = ?",
+                ((key,) for key, value in changes.items() if value is None),
+            )
+            conn.executemany(
+                "REPLACE INTO Covers VALUES (?, ?, ?)",
+                (
+                    (key, value[0], int(value[1]))
+                    for key, value in changes.items()
+                    if value is not None
+                ),
+            )
+            # PRAGMA doesn't support parameters
+            conn.execute("PRAGMA user_version = %d" % int(version))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class ThumbnailCache:
+    """
+    On-disk cache of scaled-down cover images.
+
+    Entries are keyed by the db_string of a cover and the size it was
+    scaled to. Once the cache grows over `max_size` bytes, the least
+    recently used entries are removed.
+
+    Covers read from files or tags can change while their db_string stays
+    the same, so their entries also carry a stamp of the version they
+    were made from, see `CoverManager.get_thumbnail_stamp`. Entries with
+    an outdated stamp are no longer found and age out of the cache.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        """
+        :param cache_dir: directory to use for the cache. will be
+            created if it does not exist.
+        :param max_size: maximum total size of the entries, in bytes
+        """
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # file name -> size, least recently used first; loaded on first use
+        self._entries: Optional['OrderedDict[str, int]'] = None
+        self._size = 0
+
+    @staticmethod
+    def _get_prefix(db_string: str) -> str:
+        return hashlib.sha1(db_string.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def _get_name(
+        self, db_string: str, size: Tuple[int, int], fill: bool, stamp: str
+    ) -> str:
+        name = '%s_%dx%d%s' % (
+            self._get_prefix(db_string),
+            size[0],
+            size[1],
+            'f' if fill else '',
+        )
+        if stamp:
+            name += '_' + stamp
+        return name
+
+    def _load(self) -> 'OrderedDict[str, int]':
+        if self._entries is None:
+            entries = []
+            try:
+                with os.scandir(self.cache_dir) as it:
+                    for entry in it:
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, entry.name, stat.st_size))
+            except OSError:
+                pass
+            entries.sort()
+            self._entries = OrderedDict((name, size) for _m, name, size in entries)
+            self._size = sum(self._entries.values())
+        return self._entries
+
+    def get(
+        self,
+        db_string: str,
+        size: Tuple[int, int],
+        fill: bool = False,
+        stamp: str = '',
+    ) -> Optional[bytes]:
+        """
+        Retrieve a thumbnail. Returns None if it is not cached.
+
+        :param db_string: the db_string of the cover
+        :param size: the size the cover was scaled to
+        :param fill: whether the cover was stretched to fill *size*
+        :param stamp: the version of the cover the thumbnail must be
+            made from
+        """
+        name = self._get_name(db_string, size, fill, stamp)
+        with self._lock:
+            entries = self._load()
+            if name not in entries:
+                return None
+            entries.move_to_end(name)
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            # remember the use across restarts
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._size -= entries.pop(name, 0)
+            return None
+        return data
+
+    def add(
+        self,
+        db_string: str,
+        size: Tuple[int, int],
+        data: bytes,
+        fill: bool = False,
+        stamp: str = '',
+    ) -> None:
+        """
+        Stores a thumbnail, evicting old ones if the cache is full
+
+        :param data: the scaled image
+        """
+        name = self._get_name(db_string, size, fill, stamp)
+        try:
+            with open(os.path.join(self.cache_dir, name), 'wb') as fp:
+                fp.write(data)
+        except OSError:
+            logger.warning("Could not store cover thumbnail", exc_info=True)
+            return
+        with self._lock:
+            entries = self._load()
+            self._size += len(data) - entries.pop(name, 0)
+            entries[name] = len(data)
+            evicted = []
+            while self._size > self.max_size and len(entries) > 1:
+                oldname, oldsize = entries.popitem(last=False)
+                self._size -= oldsize
+                evicted.append(oldname)
+        for oldname in evicted:
+            self._remove_file(oldname)
+
+    def remove(self, db_string: str) -> None:
+        """
+        Removes the thumbnails of a cover in all sizes
+        """
+        prefix = self._get_prefix(db_string) + '_'
+        with self._lock:
+            entries = self._load()
+            names = [name for name in entries if name.startswith(prefix)]
+            for name in names:
+                self._size -= entries.pop(name)
+        for name in names:
+            self._remove_file(name)
+
+    def _remove_file(self, name: str) -> None:
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
 
 class CoverManager(providers.ProviderHandler):
     """
@@ -123,10 +378,27 @@ class CoverManager(providers.ProviderHandler):
         """
         providers.ProviderHandler.__init__(self, "covers")
         self.__cache = Cacher(os.path.join(location, 'cache'))
+        #: Scaled-down covers, see `ThumbnailCache`
+        self.thumbnails = ThumbnailCache(
+            os.path.join(location, 'thumbnails'),
+            settings.get_option('covers/thumbnail_cache_size', 32) * 1024 * 1024,
+        )
         self.location = location
         self.methods = {}
         self.order = settings.get_option('covers/preferred_order', [])
         self.db = {'version': self.DB_VERSION}
+        # Guards db and the bookkeeping below, which are changed from
+        # cover fetching threads
+        self._db_lock = threading.RLock()
+        # keys of covers chosen by the user, which are never evicted
+        self._user_set: Set[str] = set()
+        # cache key -> number of db entries using it
+        self._refs: Counter = Counter()
+        # key -> (db_string, user_set) or None, not saved yet
+        self._changes: Dict[str, Optional[Tuple[str, bool]]] = {}
+        # the db as last saved, a different object means a full save
+        self._saved_db = None
+        self._store: Optional[CoverStore] = None
         self.load()
         for method in self.get_providers():
             self.on_provider_added(method)
@@ -143,6 +415,7 @@ class CoverManager(providers.ProviderHandler):
             providers.register('covers', self.localfile_fetcher)
 
         event.add_callback(self._on_option_set, 'covers_option_set')
+        self._timeout_collect_garbage()
 
     def _on_option_set(self, name, obj, data):
         if data == "covers/use_tags":
@@ -277,7 +550,7 @@ class CoverManager(providers.ProviderHandler):
                 break
         return covers
 
-    def set_cover(self, track, db_string, data=None):
+    def set_cover(self, track, db_string, data=None, user_set=True):
         """
         Sets the cover for a track. This will overwrite any existing
         entry.
@@ -287,16 +560,28 @@ class CoverManager(providers.ProviderHandler):
                 cover, in "method:key" format.
         :param data: The raw cover data to store for the track.  Will
                 only be stored if the method has use_cache=True
+        :param user_set: Whether the cover was chosen by the user, rather
+                than found automatically. Only automatically found covers
+                are evicted when the cache grows too large.
         """
+        key = self._get_track_key(track)
         name = db_string.split(":", 1)[0]
         method = self.methods.get(name)
-        if method and method.use_cache and data:
-            db_string = "cache:%s" % self.__cache.add(data)
-        key = self._get_track_key(track)
-        if key:
+        with self._db_lock:
+            if method and method.use_cache and data:
+                db_string = "cache:%s" % self.__cache.add(data)
+            if not key:
+                return
+            self._ref(db_string)
+            self._unref(self.db.get(key))
             self.db[key] = db_string
-            self.timeout_save()
-            event.log_event('cover_set', self, track)
+            if user_set:
+                self._user_set.add(key)
+            else:
+                self._user_set.discard(key)
+            self._changes[key] = (db_string, user_set)
+        self.timeout_save()
+        event.log_event('cover_set', self, track)
 
     def remove_cover(self, track):
         """
@@ -307,14 +592,109 @@ class CoverManager(providers.ProviderHandler):
         key = self._get_track_key(track)
         if key is None:
             return
-        db_string = self.get_db_string(track)
-        if db_string is None:
-            return
-        del self.db[key]
-        self.__cache.remove(db_string)
+        with self._db_lock:
+            db_string = self.db.pop(key, None)
+            if db_string is None:
+                return
+            self._user_set.discard(key)
+            self._changes[key] = None
+            self._unref(db_string)
         self.timeout_save()
         event.log_event('cover_removed', self, track)
 
+    def _count_refs(self) -> None:
+        self._refs = Counter(
+            db_string[6:]
+            for key, db_string in self.db.items()
+            if key != 'version' and db_string.startswith('cache:')
+        )
+
+    def _ref(self, db_string: str) -> None:
+        if db_string.startswith('cache:'):
+            self._refs[db_string[6:]] += 1
+
+    def _unref(self, db_string: Optional[str]) -> None:
+        """
+        Drops a reference to a cached cover, removing it once unused
+        """
+        if db_string is None or not db_string.startswith('cache:'):
+            return
+        cachekey = db_string[6:]
+        self._refs[cachekey] -= 1
+        if self._refs[cachekey] <= 0:
+            del self._refs[cachekey]
+            self._remove_cached(cachekey)
+
+    def _remove_cached(self, cachekey: str) -> None:
+        """
+        Removes a cached cover and its thumbnails
+        """
+        self.__cache.remove(cachekey)
+        self.thumbnails.remove('cache:' + cachekey)
+
+    @common.glib_wait_seconds(3600)
+    def _timeout_collect_garbage(self):
+        """Collect garbage every hour"""
+        self.collect_garbage()
+        return True
+
+    def collect_garbage(self) -> int:
+        """
+        Removes cached covers that are not used by any entry of the db.
+
+        If the cache is larger than the ``covers/cache_size`` setting (in
+        MiB, 0 means unlimited), the least recently used covers that were
+        found automatically are removed as well, along with their entries,
+        so they will be searched for again when needed.
+
+        :returns: the number of covers removed
+        """
+        max_size = settings.get_option('covers/cache_size', 256) * 1024 * 1024
+        removed = 0
+        with self._db_lock:
+            if self.db.get('version', 1) < self.DB_VERSION:
+                return 0  # keys are still being migrated
+            entries = []
+            total = 0
+            for cachekey, size, used in self.__cache.entries():
+                if cachekey in self._refs:
+                    entries.append((used, cachekey, size))
+                    total += size
+                else:
+                    self._remove_cached(cachekey)
+                    removed += 1
+
+            if max_size <= 0 or total <= max_size:
+                return removed
+
+            # cache key -> db keys, and the covers that must be kept
+            users: Dict[str, List[str]] = {}
+            pinned = set()
+            for key, db_string in self.db.items():
+                if key == 'version' or not db_string.startswith('cache:'):
+                    continue
+                users.setdefault(db_string[6:], []).append(key)
+                if key in self._user_set:
+                    pinned.add(db_string[6:])
+
+            entries.sort()
+            for _used, cachekey, size in entries:
+                if total <= max_size:
+                    break
+                if cachekey in pinned:
+                    continue
+                for key in users.get(cachekey, ()):
+                    del self.db[key]
+                    self._changes[key] = None
+                del self._refs[cachekey]
+                self._remove_cached(cachekey)
+                total -= size
+                removed += 1
+        if removed:
+            logger.info("Removed %d unused covers from the cache", removed)
+            self.timeout_save()
+        return removed
+
     def get_cover(self, track, save_cover=True, set_only=False, use_default=False):
         """
         get the cover for a given track.
@@ -346,7 +726,7 @@ class CoverManager(providers.ProviderHandler):
             cover = covers[0]
             data = self.get_cover_data(cover, use_default=use_default)
             if save_cover and data != self.get_default_cover():
-                self.set_cover(track, cover, data)
+                self.set_cover(track, cover, data, user_set=False)
             return data
 
         return self.get_default_cover() if use_default else None
@@ -371,6 +751,33 @@ class CoverManager(providers.ProviderHandler):
             ret = self.get_default_cover()
         return ret
 
+    def get_thumbnail_stamp(self, db_string: str) -> Optional[str]:
+        """
+        Returns what identifies the current version of a cover, for the
+        thumbnail cache, or None if its thumbnails can't be cached.
+
+        Cached covers never change. Other covers are identified by the
+        modification time and size of the file they are read from, see
+        `CoverSearchMethod.get_cover_source`.
+        """
+        source, data = db_string.split(":", 1)
+        if source == "cache":
+            return ''
+        get_cover_source = getattr(self.methods.get(source), 'get_cover_source', None)
+        uri = get_cover_source(data) if get_cover_source else None
+        if uri is None:
+            return None
+        try:
+            info = Gio.File.new_for_uri(uri).query_info(
+                "time::modified,standard::size", Gio.FileQueryInfoFlags.NONE, None
+            )
+        except GLib.Error:
+            return None
+        mtime = info.get_modification_date_time()
+        if mtime is None:
+            return None
+        return '%d-%d' % (mtime.to_unix(), info.get_size())
+
     def get_default_cover(self):
         """
         Get the raw image data for the cover to show if there is no
@@ -383,6 +790,39 @@ class CoverManager(providers.ProviderHandler):
         """
         Load the saved db
         """
+        try:
+            self._store = CoverStore(os.path.join(self.location, 'covers.sqlite'))
+            version = self._store.get_version()
+        except sqlite3.Error:
+            logger.exception("Could not open the cover database")
+            self._store = None
+            version = 0
+
+        if version:
+            self.db = db = {'version': version}
+            for key, db_string, user_set in self._store.load():
+                db[key] = db_string
+                if user_set:
+                    self._user_set.add(key)
+            self._saved_db = db
+        else:
+            # not converted from the pickled db yet
+            self._load_pickle()
+
+        self._count_refs()
+
+        version = self.db.get('version', 1)
+        if version > self.DB_VERSION:
+            logger.error(
+                "covers.db version (%s) higher than supported (%s); using anyway",
+                version,
+                self.DB_VERSION,
+            )
+
+    def _load_pickle(self):
+        """
+        Load the db saved by older versions
+        """
         path = os.path.join(self.location, 'covers.db')
         data = None
         for loc in [path, path + ".old", path + ".new"]:
@@ -400,13 +840,6 @@ class CoverManager(providers.ProviderHandler):
                 break
         if data:
             self.db = data
-        version = self.db.get('version', 1)
-        if version > self.DB_VERSION:
-            logger.error(
-                "covers.db version (%s) higher than supported (%s); using anyway",
-                version,
-                self.DB_VERSION,
-            )
 
     @common.glib_wait_seconds(60)
     def timeout_save(self):
@@ -414,23 +847,37 @@ class CoverManager(providers.ProviderHandler):
 
     def save(self):
         """
-        Save the db
+        Save the db. Only entries that changed since the last save are
+        written, unless the whole db was replaced.
         """
-        path = os.path.join(self.location, 'covers.db')
-        try:
-            with open(path + ".new", 'wb') as f:
-                pickle.dump(self.db, f, common.PICKLE_PROTOCOL)
-        except IOError:
+        if self._store is None:
             return
-        try:
-            os.rename(path, path + ".old")
-        except OSError:
-            pass  # if it doesn'texist we don't care
-        os.rename(path + ".new", path)
-        try:
-            os.remove(path + ".old")
-        except OSError:
-            pass
+        with self._db_lock:
+            version = self.db.get('version', 1)
+            if version < self.DB_VERSION:
+                # keys of old versions cannot be stored; they are kept in
+                # covers.db until they are migrated
+                return
+            replace = self.db is not self._saved_db
+            if replace:
+                # the db was replaced, e.g. by a migration
+                self._count_refs()
+                changes = {
+                    key: (db_string, key in self._user_set)
+                    for key, db_string in self.db.items()
+                    if key != 'version'
+                }
+            elif self._changes:
+                changes = self._changes
+            else:
+                return
+            try:
+                self._store.save(changes, version, replace)
+            except sqlite3.Error:
+                logger.exception("Could not save the cover database")
+                return
+            self._saved_db = self.db
+            self._changes = {}
 
     def on_provider_added(self, provider):
         self.methods[provider.name] = provider
@@ -512,6 +959,17 @@ class CoverSearchMethod:
         """
         raise NotImplementedError
 
+    def get_cover_source(self, db_string):
+        """
+        Get the file a cover is read from, if any. Thumbnails of such
+        covers are cached until the file changes.
+
+        :param db_string: A method-dependent string that identifies the
+                cover.
+        :returns: the Gio URI of the file, or None
+        """
+        return None
+
 
 class TagCoverFetcher(CoverSearchMethod):
     """
@@ -554,6 +1012,9 @@ class TagCoverFetcher(CoverSearchMethod):
 
         return covers[int(index)].data
 
+    def get_cover_source(self, db_string):
+        return db_string.split(':', 2)[2]
+
 
 class LocalFileCoverFetcher(CoverSearchMethod):
     """
@@ -622,6 +1083,9 @@ class LocalFileCoverFetcher(CoverSearchMethod):
         except GLib.Error:
             return None
 
+    def get_cover_source(self, db_string):
+        return db_string
+
     def on_option_set(self, e, settings, option):
         """
         Updates the internal settings upon option change
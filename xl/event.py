@@ -37,6 +37,7 @@ Events should be emitted AFTER the given event has taken place. Often the
 most appropriate spot is immediately before a return statement.
 """
 
+import contextlib
 from inspect import ismethod
 import logging
 import re
@@ -61,6 +62,10 @@ _NONE = Nothing()  # used by event for a safe None replacement
 # Assumes that this module was imported on main thread
 _UiThread = threading.current_thread()
 
+#: Events that are coalesced inside `batch`, and the event type they are
+#: delivered as. The data of a coalesced event must be a set.
+BATCH_EVENTS = {'track_tags_changed': 'tracks_tags_changed'}
+
 
 def log_event(evty, obj, data):
     """
@@ -78,6 +83,30 @@ def log_event(evty, obj, data):
     EVENT_MANAGER.emit(e)
 
 
+def batch():
+    """
+    Returns a context manager that coalesces the events listed in
+    `BATCH_EVENTS` which are sent from the current thread while it is
+    active. Batches may be nested; events are delivered when the
+    outermost batch exits.
+
+    For every object, the data of its events is merged into one set. If
+    anything listens for the batch event, e.g. `tracks_tags_changed`,
+    it is sent once with a dict that maps each object to its merged
+    data. Afterwards, the individual events are sent with the merged
+    data, but not to the objects that listen for the batch event, since
+    they have already seen the changes.
+
+    Example::
+
+        with event.batch():
+            for track in tracks:
+                track.set_tags(genre='Jazz')
+    """
+    global EVENT_MANAGER
+    return EVENT_MANAGER.batch()
+
+
 def add_callback(function, evty=None, obj=None, *args, **kwargs):
     """
     Adds a callback to an event
@@ -175,12 +204,14 @@ class Callback:
 
     __slots__ = ['wfunction', 'time', 'args', 'kwargs']
 
-    def __init__(self, function, time, args, kwargs):
+    def __init__(self, function, time, args, kwargs, notifyDead=None):
         """
         @param function: the function to call
         @param time: the time this callback was added
+        @param notifyDead: called when the function (or the object it is
+            bound to) is garbage collected
         """
-        self.wfunction = _getWeakRef(function)
+        self.wfunction = _getWeakRef(function, notifyDead)
         self.time = time
         self.args = args
         self.kwargs = kwargs
@@ -239,6 +270,16 @@ class _WeakMethod:
         return self.objRef == weakRef
 
 
+def _getOwner(cb):
+    """
+    Returns a reference to the object a callback belongs to: the object a
+    method is bound to, or the function itself.
+    """
+    if isinstance(cb.wfunction, _WeakMethod):
+        return cb.wfunction.objRef
+    return cb.wfunction
+
+
 def _getWeakRef(obj, notifyDead=None):
     """
     Get a weak reference to obj. If obj is a bound method, a _WeakMethod
@@ -257,6 +298,32 @@ def _getWeakRef(obj, notifyDead=None):
         return createRef(obj, notifyDead)
 
 
+class EventStats:
+    """
+    Statistics about one event type, collected while profiling
+    (see `EventManager.start_profiling`)
+    """
+
+    __slots__ = ['emits', 'calls', 'time', 'callbacks']
+
+    def __init__(self):
+        #: number of times the event was sent
+        self.emits = 0
+        #: number of callbacks called
+        self.calls = 0
+        #: total wall time spent in callbacks, in seconds
+        self.time = 0.0
+        #: callback name -> [calls, time]
+        self.callbacks = {}
+
+
+def _getCallbackName(fn):
+    return '%s.%s' % (
+        getattr(fn, '__module__', None),
+        getattr(fn, '__qualname__', repr(fn)),
+    )
+
+
 class EventManager:
     """
     Manages all Events
@@ -278,12 +345,82 @@ class EventManager:
         self.pending_ui = []
         self.pending_ui_lock = threading.Lock()
 
-    def emit(self, event):
+        # per-thread state of `batch`
+        self._batches = threading.local()
+
+        # (id(callback table), event type) -> (callbacks for any object,
+        # tables to look up callbacks for specific objects in); cleared
+        # whenever callbacks are added or removed
+        self._dispatch = {}
+        # set when a callback's function has been garbage collected
+        self._prune = False
+
+        # event type -> EventStats, None unless profiling
+        self.profile = None
+        self._profile_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Coalesces events sent from the current thread, see :func:`batch`
+        """
+        state = self._batches
+        depth = getattr(state, 'depth', 0)
+        if depth == 0:
+            state.pending = {}
+        state.depth = depth + 1
+        try:
+            yield
+        finally:
+            state.depth = depth
+            if depth == 0:
+                pending = state.pending
+                state.pending = None
+                self._emit_batch(pending)
+
+    def _emit_batch(self, pending):
+        for evty, changes in pending.items():
+            batch_evty = BATCH_EVENTS[evty]
+            owners = set()
+            with self.lock:
+                tcb = self.all_callbacks.get(batch_evty)
+                if tcb is not None:
+                    for callbacks in tcb.values():
+                        for cb in callbacks:
+                            if cb.wfunction() is not None:
+                                owners.add(_getOwner(cb))
+
+            if owners:
+                self.emit(Event(batch_evty, self, changes))
+            for obj, data in changes.items():
+                self.emit(Event(evty, obj, data), owners)
+
+    def emit(self, event, skip_owners=None):
         """
         Emits an Event, calling any registered callbacks.
 
         event: the Event to emit [Event]
+        skip_owners: references to objects whose callbacks must not be
+            called, see _getOwner [set]
         """
+        profile = self.profile
+        if profile is not None:
+            with self._profile_lock:
+                try:
+                    stats = profile[event.type]
+                except KeyError:
+                    stats = profile[event.type] = EventStats()
+                stats.emits += 1
+
+        if event.type in BATCH_EVENTS:
+            pending = getattr(self._batches, 'pending', None)
+            if pending is not None:
+                changes = pending.setdefault(event.type, {})
+                try:
+                    changes[event.object].update(event.data)
+                except KeyError:
+                    changes[event.object] = set(event.data)
+                return
 
         emit_logmsg = self.use_logger and (
             not self.logger_filter or re.search(self.logger_filter, event.type)
@@ -297,18 +434,20 @@ class EventManager:
         #       UI thread
 
         if is_ui_thread:
-            self._emit(event, self.all_callbacks, emit_logmsg, emit_verbose)
+            self._emit(
+                event, self.all_callbacks, emit_logmsg, emit_verbose, skip_owners
+            )
         else:
             # Don't issue the log message twice
             with self.pending_ui_lock:
                 do_emit = not self.pending_ui
                 self.pending_ui.append(
-                    (event, self.ui_callbacks, emit_logmsg, emit_verbose)
+                    (event, self.ui_callbacks, emit_logmsg, emit_verbose, skip_owners)
                 )
 
             if do_emit:
                 GLib.idle_add(self._emit_pending)
-            self._emit(event, self.callbacks, False, emit_verbose)
+            self._emit(event, self.callbacks, False, emit_verbose, skip_owners)
 
     def _emit_pending(self):
         with self.pending_ui_lock:
@@ -318,35 +457,85 @@ class EventManager:
         for event in events:
             self._emit(*event)
 
-    def _emit(self, event, exc_callbacks, emit_logmsg, emit_verbose):
-        # Accumulate in this set to ensure callbacks only get called once
-        callbacks = set()
-
+    def _get_callbacks(self, exc_callbacks, evty, obj):
+        """
+        Returns the callbacks in *exc_callbacks* for an event
+        """
+        if self._prune:
+            self._prune_dead()
+
+        key = (id(exc_callbacks), evty)
+        entry = self._dispatch.get(key)
+        if entry is None:
+            with self.lock:
+                any_object = []
+                by_object = []
+                for tcall in (_NONE, evty):
+                    tcb = exc_callbacks.get(tcall)
+                    if tcb is None:
+                        continue
+                    ocb = tcb.get(_NONE)
+                    if ocb is not None:
+                        any_object.extend(ocb)
+                    if len(tcb) > (ocb is not None):
+                        by_object.append(tcb)
+                entry = (tuple(any_object), tuple(by_object))
+                self._dispatch[key] = entry
+
+        any_object, by_object = entry
+        if not by_object or obj is _NONE:
+            return any_object
+
+        callbacks = list(any_object)
         with self.lock:
-            for tcall in [_NONE, event.type]:
-                tcb = exc_callbacks.get(tcall)
-                if tcb is not None:
-                    for ocall in [_NONE, event.object]:
-                        ocb = tcb.get(ocall)
-                        if ocb is not None:
-                            callbacks.update(ocb)
+            for tcb in by_object:
+                ocb = tcb.get(obj)
+                if ocb is not None:
+                    callbacks.extend(ocb)
+        return callbacks
+
+    def _on_callback_dead(self, ref):
+        # Called by the garbage collector, possibly while this thread holds
+        # the lock, so only flag the callback tables for cleanup here
+        self._prune = True
+
+    def _prune_dead(self):
+        """
+        Removes callbacks whose function has been garbage collected
+        """
+        with self.lock:
+            self._prune = False
+            for cbs in (self.callbacks, self.all_callbacks, self.ui_callbacks):
+                for evty in list(cbs):
+                    tcb = cbs[evty]
+                    for obj, callbacks in list(tcb.items()):
+                        callbacks[:] = [
+                            cb for cb in callbacks if cb.wfunction() is not None
+                        ]
+                        if not callbacks:
+                            del tcb[obj]
+                    if len(tcb) == 0:
+                        del cbs[evty]
+            self._dispatch.clear()
+
+    def _emit(self, event, exc_callbacks, emit_logmsg, emit_verbose, skip_owners=None):
+        callbacks = self._get_callbacks(exc_callbacks, event.type, event.object)
 
         # However, do not actually call the callbacks from within the lock
         # -> Otherwise non-ui threads could accidentally block the UI if
         #    they decide to run for too long
 
+        profile = self.profile
         for cb in callbacks:
             try:
                 fn = cb.wfunction()
                 if fn is None:
-                    # Remove callbacks that have been garbage collected.. but
-                    # really, should be using remove_callback to clean up after
-                    # your event handler
-                    with self.lock:
-                        try:
-                            exc_callbacks[event.type][event.object].remove(cb)
-                        except (KeyError, ValueError):
-                            pass
+                    # Callbacks that have been garbage collected are
+                    # removed on the next emit.. but really, should be using
+                    # remove_callback to clean up after your event handler
+                    self._prune = True
+                elif skip_owners and _getOwner(cb) in skip_owners:
+                    pass
                 else:
                     if emit_verbose:
                         logger.debug(
@@ -354,9 +543,22 @@ class EventManager:
                             "%(function)s in response "
                             "to %(event)s." % {'function': fn, 'event': event.type}
                         )
-                    fn.__call__(
-                        event.type, event.object, event.data, *cb.args, **cb.kwargs
-                    )
+                    if profile is None:
+                        fn.__call__(
+                            event.type, event.object, event.data, *cb.args, **cb.kwargs
+                        )
+                    else:
+                        start = time.perf_counter()
+                        try:
+                            fn.__call__(
+                                event.type,
+                                event.object,
+                                event.data,
+                                *cb.args,
+                                **cb.kwargs
+                            )
+                        finally:
+                            self._record(profile, event.type, fn, start)
                 fn = None
             except Exception:
                 # something went wrong inside the function we're calling
@@ -370,6 +572,70 @@ class EventManager:
                 event.data,
             )
 
+    def _record(self, profile, evty, fn, start):
+        elapsed = time.perf_counter() - start
+        name = _getCallbackName(fn)
+        with self._profile_lock:
+            try:
+                stats = profile[evty]
+            except KeyError:
+                stats = profile[evty] = EventStats()
+            stats.calls += 1
+            stats.time += elapsed
+            try:
+                cbstats = stats.callbacks[name]
+            except KeyError:
+                cbstats = stats.callbacks[name] = [0, 0.0]
+            cbstats[0] += 1
+            cbstats[1] += elapsed
+
+    def start_profiling(self):
+        """
+        Starts counting events and timing their callbacks. This makes
+        sending events slower, so it is only meant for debugging.
+        """
+        with self._profile_lock:
+            if self.profile is None:
+                self.profile = {}
+
+    def stop_profiling(self):
+        """
+        Stops profiling.
+
+        :returns: a dict mapping each event type to its `EventStats`
+        """
+        with self._profile_lock:
+            profile = self.profile
+            self.profile = None
+        return profile or {}
+
+    def log_profile(self, limit=20):
+        """
+        Logs the event types and callbacks that took the most time since
+        profiling started
+        """
+        with self._profile_lock:
+            profile = dict(self.profile or {})
+            callbacks = [
+                (cbtime, calls, evty, name)
+                for evty, stats in profile.items()
+                for name, (calls, cbtime) in stats.callbacks.items()
+            ]
+
+        by_time = sorted(profile.items(), key=lambda item: -item[1].time)
+        logger.info("Event profile, by time spent in callbacks:")
+        for evty, stats in by_time[:limit]:
+            logger.info(
+                "%9.3fs %8d emits %8d calls  %s",
+                stats.time,
+                stats.emits,
+                stats.calls,
+                evty,
+            )
+        logger.info("Slowest event callbacks:")
+        for cbtime, calls, evty, name in sorted(callbacks, reverse=True)[:limit]:
+            logger.info("%9.3fs %8d calls  %s (%s)", cbtime, calls, name, evty)
+
     def emit_async(self, event):
         """
         Same as emit(), but does not block.
@@ -404,7 +670,8 @@ class EventManager:
             obj = _NONE
 
         with self.lock:
-            cb = Callback(function, time.time(), args, kwargs)
+            cb = Callback(function, time.time(), args, kwargs, self._on_callback_dead)
+            self._dispatch.clear()
 
             # add the specified categories if needed.
             for cbs in all_cbs:
@@ -446,6 +713,7 @@ class EventManager:
             obj = _NONE
 
         with self.lock:
+            self._dispatch.clear()
             for cbs in [self.callbacks, self.all_callbacks, self.ui_callbacks]:
                 remove = []
                 try:
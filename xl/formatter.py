@@ -31,13 +31,15 @@ preparation of data for display in various contexts.
 """
 
 from datetime import date
+import functools
 import re
-from typing import Dict, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
+import weakref
 
 from gi.repository import GLib
 from gi.repository import GObject
 
-from xl import common, providers, settings, trax
+from xl import common, event, providers, settings, trax
 from xl.common import TimeSpan
 from xl.nls import gettext as _, ngettext
 
@@ -157,6 +159,172 @@ class ParameterTemplate(metaclass=_ParameterTemplateMetaclass):
 
         return self.pattern.sub(convert, self.template)
 
+    def compile(self) -> 'CompiledTemplate':
+        """
+        Returns the template split into literal text and fields
+        """
+        return _compile_template(self.pattern, self.delimiter, self.template)
+
+
+def _parse_parameters(parameters: str) -> Dict[str, Union[bool, str]]:
+    """
+    Turns ``parameter1=argument1, parameter2`` into a dictionary
+    """
+    # Split parameters on unescaped comma
+    parts = [p.lstrip() for p in re.split(r'(?<!\\),', parameters)]
+    # Split arguments on unescaped equals sign
+    parts = [(re.split(r'(?<!\\)=', p, 1) + [True])[:2] for p in parts]
+    # Turn list of lists into a proper dictionary
+    result = dict(parts)
+
+    # Remove now obsolete escapes
+    for p in result:
+        argument = result[p]
+
+        if not isinstance(argument, bool):
+            argument = argument.replace(r'\,', ',')
+            argument = argument.replace(r'\}', '}')
+            argument = argument.replace(r'\=', '=')
+            result[p] = argument
+
+    return result
+
+
+class TemplateField:
+    """
+    An identifier found in a template, along with its parameters
+    """
+
+    __slots__ = (
+        'needle',
+        'identifier',
+        'parameters',
+        'arguments',
+        'prefix',
+        'suffix',
+        'pad',
+        'padstring',
+        'text',
+    )
+
+    def __init__(self, needle, identifier, parameters, text):
+        #: the identifier including its parameters, as written
+        self.needle = needle
+        self.identifier = identifier
+        #: all parameters
+        self.parameters = parameters
+        #: the parameters that are not handled by the formatter itself
+        self.arguments = {
+            name: value
+            for name, value in parameters.items()
+            if name not in ('prefix', 'suffix', 'pad', 'padstring')
+        }
+        self.prefix = parameters.get('prefix', '')
+        self.suffix = parameters.get('suffix', '')
+        self.pad = parameters.get('pad', 0)
+        self.padstring = parameters.get('padstring', '')
+        #: what is left in place if there is nothing to substitute
+        self.text = text
+
+    def apply(self, substitute) -> str:
+        """
+        Applies the padding, prefix and suffix parameters
+        """
+        pad = int(self.pad)
+        padstring = self.padstring
+
+        if pad > 0 and padstring:
+            # Decrease pad length by value length
+            pad = max(0, pad - len(substitute))
+            # Retrieve the maximum multiplier for the pad string
+            padcount = pad // len(padstring) + 1
+            # Generate pad string
+            padstring = padcount * padstring
+            # Clamp pad string
+            padstring = padstring[0:pad]
+            substitute = '%s%s' % (padstring, substitute)
+
+        if substitute:
+            substitute = '%s%s%s' % (self.prefix, substitute, self.suffix)
+
+        return '%s' % (substitute,)
+
+
+class CompiledTemplate:
+    """
+    A template split into literal text and fields, so it can be filled
+    in without parsing it again
+    """
+
+    __slots__ = ('template', 'fields', '_literals', '_slots')
+
+    def __init__(self, template, literals, slots, fields):
+        self.template = template
+        #: the distinct fields, in order of appearance
+        self.fields: List[TemplateField] = fields
+        # literals[0] slot[0] literals[1] slot[1] ... literals[-1]
+        self._literals = literals
+        self._slots = slots
+
+    def join(self, values: List[str]) -> str:
+        """
+        :param values: the text for each of `fields`
+        """
+        literals = self._literals
+        parts = [literals[0]]
+        for slot, literal in zip(self._slots, literals[1:]):
+            parts.append(values[slot])
+            parts.append(literal)
+        return ''.join(parts)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_template(pattern, delimiter, template) -> CompiledTemplate:
+    literals = []
+    slots = []
+    fields = []
+    positions = {}
+    literal = []
+    end = 0
+
+    for match in pattern.finditer(template):
+        literal.append(template[end : match.start()])
+        end = match.end()
+
+        # We only care about braced and named, not escaped and invalid
+        named = match.group('named')
+        braced = match.group('braced')
+        if named is not None:
+            needle = named
+            field = TemplateField(named, named, {}, delimiter + named)
+        elif braced is not None:
+            parts = [braced]
+            parameters = {}
+            if match.group('parameters') is not None:
+                parameters = _parse_parameters(match.group('parameters'))
+                parts.append(match.group('parameters'))
+            needle = ':'.join(parts)
+            field = TemplateField(
+                needle, braced, parameters, delimiter + '{' + needle + '}'
+            )
+        else:
+            literal.append(delimiter)
+            continue
+
+        # Multiple occurrences of the same identifier with the
+        # same parameters share a field
+        position = positions.get(needle)
+        if position is None:
+            position = positions[needle] = len(fields)
+            fields.append(field)
+        literals.append(''.join(literal))
+        literal = []
+        slots.append(position)
+
+    literal.append(template[end:])
+    literals.append(''.join(literal))
+    return CompiledTemplate(template, literals, slots, fields)
+
 
 class Formatter(GObject.Object):
     R"""
@@ -192,6 +360,7 @@ class Formatter(GObject.Object):
         GObject.Object.__init__(self)
 
         self._template = ParameterTemplate(format)
+        self._compiled = None
         self._substitutions = {}
 
     def do_get_property(self, property):
@@ -210,6 +379,7 @@ class Formatter(GObject.Object):
         if property.name == 'format':
             if value != self._template.template:
                 self._template.template = value
+                self._compiled = None
         else:
             raise AttributeError('unknown property %s' % property.name)
 
@@ -232,51 +402,20 @@ class Formatter(GObject.Object):
 
         :returns: the extractions
         """
-        matches = self._template.pattern.finditer(self._template.template)
-        extractions: Formatter.Extractions = {}
-
-        # Extract list of identifiers and parameters from the format string
-        for match in matches:
-            groups = match.groupdict()
+        return {
+            field.needle: (field.identifier, dict(field.parameters))
+            for field in self.compile().fields
+        }
 
-            # We only care about braced and named, not escaped and invalid
-            identifier = groups['braced'] or groups['named']
-
-            if identifier is None:
-                continue
-
-            identifier_parts = [identifier]
-            parameters = {}
-
-            if groups['parameters'] is not None:
-                # Split parameters on unescaped comma
-                parameters = [
-                    p.lstrip() for p in re.split(r'(?<!\\),', groups['parameters'])
-                ]
-                # Split arguments on unescaped equals sign
-                parameters = [
-                    (re.split(r'(?<!\\)=', p, 1) + [True])[:2] for p in parameters
-                ]
-                # Turn list of lists into a proper dictionary
-                parameters = dict(parameters)
-
-                # Remove now obsolete escapes
-                for p in parameters:
-                    argument = parameters[p]
-
-                    if not isinstance(argument, bool):
-                        argument = argument.replace(r'\,', ',')
-                        argument = argument.replace(r'\}', '}')
-                        argument = argument.replace(r'\=', '=')
-                        parameters[p] = argument
-
-                identifier_parts += [groups['parameters']]
-
-            # Required to make multiple occurrences of the same
-            # identifier with different parameters work
-            extractions[':'.join(identifier_parts)] = (identifier, parameters)
-
-        return extractions
+    def compile(self) -> CompiledTemplate:
+        """
+        Returns the format string split into literal text and fields.
+        It is parsed once and then kept until the format changes.
+        """
+        compiled = self._compiled
+        if compiled is None:
+            compiled = self._compiled = self._template.compile()
+        return compiled
 
     def format(self, *args):
         """
@@ -286,43 +425,28 @@ class Formatter(GObject.Object):
         :returns: the formatted text
         :rtype: string
         """
-        extractions = self.extract()
-        substitutions = {}
+        compiled = self.compile()
+        substitutions = self._substitutions
+        values = []
 
-        for needle, (identifier, parameters) in extractions.items():
+        for field in compiled.fields:
             substitute = None
 
-            if needle in self._substitutions:
-                substitute = self._substitutions[needle]
-            elif identifier in self._substitutions:
-                substitute = self._substitutions[identifier]
-
-            if substitute is not None:
-                prefix = parameters.pop('prefix', '')
-                suffix = parameters.pop('suffix', '')
-                pad = int(parameters.pop('pad', 0))
-                padstring = parameters.pop('padstring', '')
+            if field.needle in substitutions:
+                substitute = substitutions[field.needle]
+            elif field.identifier in substitutions:
+                substitute = substitutions[field.identifier]
 
-                if callable(substitute):
-                    substitute = substitute(*args, **parameters)
-
-                if pad > 0 and padstring:
-                    # Decrease pad length by value length
-                    pad = max(0, pad - len(substitute))
-                    # Retrieve the maximum multiplier for the pad string
-                    padcount = pad // len(padstring) + 1
-                    # Generate pad string
-                    padstring = padcount * padstring
-                    # Clamp pad string
-                    padstring = padstring[0:pad]
-                    substitute = '%s%s' % (padstring, substitute)
+            if substitute is None:
+                values.append(field.text)
+                continue
 
-                if substitute:
-                    substitute = '%s%s%s' % (prefix, substitute, suffix)
+            if callable(substitute):
+                substitute = substitute(*args, **field.arguments)
 
-                substitutions[needle] = substitute
+            values.append(field.apply(substitute))
 
-        return self._template.safe_substitute(substitutions)
+        return compiled.join(values)
 
 
 class ProgressTextFormatter(Formatter):
@@ -382,11 +506,68 @@ class ProgressTextFormatter(Formatter):
         return Formatter.format(self)
 
 
+# Incremented whenever tag formatting providers change, which invalidates
+# the providers looked up by TrackFormatter.compile_providers()
+_provider_generation = 0
+
+
+def _on_tag_formatting_providers_changed(*args):
+    global _provider_generation
+    _provider_generation += 1
+
+
+event.add_callback(
+    _on_tag_formatting_providers_changed, 'tag-formatting_provider_added'
+)
+event.add_callback(
+    _on_tag_formatting_providers_changed, 'tag-formatting_provider_removed'
+)
+
+
 class TrackFormatter(Formatter):
     """
     A formatter for track data
     """
 
+    def __init__(self, format, cache=False):
+        """
+        :param format: the initial format
+        :param cache: whether to keep the result for each track until
+            its tags change. Formats with fields whose providers depend
+            on anything else, like the current time or settings, are
+            never cached (see :attr:`TagFormatter.cacheable`).
+        """
+        Formatter.__init__(self, format)
+        self._providers = None
+        self._cache = weakref.WeakKeyDictionary() if cache else None
+
+    def compile_providers(self) -> List[Optional['TagFormatter']]:
+        """
+        Returns the tag formatting provider of each field of the
+        format, or None for tags without one.
+        """
+        compiled = self.compile()
+        cached = self._providers
+        if (
+            cached is not None
+            and cached[0] is compiled
+            and cached[1] == _provider_generation
+        ):
+            return cached[2]
+        result = [
+            providers.get_provider('tag-formatting', field.identifier)
+            for field in compiled.fields
+        ]
+        self._providers = (compiled, _provider_generation, result)
+        return result
+
+    def _is_cacheable(self) -> bool:
+        return all(
+            getattr(provider, 'cacheable', False)
+            for provider in self.compile_providers()
+            if provider is not None
+        )
+
     def format(self, track, markup_escape=False):
         """
         Returns a string for places where
@@ -405,23 +586,41 @@ class TrackFormatter(Formatter):
                 'First argument to format() needs ' 'to be of type xl.trax.Track'
             )
 
-        extractions = self.extract()
-        self._substitutions = {}
-
-        for identifier, (tag, parameters) in extractions.items():
-            provider = providers.get_provider('tag-formatting', tag)
+        compiled = self.compile()
+        cache = self._cache
+        if cache is not None and not self._is_cacheable():
+            cache = None
+        if cache is not None:
+            key = (
+                compiled,
+                track._tag_generation,
+                _provider_generation,
+                markup_escape,
+            )
+            cached = cache.get(track)
+            if cached is not None and cached[0] == key:
+                return cached[1]
 
+        values = []
+        for field, provider in zip(compiled.fields, self.compile_providers()):
             if provider is None:
-                substitute = track.get_tag_display(tag)
+                substitute = track.get_tag_display(field.identifier)
             else:
-                substitute = provider.format(track, parameters)
+                substitute = provider.format(track, field.parameters)
+
+            if substitute is None:
+                values.append(field.text)
+                continue
 
             if markup_escape:
                 substitute = GLib.markup_escape_text(substitute)
 
-            self._substitutions[identifier] = substitute
+            values.append(field.apply(substitute))
 
-        return Formatter.format(self)
+        result = compiled.join(values)
+        if cache is not None:
+            cache[track] = (key, result)
+        return result
 
 
 class TagFormatter:
@@ -429,6 +628,10 @@ class TagFormatter:
     A formatter provider for a tag of a track
     """
 
+    #: Whether the output depends on nothing but the tags of the track,
+    #: so that it can be cached until they change
+    cacheable = True
+
     def __init__(self, name):
         """
         :param name: the name of the tag
@@ -685,6 +888,9 @@ class RatingTagFormatter(TagFormatter):
     Will return glyphs representing the rating like ★★★☆☆
     """
 
+    # depends on the rating/maximum setting
+    cacheable = False
+
     def __init__(self):
         TagFormatter.__init__(self, '__rating')
 
@@ -741,6 +947,9 @@ class DateTagFormatter(TagFormatter):
     or the respective localized date for earlier dates
     """
 
+    # depends on the current date
+    cacheable = False
+
     def __init__(self, name):
         """
         :param name: the name of the tag
@@ -403,6 +403,13 @@ def create_argument_parser():
         default=False,
         help=_("Enable full debugging of" " xl.event. Generates LOTS of output"),
     )
+    group.add_argument(
+        "--eventprofile",
+        dest="ProfileEvent",
+        action="store_true",
+        default=False,
+        help=_("Log the time spent in each xl.event callback on exit"),
+    )
     group.add_argument(
         "--threaddebug",
         dest="DebugThreads",
@@ -545,6 +552,9 @@ class Exaile:
             if self.options.DebugEventFull:
                 event.EVENT_MANAGER.use_verbose_logger = True
 
+            if self.options.ProfileEvent:
+                event.EVENT_MANAGER.start_profiling()
+
             # initial mainloop setup. The actual loop is started later,
             # if necessary
             self.mainloop_init()
@@ -675,7 +685,9 @@ class Exaile:
 
         try:
             self.collection = collection.Collection(
-                "Collection", location=os.path.join(xdg.get_data_dir(), 'music.db')
+                "Collection",
+                location=os.path.join(xdg.get_data_dir(), 'music.db'),
+                lazy=settings.get_option('collection/lazy_load', False),
             )
         except common.VersionError:
             logger.exception("VersionError loading collection")
@@ -967,6 +979,7 @@ class Exaile:
         covers.MANAGER.save()
 
         self.collection.save_to_location()
+        self.collection.close()
 
         # Save order of custom playlists
         self.playlists.save_order()
@@ -983,7 +996,10 @@ class Exaile:
 
         from xl import settings
 
-        settings.MANAGER.save()
+        settings.MANAGER.save(wait=True)
+
+        if event.EVENT_MANAGER.profile is not None:
+            event.EVENT_MANAGER.log_profile()
 
         if restart:
             logger.info("Restarting...")
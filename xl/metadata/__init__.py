@@ -25,13 +25,22 @@
 # from your version.
 
 
+import functools
 import os, logging
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, Mapping, NamedTuple, Optional
 import urllib.parse
 
 from gi.repository import Gio
 
-from xl.metadata._base import BaseFormat, CoverImage, NotWritable, NotReadable
+from xl import settings
+from xl.metadata._base import (
+    SNIFF_SIZE,
+    BaseFormat,
+    CoverImage,
+    NotWritable,
+    NotReadable,
+)
 
 from xl.metadata import (
     aac,
@@ -115,24 +124,65 @@ class DummyFormat(BaseFormat):
     pass
 
 
-def get_format(loc: str) -> Optional[BaseFormat]:
+@functools.lru_cache(maxsize=1024)
+def _get_path(loc: str) -> Optional[str]:
+    return Gio.File.new_for_uri(loc).get_path()
+
+
+def _get_format_classes(path: str):
+    """
+    Returns the entry of `formats` for the extension of *path*
+
+    :raises KeyError: if the extension is not supported
+    """
+    ext = os.path.splitext(path)[1]
+    ext = ext[1:]  # remove the pesky .
+    ext = ext.lower()
+    return formats[ext]
+
+
+def _sniff_order(path: str, classes, hint: Optional[str] = None):
+    """
+    Orders the format classes that share an extension by how likely
+    they are to read the file at *path*.
+
+    The first bytes of the file are checked, so that classes which
+    recognize the file are tried before those which cannot tell, and
+    those which reject it come last. Within each group, the class named
+    *hint* comes first. Some classes open almost anything, so the hint
+    alone is not trusted.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            header = fp.read(SNIFF_SIZE)
+    except OSError:
+        header = None
+
+    def rank(klass):
+        guess = None if header is None else klass.sniff(header)
+        group = 1 if guess is None else (0 if guess else 2)
+        return group, klass.__name__ != hint
+
+    return sorted(classes, key=rank)
+
+
+def get_format(loc: str, hint: Optional[str] = None) -> Optional[BaseFormat]:
     """
     get a Format object appropriate for the file at loc.
     if no suitable object can be found, None is returned.
 
     :param loc: The location to read from as a Gio URI
         (from Track.get_loc_for_io())
+    :param hint: the class name of the format the file had the last time
+        it was read (the ``__format`` tag), preferred when several
+        formats share the extension of the file
     """
-    loc = Gio.File.new_for_uri(loc).get_path()
+    loc = _get_path(loc)
     if not loc:
         return None
 
-    ext = os.path.splitext(loc)[1]
-    ext = ext[1:]  # remove the pesky .
-    ext = ext.lower()
-
     try:
-        formatclass = formats[ext]
+        formatclass = _get_format_classes(loc)
     except KeyError:
         return None  # not supported
 
@@ -142,7 +192,7 @@ def get_format(loc: str) -> Optional[BaseFormat]:
     # Some file types can be more than one format
     # So check each possible format
     if type(formatclass) is list:
-        for klass in formatclass:
+        for klass in _sniff_order(loc, formatclass, hint):
             try:
                 return klass(loc)
             except:
@@ -156,4 +206,119 @@ def get_format(loc: str) -> Optional[BaseFormat]:
         return None
 
 
+def read_tags(
+    loc: str,
+    modified: Optional[float] = None,
+    info: Optional[Gio.FileInfo] = None,
+    hint: Optional[str] = None,
+):
+    """
+    Reads the tags of the file at *loc*. This only does I/O and does not
+    touch any Track, so that it can be called from worker threads.
+
+    :param loc: The location to read from as a Gio URI
+    :param modified: if the file has not been modified after this
+        time, its tags are not read
+    :param info: the ``time::modified`` and ``standard::size``
+        attributes of the file, if already known
+    :param hint: the format the file had before, see `get_format`
+    :returns: (format, tags); format is None if the file is not
+        supported, tags is None if the file has not been modified
+    """
+    gloc = Gio.File.new_for_uri(loc)
+    if info is None:
+        info = gloc.query_info(
+            "time::modified,standard::size", Gio.FileQueryInfoFlags.NONE, None
+        )
+    mtime = info.get_modification_date_time().to_unix()
+    f = get_format(loc, hint)
+    if f is None or (modified is not None and modified >= mtime):
+        return f, None
+
+    # Read the tags
+    ntags = f.read_all()
+    ntags['__modified'] = mtime
+    ntags['__filesize'] = info.get_size()
+    # Remember which of the formats sharing the extension won
+    if type(_get_format_classes(f.loc)) is list:
+        ntags['__format'] = type(f).__name__
+
+    # TODO: this probably breaks on non-local files
+    ntags['__basedir'] = gloc.get_parent().get_path()
+    return f, ntags
+
+
+class TagReadResult(NamedTuple):
+    """
+    Result of reading the tags of one file with `read_tags_many`
+    """
+
+    uri: str
+    #: the Format of the file, None if not supported or on error
+    format: Optional[BaseFormat]
+    #: the tags as returned by `read_tags`
+    tags: Optional[Dict[str, Any]]
+    #: the exception raised while reading the file, if any
+    error: Optional[Exception]
+
+
+def read_tags_many(
+    uris: Iterable[str],
+    workers: Optional[int] = None,
+    modified: Optional[Mapping[str, float]] = None,
+    hints: Optional[Mapping[str, str]] = None,
+) -> Iterator[TagReadResult]:
+    """
+    Reads the tags of many files concurrently.
+
+    Results are yielded in the order the reads complete, not in the order
+    of *uris*. Only a bounded number of files is in flight at any time, so
+    *uris* may be a lazy iterable. Closing the generator early cancels the
+    reads that have not started yet.
+
+    :param uris: the locations to read, as Gio URIs
+    :param workers: number of reader threads; defaults to the value of
+        the ``collection/scan_workers`` setting
+    :param modified: maps locations to the modification time known for
+        them, see the *modified* parameter of `read_tags`
+    :param hints: maps locations to the format they had before, see
+        the *hint* parameter of `get_format`
+    """
+    if workers is None or workers <= 0:
+        workers = settings.get_option('collection/scan_workers', 0)
+        if workers <= 0:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+    if modified is None:
+        modified = {}
+    if hints is None:
+        hints = {}
+
+    def read(uri):
+        try:
+            f, ntags = read_tags(uri, modified.get(uri), hint=hints.get(uri))
+        except Exception as e:
+            return TagReadResult(uri, None, None, e)
+        return TagReadResult(uri, f, ntags, None)
+
+    uris = iter(uris)
+    max_pending = workers * 4
+    pending = set()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='TagRead')
+    try:
+        while True:
+            for uri in uris:
+                pending.add(executor.submit(read, uri))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
 # vim: et sts=4 sw=4
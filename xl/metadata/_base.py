@@ -27,7 +27,7 @@
 from collections import namedtuple
 import copy
 import threading
-from typing import Any, ClassVar, Mapping, Sequence
+from typing import Any, ClassVar, Mapping, Optional, Sequence
 
 import logging
 
@@ -41,6 +41,9 @@ version.register('Mutagen', mutagen.version_string)
 
 INFO_TAGS = ['__bitrate', '__length']
 
+#: Number of bytes passed to `BaseFormat.sniff`
+SNIFF_SIZE = 16
+
 _compute_lock = threading.Lock()
 
 # Generic description of cover images
@@ -85,6 +88,17 @@ class BaseFormat:
     # Reverse of tag_mapping, populated in _compute_mappings
     _reverse_mapping: ClassVar[Mapping[Any, str]]
 
+    @classmethod
+    def sniff(cls, header: bytes) -> Optional[bool]:
+        """
+        Guesses from the first bytes of a file whether it is in this format,
+        used to pick between formats sharing a file extension.
+
+        :param header: the first `SNIFF_SIZE` bytes of the file
+        :returns: True or False, or None if this format cannot tell
+        """
+        return None
+
     @classmethod
     def _compute_mappings(cls):
         with _compute_lock:
@@ -33,4 +33,10 @@ from mutagen import id3
 
 class AACFormat(ID3Format):
     MutagenType = id3.ID3FileType
-    pass
+
+    @classmethod
+    def sniff(cls, header):
+        # ID3v2 tag, ADIF header, or the syncword of an ADTS frame
+        if header[:3] == b'ID3' or header[:4] == b'ADIF':
+            return True
+        return len(header) >= 2 and header[0] == 0xFF and header[1] & 0xF6 == 0xF0
@@ -31,6 +31,13 @@ from mutagen import mp4
 
 class MP4Format(BaseFormat):
     MutagenType = mp4.MP4
+
+    @classmethod
+    def sniff(cls, header):
+        # ISO base media files start with the size and type of a box,
+        # which is 'ftyp' for anything mutagen can read
+        return header[4:8] == b'ftyp'
+
     tag_mapping = {
         # fmt: off
         'title':       '\xa9nam',
@@ -28,12 +28,20 @@ from xl import common
 
 
 def handle_migration(db, pdata, oldversion, newversion):
-    if oldversion == 1 and newversion == 2:
-        from . import from1to2
+    # Each step bumps pdata['_dbversion'], so chain them until we are done.
+    while oldversion < newversion:
+        if oldversion == 1:
+            from . import from1to2 as step
 
-        from1to2.migrate(db, pdata, oldversion, newversion)
-    else:
-        raise common.VersionError(
-            "Don't know how to handle upgrade from "
-            "music database version %s to %s." % (oldversion, newversion)
-        )
+            target = 2
+        elif oldversion == 2:
+            from . import from2to3 as step
+
+            target = 3
+        else:
+            raise common.VersionError(
+                "Don't know how to handle upgrade from "
+                "music database version %s to %s." % (oldversion, newversion)
+            )
+        step.migrate(db, pdata, oldversion, target)
+        oldversion = target
@@ -0,0 +1,63 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Move tracks from pickled ``tracks-N`` shelf entries to the relational tables
+of :class:`xl.trax.trackstore.TrackStore`.
+"""
+
+import logging
+
+from xl.trax.trackstore import TrackStore
+
+logger = logging.getLogger(__name__)
+
+
+def migrate(db, pdata, oldversion, newversion):
+    store = TrackStore(pdata.dict.conn)
+    keys = [x for x in pdata.keys() if x.startswith("tracks-")]
+
+    def rows():
+        seen = set()
+        for k in keys:
+            tags, key, attrs = pdata[k]
+            loc = tags.get('__loc')
+            if not loc:
+                continue
+            if loc in seen:
+                # same policy as TrackDB: the first track found wins
+                logger.warning("Dropping duplicate track: %s", loc)
+                continue
+            seen.add(loc)
+            yield key, tags, attrs
+
+    count = store.save(rows())
+    logger.info("Moved %d tracks to the new DB format", count)
+
+    for k in keys:
+        del pdata[k]
+
+    pdata['_dbversion'] = newversion
+    pdata.sync()
@@ -31,7 +31,7 @@ in playlists as well as methods to import and export from various file formats.
 
 from gi.repository import Gio
 
-from collections import deque
+from collections import Counter, deque
 from datetime import datetime, timedelta
 import logging
 import operator
@@ -47,6 +47,7 @@ import urllib.request
 
 from xl import common, dynamic, event, main, providers, settings, trax, xdg
 from xl.common import GioFileInputStream, GioFileOutputStream, MetadataList
+from xl.trax.index import TagIndex
 from xl.nls import gettext as _
 from xl.metadata.tags import tag_data
 
@@ -984,6 +985,10 @@ class Playlist:
         self.__current_position = -1
         self.__spat_position = -1
         self.__shuffle_history_counter = 1
+        # Created on the first search, see get_tag_index(). The counts
+        # tell when the last copy of a track leaves the playlist.
+        self.__tag_index = None
+        self.__tag_index_counts = Counter()
 
         event.add_callback(self.on_playback_track_start, "playback_track_start")
 
@@ -1558,6 +1563,7 @@ class Playlist:
             trs.append(track)
 
         self.__tracks[:] = trs
+        self.__tag_index = None
 
         for item, val in items.items():
             if item in self.save_attrs:
@@ -1574,6 +1580,37 @@ class Playlist:
         # reverses current view
         pass
 
+    def get_tag_index(self):
+        """
+        Returns the index used by :func:`xl.trax.search_tracks` to avoid
+        looking at every track of this playlist. It is created on first
+        use and kept up to date from then on.
+
+        :rtype: :class:`xl.trax.index.TagIndex`
+        """
+        if self.__tag_index is None:
+            self.__tag_index_counts = Counter(self.__tracks)
+            self.__tag_index = TagIndex()
+            self.__tag_index.add(self.__tag_index_counts)
+        return self.__tag_index
+
+    def __update_tag_index(self, removed, added):
+        if self.__tag_index is None:
+            return
+        counts = self.__tag_index_counts
+        before = {tr: counts[tr] for _i, tr in removed}
+        before.update((tr, counts[tr]) for _i, tr in added)
+        counts.subtract(tr for _i, tr in removed)
+        counts.update(tr for _i, tr in added)
+        gone = [tr for tr in before if counts[tr] <= 0]
+        for tr in gone:
+            del counts[tr]
+        # Moving tracks around, e.g. when sorting, leaves the index alone
+        self.__tag_index.remove(tr for tr in gone if before[tr])
+        self.__tag_index.add(
+            tr for tr, count in before.items() if not count and tr in counts
+        )
+
     ### list-like API methods ###
     # parts of this section are taken from
     # https://code.activestate.com/recipes/440656-list-mixin/
@@ -1642,6 +1679,7 @@ class Playlist:
             removed = [(i, oldtracks)]
             added = [(i, value)]
 
+        self.__update_tag_index(removed, added)
         self.on_tracks_changed()
 
         if removed:
@@ -1667,6 +1705,7 @@ class Playlist:
         else:
             removed = [(i, oldtracks)]
 
+        self.__update_tag_index(removed, [])
         self.on_tracks_changed()
         event.log_event('playlist_tracks_removed', self, removed)
         self.__adjust_current_pos(oldpos, removed, [])
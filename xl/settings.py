@@ -30,10 +30,18 @@ Central storage of application and user settings
 
 import ast
 from configparser import RawConfigParser, NoSectionError, NoOptionError
+import copy
+from fnmatch import fnmatchcase
+import io
 import logging
 import os
 import sys
-from typing import Any, ClassVar
+import threading
+import time
+import weakref
+from typing import Any, ClassVar, Dict, Iterable, List, Optional, Tuple
+
+from gi.repository import GLib
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +51,145 @@ from xl.nls import gettext as _
 
 MANAGER = None
 
+#: Options that change often (window geometry, column widths, volume...);
+#: the global manager keeps them in a separate file, so that updating them
+#: does not rewrite all other settings
+VOLATILE_OPTIONS = (
+    'gui/col_width_*',
+    'gui/collection_active_view',
+    'gui/files_*',
+    'gui/last_selected_panel',
+    'gui/mainw_*',
+    'gui/queue_notebook_num',
+    'gui/trackprop_*',
+    'player/volume',
+    'preview_device/volume',
+)
+
+#: (section, [(key, value)]) for every section stored in one file
+_Snapshot = List[Tuple[str, List[Tuple[str, str]]]]
+
+
+def _write_file(path: str, snapshot: _Snapshot) -> int:
+    """
+    Atomically replaces the settings file at *path*
+
+    :returns: the number of bytes written
+    """
+    parser = RawConfigParser()
+    parser.read_dict({section: dict(items) for section, items in snapshot})
+    buf = io.StringIO()
+    parser.write(buf)
+    data = buf.getvalue()
+
+    with open(path + ".new", 'w') as f:
+        f.write(data)
+
+        try:
+            # make it readable by current user only, to protect private data
+            os.fchmod(f.fileno(), 384)
+        except Exception:
+            pass  # fail gracefully, eg if on windows
+
+        f.flush()
+
+    try:
+        os.rename(path, path + ".old")
+    except Exception:
+        pass  # if it doesn'texist we don't care
+
+    os.rename(path + ".new", path)
+
+    try:
+        os.remove(path + ".old")
+    except Exception:
+        pass
+
+    return len(data)
+
+
+class _SettingsWriter:
+    """
+    Writes snapshots of settings files on a background thread.
+
+    Only the latest snapshot of each file is kept, so writes never pile up
+    behind a slow disk.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: Dict[str, _Snapshot] = {}
+        self._busy = False
+        self._thread = None
+        #: number of files written
+        self.flushes = 0
+        #: number of bytes written
+        self.bytes_written = 0
+
+    def submit(self, path: str, snapshot: _Snapshot) -> None:
+        with self._cond:
+            self._pending[path] = snapshot
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='SettingsWriter', daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def wait(self) -> None:
+        """
+        Blocks until all submitted snapshots have been written
+        """
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                path, snapshot = self._pending.popitem()
+                self._busy = True
+            try:
+                written = _write_file(path, snapshot)
+            except Exception:
+                written = None
+                logger.exception("Could not save settings to %s", path)
+            with self._cond:
+                if written is not None:
+                    self.flushes += 1
+                    self.bytes_written += written
+                self._busy = False
+                self._cond.notify_all()
+
+
+# Values of the typed value cache for options that are not set
+_MISSING = object()
+
+
+class BoundOption:
+    """
+    The current value of an option, kept up to date by the
+    `SettingsManager` that created it (see `SettingsManager.bind_option`).
+
+    Reading `value` is as cheap as reading an attribute, so this is meant
+    for options that are checked in loops.
+    """
+
+    __slots__ = ['option', 'default', 'value', '__weakref__']
+
+    def __init__(self, option: str, default: Any, value: Any):
+        #: the full path to the option
+        self.option = option
+        #: the value used when the option is not set
+        self.default = default
+        #: the current value of the option
+        self.value = value
+
+    def __repr__(self):
+        return '<BoundOption %s=%r>' % (self.option, self.value)
+
 
 class SettingsManager(RawConfigParser):
     """
@@ -51,6 +198,10 @@ class SettingsManager(RawConfigParser):
 
     VERSION: ClassVar[int] = 2
 
+    #: Changes are written at most this many seconds after they were made,
+    #: even if the settings keep changing in the meantime
+    MAX_SAVE_DELAY: ClassVar[float] = 5
+
     _last_serial: ClassVar[int] = 0
 
     # xl.common.glib_wait needs instances of this class to be hashable to use
@@ -58,7 +209,13 @@ class SettingsManager(RawConfigParser):
     # number as this hash.
     _serial: int
 
-    def __init__(self, location=None, default_location=None):
+    def __init__(
+        self,
+        location=None,
+        default_location=None,
+        volatile_location: Optional[str] = None,
+        volatile_options: Iterable[str] = (),
+    ):
         """
         Sets up the settings manager. Expects a location
         to a file where settings will be stored. Also sets up
@@ -69,12 +226,32 @@ class SettingsManager(RawConfigParser):
         :type location: str or None
         :param default_location: the default location to
             initialize settings from
+        :param volatile_location: the location to save the options
+            matching *volatile_options* to, instead of *location*
+        :param volatile_options: ``fnmatch`` patterns of options
+            (in ``section/key`` syntax) that change often
         """
         RawConfigParser.__init__(self)
 
         self.location = location
-        self._saving = False
+        self.volatile_location = volatile_location
+        self.volatile_options = tuple(volatile_options)
+        # option -> location it is saved to
+        self._option_locations: Dict[str, Optional[str]] = {}
         self._dirty = False
+        # locations with unsaved changes
+        self._dirty_locations = set()
+        # time of the oldest unsaved change
+        self._dirty_since: Optional[float] = None
+        # pending save started by _idle_save
+        self._idle_save_id: Optional[int] = None
+        self._writer = _SettingsWriter()
+        # option -> decoded value or _MISSING; read without locking, so
+        # entries are only stored if no option changed in the meantime
+        self._values: Dict[str, Any] = {}
+        self._generation = 0
+        # option -> BoundOptions to update when it changes
+        self._bound: Dict[str, 'weakref.WeakSet[BoundOption]'] = {}
 
         self._serial = self.__class__._last_serial = self.__class__._last_serial + 1
 
@@ -85,12 +262,17 @@ class SettingsManager(RawConfigParser):
                 pass
 
         if location is not None:
-            try:
-                self.read(self.location) or self.read(
-                    self.location + ".new"
-                ) or self.read(self.location + ".old")
-            except Exception:
-                pass
+            self._read_location(location)
+            if volatile_location is not None:
+                # this takes precedence over values still left in the
+                # main file by versions without a volatile store
+                self._read_location(volatile_location)
+                if not os.path.exists(volatile_location):
+                    # move the volatile options out of the main file
+                    self._dirty_locations.add(volatile_location)
+                    self._dirty_locations.add(location)
+
+        self._values.clear()
 
         version = self.get_option('settings/version')
         if version and version > self.VERSION:
@@ -105,6 +287,44 @@ class SettingsManager(RawConfigParser):
     def __hash__(self):
         return self._serial
 
+    def _read_location(self, location):
+        try:
+            self.read(location) or self.read(location + ".new") or self.read(
+                location + ".old"
+            )
+        except Exception:
+            pass
+
+    def _get_location(self, option):
+        """
+        Returns the file *option* is saved to
+        """
+        try:
+            return self._option_locations[option]
+        except KeyError:
+            location = self.location
+            if self.volatile_location is not None:
+                for pattern in self.volatile_options:
+                    if fnmatchcase(option, pattern):
+                        location = self.volatile_location
+                        break
+            self._option_locations[option] = location
+            return location
+
+    @property
+    def flush_count(self) -> int:
+        """
+        Number of times a settings file has been written
+        """
+        return self._writer.flushes
+
+    @property
+    def bytes_written(self) -> int:
+        """
+        Number of bytes written to settings files
+        """
+        return self._writer.bytes_written
+
     @glib_wait_seconds(30)
     def _timeout_save(self):
         """Save every 30 seconds"""
@@ -150,11 +370,20 @@ class SettingsManager(RawConfigParser):
         except NoSectionError:
             self.add_section(section)
             self.set(section, key, value)
+        self._option_changed(section, key)
 
         self._dirty = True
+        self._dirty_locations.add(self._get_location(option))
+        now = time.monotonic()
+        if self._dirty_since is None:
+            self._dirty_since = now
 
         if save:
-            self.delayed_save()
+            if now - self._dirty_since >= self.MAX_SAVE_DELAY:
+                # don't let a steady stream of changes postpone saving
+                self._idle_save()
+            else:
+                self.delayed_save()
 
         section = section.replace('/', '_')
 
@@ -170,19 +399,70 @@ class SettingsManager(RawConfigParser):
         :param default: a default value to use as fallback
         :returns: the option value or *default*
         """
+        value = self._values.get(option, _MISSING)
+        if value is _MISSING:
+            value = self._read_option(option)
+        if value is _MISSING:
+            return default
+        if isinstance(value, (list, dict)):
+            # callers may modify the value they get
+            return copy.deepcopy(value)
+        return value
+
+    def _read_option(self, option: str) -> Any:
+        """
+        Decodes the value of an option and caches it
+
+        :returns: the value, or _MISSING if the option is not set
+        """
+        generation = self._generation
         splitvals = option.split('/')
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
         try:
-            value = self.get(section, key)
-            value = self._str_to_val(value)
-        except NoSectionError:
-            value = default
-        except NoOptionError:
-            value = default
+            value = self._str_to_val(self.get(section, key))
+        except (NoSectionError, NoOptionError):
+            value = _MISSING
 
+        # only options in canonical form can be invalidated later
+        if key == self.optionxform(key) and generation == self._generation:
+            self._values[option] = value
         return value
 
+    def _option_changed(self, section: str, key: str) -> None:
+        """
+        Drops the cached value of an option and updates its bindings
+        """
+        option = '%s/%s' % (section, self.optionxform(key))
+        self._generation += 1
+        self._values.pop(option, None)
+        bound = self._bound.get(option)
+        if bound:
+            value = self._read_option(option)
+            for binding in bound:
+                binding.value = binding.default if value is _MISSING else value
+
+    def bind_option(self, option: str, default: Any = None) -> BoundOption:
+        """
+        Returns an object whose ``value`` attribute always holds the
+        current value of an option, like `get_option` would return it.
+
+        This is meant for hot code paths. The value must not be modified.
+        The binding is dropped when the returned object is garbage
+        collected, so it should be stored for as long as it is used.
+
+        :param option: the full path to an option
+        :param default: a default value to use as fallback
+        """
+        section, _sep, key = option.rpartition('/')
+        option = '%s/%s' % (section, self.optionxform(key))
+        binding = BoundOption(option, default, self.get_option(option, default))
+        try:
+            self._bound[option].add(binding)
+        except KeyError:
+            self._bound[option] = weakref.WeakSet([binding])
+        return binding
+
     def has_option(self, option):
         """
         Returns information about the existence
@@ -210,6 +490,7 @@ class SettingsManager(RawConfigParser):
         section, key = "/".join(splitvals[:-1]), splitvals[-1]
 
         RawConfigParser.remove_option(self, section, key)
+        self._option_changed(section, key)
 
     def _set_direct(self, option, value):
         """
@@ -229,6 +510,7 @@ class SettingsManager(RawConfigParser):
         except NoSectionError:
             self.add_section(section)
             self.set(section, key, value)
+        self._option_changed(section, key)
 
         event.log_event('option_set', self, option)
 
@@ -285,46 +567,58 @@ class SettingsManager(RawConfigParser):
         '''Save options after a delay, waiting for multiple saves to accumulate'''
         self.save()
 
-    def save(self):
+    def _idle_save(self):
         """
-        Save the settings to disk
+        Saves from the main loop as soon as it is idle, like
+        `delayed_save` but without waiting for changes to stop
         """
-        if self.location is None:
-            logger.debug("Save requested but not saving settings, " "location is None")
-            return
-
-        if self._saving or not self._dirty:
-            return
-
-        self._saving = True
-
-        logger.debug("Saving settings...")
+        if self._idle_save_id is None:
+            self._idle_save_id = GLib.idle_add(self._on_idle_save)
 
-        with open(self.location + ".new", 'w') as f:
-            self.write(f)
+    def _on_idle_save(self):
+        self._idle_save_id = None
+        self.save()
+        return False
 
-            try:
-                # make it readable by current user only, to protect private data
-                os.fchmod(f.fileno(), 384)
-            except Exception:
-                pass  # fail gracefully, eg if on windows
+    def save(self, wait=False):
+        """
+        Save the settings to disk
 
-            f.flush()
+        The settings are copied right away and written to disk on a
+        background thread. Only the files with changed options are written.
 
-        try:
-            os.rename(self.location, self.location + ".old")
-        except Exception:
-            pass  # if it doesn'texist we don't care
+        :param wait: whether to block until the settings are written,
+            e.g. when quitting
+        """
+        if self.location is None:
+            logger.debug("Save requested but not saving settings, " "location is None")
+            return
 
-        os.rename(self.location + ".new", self.location)
+        if self._dirty_locations:
+            logger.debug("Saving settings...")
+            for location in self._dirty_locations:
+                self._writer.submit(location, self._snapshot(location))
+            self._dirty_locations = set()
+            self._dirty_since = None
+            self._dirty = False
 
-        try:
-            os.remove(self.location + ".old")
-        except Exception:
-            pass
+        if wait:
+            self._writer.wait()
 
-        self._saving = False
-        self._dirty = False
+    def _snapshot(self, location) -> _Snapshot:
+        """
+        Copies the options saved to *location*
+        """
+        snapshot = []
+        for section in self.sections():
+            items = [
+                (key, value)
+                for key, value in self.items(section)
+                if self._get_location('%s/%s' % (section, key)) == location
+            ]
+            if items:
+                snapshot.append((section, items))
+        return snapshot
 
 
 location = xdg.get_config_dir()
@@ -340,10 +634,14 @@ else:
 
 
 MANAGER = SettingsManager(
-    os.path.join(location, "settings.ini"), xdg.get_config_path("settings.ini")
+    os.path.join(location, "settings.ini"),
+    xdg.get_config_path("settings.ini"),
+    os.path.join(location, "state.ini"),
+    VOLATILE_OPTIONS,
 )
 
 get_option = MANAGER.get_option
+bind_option = MANAGER.bind_option
 set_option = MANAGER.set_option
 remove_option = MANAGER.remove_option
 
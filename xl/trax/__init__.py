@@ -41,12 +41,16 @@ from xl.trax.search import (
     TracksInList,
     TracksNotInList,
     match_track_from_string,
+    is_refinement,
+    SearchSession,
 )
 from xl.trax.util import (
     is_valid_track,
     get_album_tracks,
     get_uris_from_tracks,
     get_tracks_from_uri,
+    get_tracks_from_uris,
+    read_tracks_tags,
     sort_tracks,
     sort_result_tracks,
     get_rating_from_tracks,
@@ -0,0 +1,471 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2, or (at your option)
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Inverted index over the tag values of the tracks in a
+:class:`xl.trax.TrackDB`.
+
+The index is only a pre-filter: it returns a superset of the tracks that
+can match a condition, and :func:`xl.trax.search.search_tracks` still runs
+the matchers on each candidate. This keeps the search semantics in one
+place while sparing most of the collection from being looked at.
+"""
+
+import bisect
+import math
+import operator
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from xl import event
+
+__all__ = ['TagIndex']
+
+#: Length of the substrings used to look up ``tag=value`` matches
+GRAM_LENGTH = 3
+
+#: Numbers closer than this are equal in ``__tag==value`` matches
+NUMERIC_TOLERANCE = 0.0001
+
+
+def _grams(value: str) -> Set[str]:
+    return {value[i : i + GRAM_LENGTH] for i in range(len(value) - GRAM_LENGTH + 1)}
+
+
+def _search_values(track, tag: str) -> Tuple[Any, ...]:
+    """
+    Returns the values a matcher would compare for the given tag,
+    with a missing value represented by None.
+    """
+    values = track.get_tag_search(tag, format=False)
+    if values == '__null__':
+        return (None,)
+    if isinstance(values, list):
+        return tuple(values)
+    return (values,)
+
+
+class _TagValues:
+    """
+    Index of the values of a single tag
+    """
+
+    __slots__ = ['tracks', 'folded', 'grams', 'unindexable']
+
+    def __init__(self):
+        #: value -> tracks having it (None is used for missing values)
+        self.tracks: Dict[Any, Set] = {}
+        #: lowercase value -> values
+        self.folded: Dict[str, Set[str]] = {}
+        #: substring of a lowercase value -> lowercase values
+        self.grams: Dict[str, Set[str]] = {}
+        #: tracks with values that cannot be indexed, e.g. numbers
+        self.unindexable: Set = set()
+
+    def add(self, track, values: Tuple[Any, ...]) -> None:
+        for value in values:
+            tracks = self.tracks.get(value)
+            if tracks is None:
+                tracks = self.tracks[value] = set()
+                if isinstance(value, str):
+                    self._add_value(value)
+            tracks.add(track)
+            if value is not None and not isinstance(value, str):
+                self.unindexable.add(track)
+
+    def _add_value(self, value: str) -> None:
+        folded = value.lower()
+        values = self.folded.get(folded)
+        if values is None:
+            values = self.folded[folded] = set()
+            for gram in _grams(folded):
+                self.grams.setdefault(gram, set()).add(folded)
+        values.add(value)
+
+    def remove(self, track, values: Tuple[Any, ...]) -> None:
+        self.unindexable.discard(track)
+        for value in values:
+            tracks = self.tracks.get(value)
+            if tracks is None:
+                continue
+            tracks.discard(track)
+            if not tracks:
+                del self.tracks[value]
+                if isinstance(value, str):
+                    self._remove_value(value)
+
+    def _remove_value(self, value: str) -> None:
+        folded = value.lower()
+        values = self.folded[folded]
+        values.discard(value)
+        if values:
+            return
+        del self.folded[folded]
+        for gram in _grams(folded):
+            folded_values = self.grams[gram]
+            folded_values.discard(folded)
+            if not folded_values:
+                del self.grams[gram]
+
+    def tracks_for(self, folded_values: Iterable[str]) -> Set:
+        result = set(self.unindexable)
+        for folded in folded_values:
+            for value in self.folded.get(folded, ()):
+                result |= self.tracks[value]
+        return result
+
+    def exact(self, content: Optional[str]) -> Set:
+        if content is None:
+            return set(self.tracks.get(None, ()))
+        return self.tracks_for([content.lower()])
+
+    def substring(self, content: str) -> Set:
+        content = content.lower()
+        if len(content) < GRAM_LENGTH:
+            folded_values = self.folded.keys()
+        else:
+            grams = sorted(
+                (self.grams.get(gram, set()) for gram in _grams(content)), key=len
+            )
+            folded_values = set.intersection(*grams)
+        return self.tracks_for(v for v in folded_values if content in v)
+
+
+class _NumericValues:
+    """
+    Values of a single tag sorted as numbers, for range lookups
+    """
+
+    __slots__ = ['keys', 'tracks', 'nulls']
+
+    def __init__(self):
+        #: sorted numeric values, and the track of each one
+        self.keys: List[float] = []
+        self.tracks: List = []
+        #: tracks without a value, which compare as 0 in '<' matches
+        self.nulls: Set = set()
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[Any, Tuple[Any, ...]]]) -> '_NumericValues':
+        """
+        Creates the index from (track, values) pairs with a single sort;
+        `add` is meant for tracks added later.
+        """
+        numbers = cls()
+        pairs = []
+        for track, values in items:
+            for value in values:
+                if value is None:
+                    numbers.nulls.add(track)
+                    continue
+                number = _to_number(value)
+                if number is not None:
+                    pairs.append((number, track))
+        # tracks don't compare, so sort on the number only
+        pairs.sort(key=operator.itemgetter(0))
+        numbers.keys = [number for number, _track in pairs]
+        numbers.tracks = [track for _number, track in pairs]
+        return numbers
+
+    def add(self, track, values: Tuple[Any, ...]) -> None:
+        for value in values:
+            if value is None:
+                self.nulls.add(track)
+                continue
+            number = _to_number(value)
+            if number is not None:
+                pos = bisect.bisect_right(self.keys, number)
+                self.keys.insert(pos, number)
+                self.tracks.insert(pos, track)
+
+    def remove(self, track, values: Tuple[Any, ...]) -> None:
+        self.nulls.discard(track)
+        for value in values:
+            number = _to_number(value)
+            if number is None:
+                continue
+            pos = bisect.bisect_left(self.keys, number)
+            end = bisect.bisect_right(self.keys, number, pos)
+            for i in range(pos, end):
+                if self.tracks[i] is track:
+                    del self.keys[i]
+                    del self.tracks[i]
+                    break
+
+    def between(self, low: float, high: float) -> Set:
+        """
+        Returns the tracks with a value between low and high, inclusive
+        """
+        start = bisect.bisect_left(self.keys, low)
+        end = bisect.bisect_right(self.keys, high, start)
+        return set(self.tracks[start:end])
+
+    def above(self, low: float) -> Set:
+        return set(self.tracks[bisect.bisect_right(self.keys, low) :])
+
+    def below(self, high: float) -> Set:
+        return set(self.tracks[: bisect.bisect_left(self.keys, high)])
+
+
+def _to_number(value: Any) -> Optional[float]:
+    """
+    Converts a value the way the range matchers do, or returns None if
+    they would never match it.
+    """
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(number):
+        return None
+    return number
+
+
+class TagIndex:
+    """
+    Maps tag values to the tracks of a :class:`xl.trax.TrackDB`.
+
+    Each tag is indexed the first time it is queried. Afterwards the index
+    follows the `tracks_added`, `tracks_removed` and `track_tags_changed`
+    events. An index created without a TrackDB starts out empty and its
+    tracks are managed with :meth:`add` and :meth:`remove` instead.
+
+    Text lookups cover exact and substring matches on regular tags,
+    numeric lookups cover ranges on any tag as well as exact matches on
+    internal (``__``) tags, which the search code compares as numbers.
+
+    Lookups are case insensitive and return a superset of the tracks
+    that can match, so callers must still check each track.
+    """
+
+    def __init__(self, trackdb=None):
+        """
+        :param trackdb: The :class:`xl.trax.TrackDB` to index. It must
+            not be modified while the index is being created.
+        """
+        self._lock = threading.RLock()
+        self._tags: Dict[str, _TagValues] = {}
+        self._numbers: Dict[str, _NumericValues] = {}
+        #: track -> location it was indexed under
+        self._tracks: Dict[Any, str] = {}
+        self._locations: Dict[str, Any] = {}
+        #: track -> tag -> indexed values, so they can be removed later
+        self._values: Dict[Any, Dict[str, Tuple[Any, ...]]] = {}
+        if trackdb is not None:
+            for loc, holder in trackdb.tracks.items():
+                self._add(holder._track, loc)
+
+            event.add_callback(self._on_tracks_added, 'tracks_added', trackdb)
+            event.add_callback(self._on_tracks_removed, 'tracks_removed', trackdb)
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self._on_tracks_tags_changed, 'tracks_tags_changed')
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __contains__(self, track) -> bool:
+        return track in self._tracks
+
+    def add(self, tracks: Iterable) -> None:
+        """
+        Adds tracks that are not indexed yet
+        """
+        with self._lock:
+            for track in tracks:
+                if track not in self._tracks:
+                    self._add(track, track.get_loc_for_io())
+
+    def remove(self, tracks: Iterable) -> None:
+        """
+        Removes tracks. Tracks that are not indexed are ignored.
+        """
+        with self._lock:
+            for track in tracks:
+                if track in self._tracks:
+                    self._remove(track)
+
+    def is_indexable(self, tag: Optional[str]) -> bool:
+        """
+        Returns whether text lookups are supported for `tag`
+        """
+        return bool(tag) and not tag.startswith('__')
+
+    def cardinality(self, tag: Optional[str]) -> Optional[int]:
+        """
+        Returns the number of distinct values of `tag`, or None if the
+        tag has not been indexed for text lookups yet.
+        """
+        values = self._tags.get(tag)
+        if values is None:
+            return None
+        return len(values.tracks)
+
+    def exact(self, tag: str, content: Optional[str]) -> Optional[Set]:
+        """
+        Returns the tracks that may have `content` as a value of `tag`,
+        or None if the index can't tell.
+
+        :param content: The value, or None to find tracks without the tag
+        """
+        if not tag:
+            return None
+        if tag.startswith('__'):
+            with self._lock:
+                if content is None:
+                    return set(self._get_numbers(tag).nulls)
+                number = _to_number(content)
+                if number is None:
+                    return None
+                return self._get_numbers(tag).between(
+                    number - NUMERIC_TOLERANCE, number + NUMERIC_TOLERANCE
+                )
+        with self._lock:
+            return self._get_tag(tag).exact(content)
+
+    def substring(self, tag: str, content: str) -> Optional[Set]:
+        """
+        Returns the tracks that may have `content` in a value of `tag`,
+        or None if `tag` is not indexable.
+        """
+        if not self.is_indexable(tag) or not content:
+            return None
+        with self._lock:
+            return self._get_tag(tag).substring(content)
+
+    def greater(self, tag: str, content: str) -> Optional[Set]:
+        """
+        Returns the tracks with a value of `tag` greater than `content`
+        """
+        number = _to_number(content)
+        if not tag:
+            return None
+        if number is None:
+            return set()
+        with self._lock:
+            return self._get_numbers(tag).above(number)
+
+    def less(self, tag: str, content: str) -> Optional[Set]:
+        """
+        Returns the tracks with a value of `tag` less than `content`.
+        Missing values count as 0.
+        """
+        number = _to_number(content)
+        if not tag:
+            return None
+        if number is None:
+            return set()
+        with self._lock:
+            numbers = self._get_numbers(tag)
+            tracks = numbers.below(number)
+            if number > 0:
+                tracks |= numbers.nulls
+            return tracks
+
+    def _get_tag(self, tag: str) -> _TagValues:
+        values = self._tags.get(tag)
+        if values is None:
+            values = self._tags[tag] = _TagValues()
+            for track in self._values:
+                values.add(track, self._search_values(track, tag))
+        return values
+
+    def _get_numbers(self, tag: str) -> _NumericValues:
+        numbers = self._numbers.get(tag)
+        if numbers is None:
+            numbers = self._numbers[tag] = _NumericValues.build(
+                (track, self._search_values(track, tag)) for track in self._values
+            )
+        return numbers
+
+    def _search_values(self, track, tag: str) -> Tuple[Any, ...]:
+        trvalues = self._values[track]
+        values = trvalues.get(tag)
+        if values is None:
+            values = trvalues[tag] = _search_values(track, tag)
+        return values
+
+    def _indexes(self, tag: str) -> Iterator[Union[_TagValues, _NumericValues]]:
+        for indexes in (self._tags, self._numbers):
+            index = indexes.get(tag)
+            if index is not None:
+                yield index
+
+    def _add(self, track, loc: str) -> None:
+        self._tracks[track] = loc
+        self._locations[loc] = track
+        self._values[track] = {}
+        for tag in set(self._tags) | set(self._numbers):
+            values = self._search_values(track, tag)
+            for index in self._indexes(tag):
+                index.add(track, values)
+
+    def _remove(self, track) -> None:
+        loc = self._tracks.pop(track)
+        if self._locations.get(loc) is track:
+            del self._locations[loc]
+        for tag, values in self._values.pop(track).items():
+            for index in self._indexes(tag):
+                index.remove(track, values)
+
+    def _on_tracks_added(self, type, trackdb, locations):
+        with self._lock:
+            for loc in locations:
+                holder = trackdb.tracks.get(loc)
+                if holder is not None and holder._track not in self._tracks:
+                    self._add(holder._track, loc)
+
+    def _on_tracks_removed(self, type, trackdb, locations):
+        with self._lock:
+            for loc in locations:
+                track = self._locations.get(loc)
+                if track is not None:
+                    self._remove(track)
+
+    def _on_track_tags_changed(self, type, track, tags):
+        if track not in self._tracks:
+            return
+        # Internal tags like __playcount change all the time, but only
+        # matter here if they are indexed. Other tags may be derived from
+        # each other, e.g. albumartist falls back to artist.
+        if tags and all(
+            tag.startswith('__')
+            and tag != '__loc'
+            and tag not in self._tags
+            and tag not in self._numbers
+            for tag in tags
+        ):
+            return
+        with self._lock:
+            loc = self._tracks.get(track)
+            if loc is None:
+                return
+            if '__loc' in tags:
+                loc = track.get_loc_for_io()
+            self._remove(track)
+            self._add(track, loc)
+
+    def _on_tracks_tags_changed(self, type, manager, changes):
+        for track, tags in changes.items():
+            self._on_track_tags_changed(type, track, tags)
@@ -24,9 +24,16 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+import collections
+import copy
+import functools
+import math
+import operator
 import re
-from typing import Collection
+import time
+from typing import Collection, List
 
+from xl import event
 from xl.unicode import shave_marks
 
 __all__ = ['TracksMatcher', 'search_tracks']
@@ -78,6 +85,13 @@ class _Matcher:
     def _matches(self, value):
         raise NotImplementedError
 
+    def candidates(self, index):
+        """
+        Returns a superset of the tracks in a :class:`xl.trax.index.TagIndex`
+        that may match this condition, or None if the index can't tell.
+        """
+        return None
+
 
 class _ExactMatcher(_Matcher):
     """
@@ -98,6 +112,9 @@ class _ExactMatcher(_Matcher):
             newcontent = self.content
         return newvalue == newcontent
 
+    def candidates(self, index):
+        return index.exact(self.tag, self.content)
+
 
 class _InMatcher(_Matcher):
     """
@@ -112,6 +129,9 @@ class _InMatcher(_Matcher):
         except TypeError:
             return False
 
+    def candidates(self, index):
+        return index.substring(self.tag, self.content)
+
 
 class _RegexMatcher(_Matcher):
     """
@@ -144,6 +164,9 @@ class _GtMatcher(_Matcher):
             return False
         return value > content
 
+    def candidates(self, index):
+        return index.greater(self.tag, self.content)
+
 
 class _LtMatcher(_Matcher):
     """
@@ -161,6 +184,9 @@ class _LtMatcher(_Matcher):
             return False
         return value < content
 
+    def candidates(self, index):
+        return index.less(self.tag, self.content)
+
 
 class _NotMetaMatcher:
     """
@@ -176,6 +202,9 @@ class _NotMetaMatcher:
     def match(self, srtrack):
         return not self.matcher.match(srtrack)
 
+    def candidates(self, index):
+        return None
+
 
 class _OrMetaMatcher:
     """
@@ -191,6 +220,9 @@ class _OrMetaMatcher:
     def match(self, srtrack):
         return self.left.match(srtrack) or self.right.match(srtrack)
 
+    def candidates(self, index):
+        return _union_candidates([self.left, self.right], index)
+
 
 class _MultiMetaMatcher:
     """
@@ -209,6 +241,9 @@ class _MultiMetaMatcher:
                 return False
         return True
 
+    def candidates(self, index):
+        return _intersect_candidates(self.matchers, index)
+
 
 class _ManyMultiMetaMatcher:
     """
@@ -239,14 +274,95 @@ class _ManyMultiMetaMatcher:
                     self.tags.update(ma.tags)
         return matched
 
+    def candidates(self, index):
+        return _union_candidates(self.matchers, index)
+
+
+class _SharedMatcher:
+    """
+    Wraps a condition that appears more than once in a query, so that it
+    is only evaluated once per track.
+    """
+
+    __slots__ = ['matcher', 'last']
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.last = (None, False)
+
+    @property
+    def tag(self):
+        return self.matcher.tag
+
+    @property
+    def tags(self):
+        return self.matcher.tags
+
+    def match(self, srtrack):
+        last_srtrack, result = self.last
+        if last_srtrack is not srtrack:
+            result = self.matcher.match(srtrack)
+            self.last = (srtrack, result)
+        return result
+
+    def candidates(self, index):
+        return _candidates(self.matcher, index)
+
+
+class _ProfiledMatcher:
+    """
+    Wraps a condition to count how often it is evaluated, how often it
+    matches and how long that takes. Used by :meth:`TracksMatcher.explain`.
+    """
+
+    __slots__ = ['matcher', 'calls', 'hits', 'elapsed']
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.calls = 0
+        self.hits = 0
+        self.elapsed = 0.0
+
+    @property
+    def tag(self):
+        return self.matcher.tag
+
+    @property
+    def tags(self):
+        return self.matcher.tags
+
+    def match(self, srtrack):
+        start = time.perf_counter()
+        result = self.matcher.match(srtrack)
+        self.elapsed += time.perf_counter() - start
+        self.calls += 1
+        if result:
+            self.hits += 1
+        return result
+
+    def candidates(self, index):
+        return _candidates(self.matcher, index)
+
 
 class TracksMatcher:
     """
     Holds criteria and determines whether
     a given track matches those criteria.
+
+    The search string is parsed into a tree of conditions, which is cached
+    for each search string. The conditions are then ordered so that the
+    ones that are cheap to check and reject many tracks are evaluated
+    first. Conditions that occur more than once are only evaluated once
+    per track.
     """
 
-    __slots__ = ['matchers', 'case_sensitive', 'keyword_tags']
+    __slots__ = [
+        'matchers',
+        'case_sensitive',
+        'keyword_tags',
+        'search_string',
+        '_shared',
+    ]
 
     def __init__(self, search_string, case_sensitive=True, keyword_tags=None):
         """
@@ -258,11 +374,12 @@ class TracksMatcher:
         """
         self.case_sensitive = case_sensitive
         self.keyword_tags = keyword_tags or []
-        search_string = shave_marks(search_string)
-        tokens = self.__tokenize_query(search_string)
-        tokens = self.__red(tokens)
-        tokens = self.__optimize_tokens(tokens)
-        self.matchers = self.__tokens_to_matchers(tokens)
+        self.search_string = shave_marks(search_string)
+        tree = parse_query(self.search_string)
+        builder = _MatcherBuilder(tree, case_sensitive, self.keyword_tags)
+        self.matchers = [builder.build(node) for node in tree[1:]]
+        self._shared = builder.shared
+        self.matchers = _plan_conditions(self.matchers, None)[0]
 
     def append_matcher(self, matcher, or_match=False):
         '''Here so you can use playlist matchers. Probably needs better impl'''
@@ -283,6 +400,8 @@ class TracksMatcher:
         Determine whether a given SearchResultTrack's internal
         Track object matches this search condition.
         """
+        for shared in self._shared:
+            shared.last = (None, False)
         for ma in self.matchers:
             if not ma.match(srtrack):
                 break
@@ -297,203 +416,492 @@ class TracksMatcher:
             return True
         return False
 
-    def __tokens_to_matchers(self, tokens, matchers=None):
-        """
-        Converts a token hierarchy to a list of matchers
+    def candidates(self, index):
         """
-        if not matchers:
-            matchers = []
+        Returns a superset of the tracks in a :class:`xl.trax.index.TagIndex`
+        that may match, or None if the index can't narrow them down.
 
-        # if there's no more tokens, we're done
-        try:
-            token = tokens[0]
-        except IndexError:
-            return matchers
-
-        # is it a special operator?
-        if isinstance(token, list):
-            if len(token) == 1:
-                token = token[0]
-            subtoken = token[0]
-            # NOT
-            if subtoken == "!":
-                nots = self.__tokens_to_matchers(token[1])
-                matchers.append(_NotMetaMatcher(_MultiMetaMatcher(nots)))
-            # OR
-            elif subtoken == "|":
-                left = self.__tokens_to_matchers([token[1][0]])
-                right = self.__tokens_to_matchers([token[1][1]])
-                matchers.append(
-                    _OrMetaMatcher(_MultiMetaMatcher(left), _MultiMetaMatcher(right))
-                )
-            # ()
-            elif subtoken == "(":
-                inner = self.__tokens_to_matchers([token[1]])
-                matchers.append(_MultiMetaMatcher(inner))
+        The conditions are reordered for checking these candidates: the
+        ones the index answered rarely reject a candidate, so they go last.
+        """
+        result = None
+        hoisted = set()
+        for ma in self.matchers:
+            tracks = _candidates(ma, index)
+            if tracks is None:
+                continue
+            hoisted.add(id(ma))
+            if result is None:
+                result = tracks
             else:
-                return matchers
+                result &= tracks
+        self.matchers = _plan_conditions(self.matchers, index, hoisted)[0]
+        return result
 
-        elif token == '':
-            pass
+    def explain(self, trackiter=None, index=None) -> str:
+        """
+        Describes how tracks are matched, as an indented tree with the
+        estimated cost (relative to an exact match) and selectivity (the
+        fraction of tracks expected to match) of each condition.
+
+        :param trackiter: If given, these tracks are searched, and for
+            each condition the number of evaluations and matches as well
+            as the time spent are added.
+        :param index: The :class:`xl.trax.index.TagIndex` to plan with.
+            Defaults to the index of `trackiter` if it is a
+            :class:`xl.trax.TrackDB`.
+        """
+        if index is None and trackiter is not None:
+            get_tag_index = getattr(trackiter, 'get_tag_index', None)
+            if get_tag_index is not None:
+                index = get_tag_index()
+
+        lines = ['Query: %r' % self.search_string]
+        if index is not None:
+            start = time.perf_counter()
+            candidates = self.candidates(index)
+            elapsed = time.perf_counter() - start
+            if candidates is None:
+                lines.append('Index: not used')
+            else:
+                lines.append(
+                    'Index: %d of %d tracks are candidates (%.3f ms)'
+                    % (len(candidates), len(index), elapsed * 1000)
+                )
 
-        # normal token
+        profiled = copy.copy(self)
+        profiled.matchers = [_profile(ma) for ma in self.matchers]
+        if trackiter is not None:
+            start = time.perf_counter()
+            count = sum(1 for _srtr in search_tracks(trackiter, [profiled], index))
+            lines.append(
+                'Matched %d tracks in %.3f ms'
+                % (count, (time.perf_counter() - start) * 1000)
+            )
+
+        cost, selectivity = _plan_conditions(profiled.matchers, index, reorder=False)[
+            1:
+        ]
+        lines.append('AND (cost %.2f, selectivity %.4f)' % (cost, selectivity))
+        for ma in profiled.matchers:
+            _explain(ma, index, 1, lines)
+        return '\n'.join(lines)
+
+
+def _tokenize_query(search):
+    """
+    Turns a search string into a list of tokens.
+    """
+    search = " " + search + " "
+
+    tokens = []
+    newsearch = ""
+    in_quotes = False
+    in_regex = False
+    n = 0
+    while n < len(search):
+        c = search[n]
+        if c == "\\":
+            if not in_regex:
+                n += 1
+            try:
+                newsearch += search[n]
+            except IndexError:
+                pass
+        elif in_quotes and c != "\"":
+            newsearch += c
+        elif c == "~":
+            in_regex = True
+            newsearch += c
+        elif c == "\"":
+            in_quotes = not in_quotes  # toggle
+            # newsearch += c
+        elif c in ["|", "!", "(", ")"]:
+            newsearch += c
+        elif c == " ":
+            in_regex = False
+            tokens.append(newsearch)
+            newsearch = ""
         else:
-            if not self.case_sensitive:
-                lower = lambda x: x.lower()
-            else:
-                lower = lambda x: x
-
-            # TODO: this stuff is kinda repetitive, can we consolidate
-            # it? Maybe move some of this into the matcher classes?
-
-            # exact match in tag
-            if "==" in token:
-                tag, content = token.split("==", 1)
-                if content == "__null__":
-                    content = None
-                matcher = _ExactMatcher(tag, content, lower)
-                matchers.append(matcher)
-
-            # keyword in tag
-            elif "=" in token:
-                tag, content = token.split("=", 1)
-                content = content.strip().strip('"')
-                matcher = _InMatcher(tag, content, lower)
-                matchers.append(matcher)
-
-            elif ">" in token:
-                tag, content = token.split(">", 1)
-                content = content.strip().strip('"')
-                matcher = _GtMatcher(tag, content, lower)
-                matchers.append(matcher)
-
-            elif "<" in token:
-                tag, content = token.split("<", 1)
-                content = content.strip().strip('"')
-                matcher = _LtMatcher(tag, content, lower)
-                matchers.append(matcher)
-
-            elif "~" in token:
-                tag, content = token.split("~", 1)
-                content = content.strip().strip('"')
-                matcher = _RegexMatcher(tag, content, lower)
-                matchers.append(matcher)
-
-            # plain keyword
-            else:
-                content = token.strip().strip('"')
-                mmm = []
-                for tag in self.keyword_tags:
-                    matcher = _InMatcher(tag, content, lower)
-                    mmm.append(matcher)
-                matchers.append(_ManyMultiMetaMatcher(mmm))
+            newsearch += c
+        n += 1
+    return tokens
 
-        return self.__tokens_to_matchers(tokens[1:], matchers)
 
-    def __tokenize_query(self, search):
-        """
-        Turns a search string into a list of tokens.
-        """
-        search = " " + search + " "
-
-        tokens = []
-        newsearch = ""
-        in_quotes = False
-        in_regex = False
-        n = 0
-        while n < len(search):
-            c = search[n]
-            if c == "\\":
-                if not in_regex:
-                    n += 1
-                try:
-                    newsearch += search[n]
-                except IndexError:
-                    pass
-            elif in_quotes and c != "\"":
-                newsearch += c
-            elif c == "~":
-                in_regex = True
-                newsearch += c
-            elif c == "\"":
-                in_quotes = not in_quotes  # toggle
-                # newsearch += c
-            elif c in ["|", "!", "(", ")"]:
-                newsearch += c
-            elif c == " ":
-                in_regex = False
-                tokens.append(newsearch)
-                newsearch = ""
-            else:
-                newsearch += c
-            n += 1
-        return tokens
+def _parse_term(token):
+    """
+    Turns a token that is not an operator into a condition node
+    """
+    # exact match in tag
+    if "==" in token:
+        tag, content = token.split("==", 1)
+        if content == "__null__":
+            content = None
+        return ('==', tag, content)
 
-    def __red(self, tokens):
-        """
-        Turn the token list into a token list hierarchy that is
-        easier to parse.
-        """
-        # base case since we use recursion
-        if tokens == []:
-            return []
-
-        # handle parentheses
-        elif "(" in tokens:
-            num_found = 0
-            start = None
-            end = None
-            count = 0
-            for t in tokens:
-                if t == "(":
-                    if start is None:
-                        start = count
-                    else:
-                        num_found += 1
-                elif t == ")":
-                    if end is None and num_found == 0:
-                        end = count
-                    else:
-                        num_found -= 1
-                if start and end:
+    for op in ('=', '>', '<', '~'):
+        if op in token:
+            tag, content = token.split(op, 1)
+            return (op, tag, content.strip().strip('"'))
+
+    # plain keyword
+    return ('keyword', token.strip().strip('"'))
+
+
+class _QueryParser:
+    """
+    Parses the tokens of a search string into a tree of tuples.
+
+    From tightest to loosest binding, the operators are ``( )``, ``!``,
+    ``|`` and the implicit AND between terms. Operators that lack an
+    operand, such as a trailing ``|`` while the user is still typing,
+    are ignored.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = [token for token in tokens if token != '']
+        self.pos = 0
+
+    def parse(self):
+        return self._parse_and(nested=False)
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def _parse_and(self, nested):
+        children = []
+        while True:
+            token = self._peek()
+            if token is None:
+                break
+            if token == ')':
+                self.pos += 1
+                if nested:
                     break
-                count += 1
-            before = tokens[:start]
-            inside = self.__red(tokens[start + 1 : end])
-            after = tokens[end + 1 :]
-            tokens = before + [["(", inside]] + after
-
-        # handle NOT
-        elif "!" in tokens:
-            start = tokens.index("!")
-            end = start + 2
-            before = tokens[:start]
-            inside = tokens[start + 1 : end]
-            after = tokens[end:]
-            tokens = before + [["!", inside]] + after
-
-        # handle OR
-        elif "|" in tokens:
-            start = tokens.index("|")
-            inside = [tokens[start - 1], tokens[start + 1]]
-            before = tokens[: start - 1]
-            after = tokens[start + 2 :]
-            tokens = before + [["|", inside]] + after
-
-        # nothing special, so just return it
+                continue
+            child = self._parse_or()
+            if child is not None:
+                children.append(child)
+        return ('and',) + tuple(children)
+
+    def _parse_or(self):
+        alternatives = []
+        operand = self._parse_not()
+        if operand is not None:
+            alternatives.append(operand)
+        while self._peek() == '|':
+            self.pos += 1
+            operand = self._parse_not()
+            if operand is not None:
+                alternatives.append(operand)
+        if len(alternatives) > 1:
+            return ('or',) + tuple(alternatives)
+        return alternatives[0] if alternatives else None
+
+    def _parse_not(self):
+        token = self._peek()
+        if token is None or token in ('|', ')'):
+            return None
+        self.pos += 1
+        if token == '!':
+            operand = self._parse_not()
+            if operand is None:
+                return None
+            return ('not', operand)
+        if token == '(':
+            return self._parse_and(nested=True)
+        return _parse_term(token)
+
+
+def _simplify(node):
+    """
+    Removes repeated terms from AND and OR nodes
+    """
+    kind = node[0]
+    if kind in ('and', 'or'):
+        children = []
+        for child in node[1:]:
+            child = _simplify(child)
+            if child not in children:
+                children.append(child)
+        if kind == 'or' and len(children) == 1:
+            return children[0]
+        return (kind,) + tuple(children)
+    if kind == 'not':
+        return ('not', _simplify(node[1]))
+    return node
+
+
+@functools.lru_cache(maxsize=256)
+def parse_query(search_string):
+    """
+    Parses a search string into a tree of tuples. Inner nodes are
+    ``('and', child...)``, ``('or', child...)`` and ``('not', child)``;
+    leaves are ``(operator, tag, content)`` or ``('keyword', content)``.
+    The root is always an AND node.
+
+    Results are cached, so the returned tree must not be modified.
+
+    :param search_string: The search string, with marks already shaved
+    """
+    return _simplify(_QueryParser(_tokenize_query(search_string)).parse())
+
+
+def _iter_leaves(node):
+    if node[0] in ('and', 'or', 'not'):
+        for child in node[1:]:
+            yield from _iter_leaves(child)
+    else:
+        yield node
+
+
+class _MatcherBuilder:
+    """
+    Creates the matchers for a tree returned by :func:`parse_query`
+    """
+
+    def __init__(self, tree, case_sensitive, keyword_tags):
+        if not case_sensitive:
+            self.lower = lambda x: x.lower()
         else:
-            return tokens
+            self.lower = lambda x: x
+        self.keyword_tags = keyword_tags
+        counts = collections.Counter(_iter_leaves(tree))
+        self.repeated = {leaf for leaf, count in counts.items() if count > 1}
+        self.built = {}
+        self.shared = []
+
+    def build(self, node):
+        kind = node[0]
+        if kind == 'and':
+            return _MultiMetaMatcher([self.build(child) for child in node[1:]])
+        if kind == 'or':
+            matcher = None
+            for child in node[1:]:
+                alternative = _MultiMetaMatcher([self.build(child)])
+                if matcher is None:
+                    matcher = alternative
+                else:
+                    matcher = _OrMetaMatcher(matcher, alternative)
+            return matcher
+        if kind == 'not':
+            return _NotMetaMatcher(_MultiMetaMatcher([self.build(node[1])]))
+
+        if node not in self.repeated:
+            return self._build_leaf(node)
+        matcher = self.built.get(node)
+        if matcher is None:
+            matcher = self.built[node] = _SharedMatcher(self._build_leaf(node))
+            self.shared.append(matcher)
+        return matcher
+
+    def _build_leaf(self, node):
+        kind = node[0]
+        if kind == 'keyword':
+            return _ManyMultiMetaMatcher(
+                [_InMatcher(tag, node[1], self.lower) for tag in self.keyword_tags]
+            )
+        _op, tag, content = node
+        return _LEAF_MATCHERS[kind](tag, content, self.lower)
+
+
+_LEAF_MATCHERS = {
+    '==': _ExactMatcher,
+    '=': _InMatcher,
+    '>': _GtMatcher,
+    '<': _LtMatcher,
+    '~': _RegexMatcher,
+}
+
+#: Estimated cost of checking a condition on a track, relative to an
+#: exact match
+_CONDITION_COSTS = {
+    _ExactMatcher: 1.0,
+    _InMatcher: 1.5,
+    _GtMatcher: 2.0,
+    _LtMatcher: 2.0,
+    _RegexMatcher: 4.0,
+}
+
+#: Fraction of tracks a condition is assumed to match, when there are
+#: no better estimates
+_CONDITION_SELECTIVITY = {
+    _ExactMatcher: 0.05,
+    _InMatcher: 0.5,
+    _GtMatcher: 0.5,
+    _LtMatcher: 0.5,
+    _RegexMatcher: 0.25,
+}
+
+
+def _estimate_condition(matcher, index):
+    """
+    Returns the (cost, selectivity) of a single condition
+    """
+    cost = _CONDITION_COSTS.get(type(matcher), 1.0)
+    selectivity = _CONDITION_SELECTIVITY.get(type(matcher), 0.5)
+    distinct = None
+    if index is not None:
+        distinct = index.cardinality(matcher.tag)
+
+    if isinstance(matcher, _ExactMatcher) and matcher.content is not None:
+        if distinct:
+            selectivity = 1.0 / distinct
+    elif isinstance(matcher, _InMatcher) and matcher.content:
+        # every extra character makes a substring less likely to match
+        selectivity **= len(matcher.content)
+        if distinct:
+            selectivity = max(selectivity, 1.0 / distinct)
+    return cost, selectivity
+
+
+def _plan(matcher, index, reorder=True):
+    """
+    Reorders the conditions below a matcher.
 
-        return self.__red(tokens)
+    :param reorder: False to only estimate the current order
+    :returns: the (cost, selectivity) of the matcher
+    """
+    if isinstance(matcher, (_SharedMatcher, _ProfiledMatcher)):
+        return _plan(matcher.matcher, index, reorder)
+    if isinstance(matcher, _Matcher):
+        return _estimate_condition(matcher, index)
+    if isinstance(matcher, _MultiMetaMatcher):
+        matchers, cost, selectivity = _plan_conditions(
+            matcher.matchers, index, reorder=reorder
+        )
+        matcher.matchers = matchers
+        return cost, selectivity
+    if isinstance(matcher, _OrMetaMatcher):
+        left = _plan(matcher.left, index, reorder)
+        right = _plan(matcher.right, index, reorder)
+        if reorder and _or_rank(*right) < _or_rank(*left):
+            matcher.left, matcher.right = matcher.right, matcher.left
+            left, right = right, left
+        cost = left[0] + (1 - left[1]) * right[0]
+        return cost, 1 - (1 - left[1]) * (1 - right[1])
+    if isinstance(matcher, _NotMetaMatcher):
+        cost, selectivity = _plan(matcher.matcher, index, reorder)
+        return cost, 1 - selectivity
+    if isinstance(matcher, _ManyMultiMetaMatcher):
+        # all keyword tags are checked to find out which ones match
+        cost, rejected = 0.0, 1.0
+        for ma in matcher.matchers:
+            ma_cost, ma_selectivity = _plan(ma, index, reorder)
+            cost += ma_cost
+            rejected *= 1 - ma_selectivity
+        return cost, 1 - rejected
+    # e.g. TracksInList from smart playlists
+    return 1.0, 0.5
+
+
+def _and_rank(cost, selectivity):
+    if selectivity >= 1:
+        return math.inf
+    return cost / (1 - selectivity)
+
+
+def _or_rank(cost, selectivity):
+    if selectivity <= 0:
+        return math.inf
+    return cost / selectivity
+
+
+def _plan_conditions(matchers, index, hoisted=frozenset(), reorder=True):
+    """
+    Orders conditions that all have to match so that the expected cost
+    of rejecting a track is as low as possible.
 
-    def __optimize_tokens(self, tokens):
-        """
-        Attempt to optimize tokens, to speed up matching.
-        """
-        # longer queries tend to reject more tracks, which speeds up
-        # processing, so we put them first.
-        tokens.sort(key=len)
-        return tokens
+    :param hoisted: ids of the matchers that were used to find candidates
+        in the index; they hardly reject any of those, so they go last
+    :param reorder: False to only estimate the current order
+    :returns: (ordered matchers, cost, selectivity)
+    """
+    planned = []
+    for ma in matchers:
+        cost, selectivity = _plan(ma, index, reorder)
+        residual = 1.0 if id(ma) in hoisted else selectivity
+        planned.append((_and_rank(cost, residual), ma, cost, selectivity))
+    if reorder:
+        planned.sort(key=operator.itemgetter(0))
+
+    total_cost, passed = 0.0, 1.0
+    for _rank, _ma, cost, selectivity in planned:
+        total_cost += passed * cost
+        passed *= selectivity
+    return [ma for _rank, ma, _c, _s in planned], total_cost, passed
+
+
+def _profile(matcher):
+    """
+    Returns a copy of a matcher tree with every node wrapped in a
+    _ProfiledMatcher
+    """
+    if isinstance(matcher, _MultiMetaMatcher):
+        matcher = _MultiMetaMatcher([_profile(ma) for ma in matcher.matchers])
+    elif isinstance(matcher, _OrMetaMatcher):
+        matcher = _OrMetaMatcher(_profile(matcher.left), _profile(matcher.right))
+    elif isinstance(matcher, _NotMetaMatcher):
+        matcher = _NotMetaMatcher(_profile(matcher.matcher))
+    elif isinstance(matcher, _ManyMultiMetaMatcher):
+        matcher = _ManyMultiMetaMatcher([_profile(ma) for ma in matcher.matchers])
+    return _ProfiledMatcher(matcher)
+
+
+def _describe(matcher):
+    if isinstance(matcher, _SharedMatcher):
+        return '%s [shared]' % _describe(matcher.matcher)
+    if isinstance(matcher, _Matcher):
+        for op, cls in _LEAF_MATCHERS.items():
+            if type(matcher) is cls:
+                content = matcher.content
+                if content is None:
+                    content = '__null__'
+                return '%s%s%r' % (matcher.tag, op, content)
+    names = {
+        _MultiMetaMatcher: 'AND',
+        _OrMetaMatcher: 'OR',
+        _NotMetaMatcher: 'NOT',
+        _ManyMultiMetaMatcher: 'ANY TAG',
+    }
+    return names.get(type(matcher), type(matcher).__name__)
+
+
+def _explain(profiled, index, depth, lines):
+    """
+    Appends the description of a _ProfiledMatcher tree to lines
+    """
+    matcher = profiled.matcher
+    cost, selectivity = _plan(matcher, index, reorder=False)
+    line = '%s%s (cost %.2f, selectivity %.4f' % (
+        '  ' * depth,
+        _describe(matcher),
+        cost,
+        selectivity,
+    )
+    if index is not None and _candidates(matcher, index) is not None:
+        line += ', indexed'
+    line += ')'
+    if profiled.calls:
+        line += ': %d calls, %d matches, %.3f ms' % (
+            profiled.calls,
+            profiled.hits,
+            profiled.elapsed * 1000,
+        )
+    lines.append(line)
+
+    if isinstance(matcher, (_MultiMetaMatcher, _ManyMultiMetaMatcher)):
+        children = matcher.matchers
+    elif isinstance(matcher, _OrMetaMatcher):
+        children = [matcher.left, matcher.right]
+    elif isinstance(matcher, _NotMetaMatcher):
+        children = [matcher.matcher]
+    else:
+        children = []
+    for child in children:
+        _explain(child, index, depth + 1, lines)
 
 
 class TracksInList:
@@ -513,6 +921,9 @@ class TracksInList:
     def match(self, track):
         return track.track in self._tracks
 
+    def candidates(self, index):
+        return set(self._tracks)
+
 
 class TracksNotInList(TracksInList):
     """
@@ -522,14 +933,68 @@ class TracksNotInList(TracksInList):
     def match(self, track):
         return track.track not in self._tracks
 
+    def candidates(self, index):
+        return None
 
-def search_tracks(trackiter, trackmatchers: Collection[TracksMatcher]):
+
+def _candidates(matcher, index):
+    # matchers from plugins may not know about indexes
+    candidates = getattr(matcher, 'candidates', None)
+    if candidates is None:
+        return None
+    return candidates(index)
+
+
+def _intersect_candidates(matchers, index):
+    result = None
+    for ma in matchers:
+        tracks = _candidates(ma, index)
+        if tracks is None:
+            continue
+        if result is None:
+            result = tracks
+        else:
+            result &= tracks
+        if not result:
+            break
+    return result
+
+
+def _union_candidates(matchers, index):
+    result = set()
+    for ma in matchers:
+        tracks = _candidates(ma, index)
+        if tracks is None:
+            return None
+        result |= tracks
+    return result
+
+
+def search_tracks(trackiter, trackmatchers: Collection[TracksMatcher], index=None):
     """
     Search a set of tracks for those that match specified conditions.
 
+    If an index is available, only the tracks it returns as candidates are
+    checked against the matchers. Objects with a ``get_tag_index`` method,
+    like :class:`xl.trax.TrackDB` and :class:`xl.playlist.Playlist`, use
+    their own index. Either way, results keep the order and duplicates of
+    `trackiter`.
+
     :param trackiter: An iterable object returning Track objects
     :param trackmatchers: A list of TrackMatcher objects
+    :param index: A :class:`xl.trax.index.TagIndex` containing all tracks
+        of `trackiter`, used to skip tracks that cannot match
     """
+    get_tag_index = getattr(trackiter, 'get_tag_index', None)
+    if index is None and get_tag_index is not None:
+        index = get_tag_index()
+    if index is not None:
+        candidates = _intersect_candidates(trackmatchers, index)
+        if candidates is not None:
+            trackiter = (
+                tr for tr in trackiter if getattr(tr, 'track', tr) in candidates
+            )
+
     for srtr in trackiter:
         if not isinstance(srtr, SearchResultTrack):
             srtr = SearchResultTrack(srtr)
@@ -538,7 +1003,7 @@ def search_tracks(trackiter, trackmatchers: Collection[TracksMatcher]):
 
 
 def search_tracks_from_string(
-    trackiter, search_string, case_sensitive=True, keyword_tags=None
+    trackiter, search_string, case_sensitive=True, keyword_tags=None, index=None
 ):
     """
     Convenience wrapper around search_tracks that builds matchers
@@ -552,7 +1017,7 @@ def search_tracks_from_string(
             search_string, case_sensitive=case_sensitive, keyword_tags=keyword_tags
         )
     ]
-    return search_tracks(trackiter, matchers)
+    return search_tracks(trackiter, matchers, index=index)
 
 
 def match_track_from_string(
@@ -562,3 +1027,114 @@ def match_track_from_string(
         search_string, case_sensitive=case_sensitive, keyword_tags=keyword_tags
     )
     return matcher.match(SearchResultTrack(track))
+
+
+def _implies(node, other):
+    """
+    Returns whether every track matched by the tree `node` is also
+    matched by the tree `other`. This errs on the side of False.
+    """
+    if node == other:
+        return True
+    if other[0] == 'and':
+        return all(_implies(node, child) for child in other[1:])
+    if node[0] == 'or':
+        return all(_implies(child, other) for child in node[1:])
+    if node[0] == 'and' and any(_implies(child, other) for child in node[1:]):
+        return True
+    if other[0] == 'or' and any(_implies(node, child) for child in other[1:]):
+        return True
+    if node[0] == 'not' and other[0] == 'not':
+        return _implies(other[1], node[1])
+    if node[0] != other[0] or node[0] in ('and', 'or', 'not'):
+        return False
+
+    if node[0] == 'keyword':
+        return other[1] in node[1]
+    kind, tag, content = node
+    if tag != other[1]:
+        return False
+    if kind == '=':
+        return other[2] in content
+    if kind in ('>', '<'):
+        try:
+            bound, other_bound = float(content), float(other[2])
+        except ValueError:
+            return False
+        if kind == '>':
+            return bound >= other_bound
+        return bound <= other_bound
+    return False
+
+
+def is_refinement(search_string, previous_search_string):
+    """
+    Returns whether all tracks matching `search_string` also match
+    `previous_search_string`, e.g. because a character or a condition
+    was added. Both strings must be used with the same keyword tags.
+    """
+    return _implies(
+        parse_query(shave_marks(search_string)),
+        parse_query(shave_marks(previous_search_string)),
+    )
+
+
+class SearchSession:
+    """
+    Searches the same tracks again and again with changing search
+    strings, as happens while the user types into a filter box.
+
+    When a search string is a refinement of the previous one, only the
+    previous results are searched. Other search strings search all
+    tracks, using an index if there is one.
+
+    Previous results are forgotten when the tags of a track change. Call
+    :meth:`reset` when tracks are added or removed.
+    """
+
+    def __init__(self, trackiter, case_sensitive=True, keyword_tags=None, index=None):
+        """
+        :param trackiter: The tracks to search. The order is kept in
+            the results.
+        :param index: see :func:`search_tracks`
+        """
+        self.trackiter = trackiter
+        self.case_sensitive = case_sensitive
+        self.keyword_tags = keyword_tags
+        self.index = index
+        self._previous = None
+        self._generation = 0
+        event.add_callback(self._on_track_tags_changed, 'track_tags_changed')
+        event.add_callback(self._on_track_tags_changed, 'tracks_tags_changed')
+
+    def search(self, search_string) -> List[SearchResultTrack]:
+        """
+        Returns the tracks matching search_string
+        """
+        matcher = TracksMatcher(
+            search_string,
+            case_sensitive=self.case_sensitive,
+            keyword_tags=self.keyword_tags,
+        )
+        tree = parse_query(matcher.search_string)
+        generation = self._generation
+        previous = self._previous
+        if previous is not None and _implies(tree, previous[0]):
+            tracks = [srtr.track for srtr in previous[1]]
+            results = list(search_tracks(tracks, [matcher]))
+        else:
+            results = list(search_tracks(self.trackiter, [matcher], index=self.index))
+        # tags may have changed while searching
+        if generation == self._generation:
+            self._previous = (tree, results)
+        return list(results)
+
+    def reset(self) -> None:
+        """
+        Makes the next search go through all tracks
+        """
+        self._generation += 1
+        self._previous = None
+
+    def _on_track_tags_changed(self, type, track, tags):
+        self.reset()
@@ -25,12 +25,14 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+from collections import OrderedDict
 from copy import deepcopy
 import logging
 import operator
 import re
+import threading
 import time
-from typing import Dict, Generic, List, Optional, TypeVar, Union
+from typing import Any, Callable, Dict, Generic, List, Optional, TypeVar, Union
 import unicodedata
 import weakref
 
@@ -50,6 +52,12 @@ _K = TypeVar('_K')
 _V = TypeVar('_V')
 _V1 = TypeVar('_V1')
 
+# options checked for every track that is read or rated
+_WRITE_RATING = settings.bind_option(
+    'collection/write_rating_to_audio_file_metadata', False
+)
+_RATING_MAXIMUM = settings.bind_option('rating/maximum', 5)
+
 # map chars to appropriate substitutes for sorting
 _sortcharmap = {
     'ß': 'ss',  # U+00DF
@@ -149,6 +157,51 @@ class _MetadataCacher(Generic[_K, _V]):
 _CACHER: _MetadataCacher['Track', BaseFormat] = _MetadataCacher()
 
 
+class _HydrationCache:
+    """
+    LRU of lazily loaded tracks whose tags are currently in memory.
+
+    When more than `maxentries` such tracks are hydrated, the least recently
+    used ones drop their tags again; they are reloaded on next access. Tracks
+    with unsaved changes are never dropped.
+    """
+
+    def __init__(self, maxentries: int = 20000):
+        self.maxentries = maxentries
+        self._tracks: 'OrderedDict[Track, None]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def touch(self, track: 'Track') -> None:
+        with self._lock:
+            if track in self._tracks:
+                self._tracks.move_to_end(track)
+                return
+        self.add(track)
+
+    def add(self, track: 'Track') -> None:
+        with self._lock:
+            self._tracks[track] = None
+            while len(self._tracks) > self.maxentries:
+                oldest, _ = self._tracks.popitem(last=False)
+                if not oldest._dirty:
+                    oldest._dehydrate()
+
+    def remove(self, track: 'Track') -> None:
+        with self._lock:
+            self._tracks.pop(track, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tracks.clear()
+
+
+#: Lazily loaded tracks that are currently hydrated
+_HYDRATED = _HydrationCache()
+
+
 class Track:
     """
     Represents a single track.
@@ -156,18 +209,24 @@ class Track:
 
     # save a little memory this way
     __slots__ = [
-        "__tags",
+        "__tagdict",
+        "_lazy",
         "_scan_valid",
         "_dirty",
         "__weakref__",
         "_init",
         "_is_supported",
+        "_sort_keys",
+        "_tag_generation",
     ]
     # this is used to enforce the one-track-per-uri rule
     __tracksdict = weakref.WeakValueDictionary()
     # store a copy of the settings values here - much faster (0.25 cpu
     # seconds) (see _the_cuts_cb)
     __the_cuts = settings.get_option('collection/strip_list', [])
+    # bumped whenever a setting that affects sort keys changes, which
+    # invalidates the sort keys cached on every track (see get_tag_sort)
+    __sort_generation = 0
 
     def __new__(cls, *args, **kwargs):
         """
@@ -254,9 +313,14 @@ class Track:
         if self._init is False:
             return
 
-        self.__tags = {}
+        self.__tagdict = {}
+        self._lazy = None
         self._scan_valid = None  # whether our last tag read attempt worked
         self._is_supported = None
+        self._sort_keys = None
+        #: Incremented whenever a tag changes, so values derived from
+        #: the tags can tell if they are stale
+        self._tag_generation = 0
 
         # This is not used by write_tags, this is used by the collection to
         # indicate that the tags haven't been written to the collection
@@ -273,12 +337,106 @@ class Track:
         else:
             raise ValueError("Cannot create a Track from nothing")
 
+    @classmethod
+    def _restore(
+        cls,
+        loc: str,
+        tags: Optional[Dict[str, Any]] = None,
+        key: Any = None,
+        loader: Optional[Callable[[Any], Optional[Dict[str, Any]]]] = None,
+    ) -> 'Track':
+        """
+        Internal API for TrackDB: recreate a track from stored state.
+
+        Unlike ``Track(_unpickles=...)``, this trusts *loc* to already be a
+        normalised URI and takes ownership of *tags* instead of copying them.
+
+        If *tags* is None, the track is created as a lightweight handle:
+        ``loader(key)`` is called to fetch the tags the first time they are
+        needed, and they may be dropped again later (see `_HydrationCache`).
+
+        As with the normal constructor, if a track with this location already
+        exists, that track is returned instead.
+        """
+        tr = cls.__tracksdict.get(loc)
+        if tr is not None:
+            if tags is not None:
+                existing = tr.list_tags()
+                to_set = {
+                    tag: values
+                    for tag, values in tags.items()
+                    if tag.startswith('__') and tag not in existing
+                }
+                if to_set:
+                    tr.set_tags(**to_set)
+            return tr
+
+        tr = object.__new__(cls)
+        tr._init = False
+        tr._scan_valid = None
+        tr._is_supported = None
+        tr._sort_keys = None
+        tr._tag_generation = 0
+        tr._dirty = False
+        if tags is None:
+            tr.__tagdict = None
+            tr._lazy = (loc, key, loader)
+        else:
+            tr.__tagdict = tags
+            tr._lazy = None
+        cls.__tracksdict[loc] = tr
+        return tr
+
+    @property
+    def __tags(self) -> Dict[str, Any]:
+        """
+        The tag dictionary, loaded on demand for lazily restored tracks
+        """
+        tags = self.__tagdict
+        if tags is None:
+            tags = self.__hydrate()
+        elif self._lazy is not None:
+            _HYDRATED.touch(self)
+        return tags
+
+    def __hydrate(self) -> Dict[str, Any]:
+        loc, key, loader = self._lazy
+        tags = None
+        try:
+            tags = loader(key)
+        except Exception:
+            logger.exception("Error loading tags for %s", loc)
+        if tags is None:
+            tags = {'__loc': loc}
+        self.__tagdict = tags
+        _HYDRATED.add(self)
+        return tags
+
+    def _dehydrate(self) -> None:
+        """
+        Drop the tags of a lazily restored track; they are reloaded from
+        the database on next access.
+        """
+        if self._lazy is not None and not self._dirty:
+            self.__tagdict = None
+
+    def _detach(self) -> None:
+        """
+        Load the tags of a lazily restored track and keep them in memory
+        from now on. Call this before the backing database entry goes away.
+        """
+        if self._lazy is not None:
+            if self.__tagdict is None:
+                self.__hydrate()
+            self._lazy = None
+            _HYDRATED.remove(self)
+
     def __register(self):
         """
         Register this instance into the global registry of Track
         objects.
         """
-        self.__tracksdict[self.__tags['__loc']] = self
+        self.__tracksdict[self.get_loc_for_io()] = self
 
     def __unregister(self):
         """
@@ -286,7 +444,7 @@ class Track:
         Track objects.
         """
         try:
-            del self.__tracksdict[self.__tags['__loc']]
+            del self.__tracksdict[self.get_loc_for_io()]
         except KeyError:
             pass
 
@@ -297,8 +455,12 @@ class Track:
         :param loc: the location, as either a uri or a file path.
         """
         self.__unregister()
+        # the stored entry would still point at the old location
+        self._detach()
         gloc = Gio.File.new_for_commandline_arg(loc)
         self.__tags['__loc'] = gloc.get_uri()
+        self._sort_keys = None
+        self._tag_generation += 1
         self.__register()
         if notify_changed:
             event.log_event('track_tags_changed', self, {'__loc'})
@@ -317,7 +479,11 @@ class Track:
         Safe for IO operations via gio, not suitable for display to users
         as it may be in non-utf-8 encodings.
         """
-        return self.__tags['__loc']
+        tags = self.__tagdict
+        if tags is None:
+            # lazily restored track, don't load all tags just for this
+            return self._lazy[0]
+        return tags['__loc']
 
     def get_local_path(self):
         """
@@ -366,7 +532,7 @@ class Track:
         `xl.metadata` otherwise.
         """
         try:
-            f = metadata.get_format(self.get_loc_for_io())
+            f = metadata.get_format(self.get_loc_for_io(), self.__tags.get('__format'))
             if f is None:
                 return False  # not a supported type
             f.write_tags(self.__tags)
@@ -403,54 +569,55 @@ class Track:
 
         loc = self.get_loc_for_io()
         try:
-            # Retrieve file specific metadata
-            gloc = Gio.File.new_for_uri(loc)
-            mtime = (
-                gloc.query_info("time::modified", Gio.FileQueryInfoFlags.NONE, None)
-                .get_modification_date_time()
-                .to_unix()
+            modified = None if force else self.__tags.get('__modified', 0)
+            f, ntags = metadata.read_tags(
+                loc, modified, hint=self.__tags.get('__format')
             )
-            f = metadata.get_format(loc)
-            if not force and self.__tags.get('__modified', 0) >= mtime:
-                return f
+            return self._apply_file(f, ntags, notify_changed=notify_changed)
+        except Exception:
+            self._scan_valid = False
+            logger.exception("Error reading tags for %s", loc)
+            return False
 
-            # Read the tags
-            ntags = f.read_all()
-            ntags['__modified'] = mtime
+    def _apply_file(self, f, ntags, notify_changed=True):
+        """
+        Internal API: updates this track with the result of
+        `xl.metadata.read_tags`.
 
-            # TODO: this probably breaks on non-local files
-            ntags['__basedir'] = gloc.get_parent().get_path()
+        :returns: False if the file is not supported, the Format otherwise
+        """
+        if f is None:
+            self._is_supported = False
+            self._scan_valid = False
+            return False
+        self._is_supported = True
+        if ntags is None:
+            return f
 
-            if '__rating' in ntags and settings.get_option(
-                'collection/write_rating_to_audio_file_metadata', False
-            ):
-                ntags['__rating'] = int(ntags['__rating'][0])
+        if '__rating' in ntags and _WRITE_RATING.value:
+            ntags['__rating'] = int(ntags['__rating'][0])
 
-            # remove tags that could be in the file, but are in fact not
-            # in the file. Retain tags in the DB that aren't supported by
-            # the file format.
+        # remove tags that could be in the file, but are in fact not
+        # in the file. Retain tags in the DB that aren't supported by
+        # the file format.
 
-            nkeys = set(ntags.keys())
-            ekeys = {k for k in self.__tags if not k.startswith('__')}
+        nkeys = set(ntags.keys())
+        ekeys = {k for k in self.__tags if not k.startswith('__')}
 
-            # delete anything that wasn't in the new tags
-            to_del = ekeys - nkeys
+        # delete anything that wasn't in the new tags
+        to_del = ekeys - nkeys
 
-            # but if not others set, only delete supported tags
-            if not f.others:
-                to_del &= set(f.tag_mapping.keys())
+        # but if not others set, only delete supported tags
+        if not f.others:
+            to_del &= set(f.tag_mapping.keys())
 
-            for tag in to_del:
-                ntags[tag] = None
+        for tag in to_del:
+            ntags[tag] = None
 
-            self.set_tags(notify_changed=notify_changed, **ntags)
+        self.set_tags(notify_changed=notify_changed, **ntags)
 
-            self._scan_valid = True
-            return f
-        except Exception:
-            self._scan_valid = False
-            logger.exception("Error reading tags for %s", loc)
-            return False
+        self._scan_valid = True
+        return f
 
     def is_local(self):
         """
@@ -509,7 +676,7 @@ class Track:
 
         internal use only please
         """
-        self.__tags = deepcopy(pickle_obj)
+        self.__tagdict = deepcopy(pickle_obj)
 
     def list_tags(self):
         """
@@ -604,6 +771,8 @@ class Track:
 
         if changed:
             self._dirty = True
+            self._sort_keys = None
+            self._tag_generation += 1
             if notify_changed:
                 event.log_event("track_tags_changed", self, changed)
 
@@ -654,6 +823,23 @@ class Track:
         :param extend_title: If the title tag is unknown, try to
             add some identifying information to it.
         """
+        if not join:
+            return self.__get_tag_sort(tag, False, artist_compilations)
+
+        # Joined values are immutable, so they can be handed out from a
+        # cache that lives until the tags or the relevant settings change
+        generation = Track.__sort_generation
+        cache = self._sort_keys
+        if cache is None or cache[0] != generation:
+            cache = self._sort_keys = (generation, {})
+        key = (tag, artist_compilations)
+        try:
+            return cache[1][key]
+        except KeyError:
+            value = cache[1][key] = self.__get_tag_sort(tag, True, artist_compilations)
+            return value
+
+    def __get_tag_sort(self, tag, join, artist_compilations):
         # The two magic values here are to ensure that compilations
         # and unknown values are always sorted below all normal
         # values.
@@ -732,7 +918,7 @@ class Track:
             add some identifying information to it.
         """
         if tag == '__loc':
-            return Gio.File.new_for_uri(self.__tags['__loc']).get_parse_name()
+            return Gio.File.new_for_uri(self.get_loc_for_io()).get_parse_name()
 
         value = None
         if tag == "albumartist":
@@ -833,7 +1019,7 @@ class Track:
         if value is None:
             value = '__null__'
             if tag == 'title':
-                extraformat += ' __loc==\"%s\"' % self.__tags['__loc']
+                extraformat += ' __loc==\"%s\"' % self.get_loc_for_io()
         elif format:
             if isinstance(value, list):
                 value = ['"%s"' % self.quoter(val) for val in value]
@@ -861,7 +1047,9 @@ class Track:
         f = _CACHER.get(self)
         if not f:
             try:
-                f = metadata.get_format(self.get_loc_for_io())
+                f = metadata.get_format(
+                    self.get_loc_for_io(), self.get_tag_raw('__format')
+                )
             except Exception:  # TODO: What exception?
                 return None
             if not f:
@@ -928,7 +1116,7 @@ class Track:
         except (TypeError, KeyError, ValueError):
             return 0
 
-        maximum = settings.get_option("rating/maximum", 5)
+        maximum = _RATING_MAXIMUM.value
         rating = int(round(rating * float(maximum) / 100.0))
 
         if rating > maximum:
@@ -945,7 +1133,7 @@ class Track:
 
         Returns the scaled rating
         """
-        maximum = settings.get_option("rating/maximum", 5)
+        maximum = _RATING_MAXIMUM.value
         rating = min(rating, maximum)
         rating = max(0, rating)
         rating = 100 * rating / maximum
@@ -1105,6 +1293,17 @@ class Track:
         """
         if data == "collection/strip_list":
             cls._Track__the_cuts = settings.get_option('collection/strip_list', [])
+            cls._Track__sort_generation += 1
+
+    @classmethod
+    def _rating_option_cb(cls, name, obj, data):
+        """
+        PRIVATE
+
+        invalidate cached rating sort keys when the rating scale changes
+        """
+        if data == "rating/maximum":
+            cls._Track__sort_generation += 1
 
     ### Utility method intended for TrackDB ###
 
@@ -1114,9 +1313,7 @@ class Track:
         return len(cls._Track__tracksdict)
 
     def _write_rating_to_disk(self):
-        if not settings.get_option(
-            'collection/write_rating_to_audio_file_metadata', False
-        ):
+        if not _WRITE_RATING.value:
             return False
 
         f = self._get_format_obj()
@@ -1131,3 +1328,4 @@ class Track:
 
 
 event.add_callback(Track._the_cuts_cb, 'collection_option_set')
+event.add_callback(Track._rating_option_cb, 'rating_option_set')
@@ -27,12 +27,15 @@
 
 from copy import deepcopy
 import logging
+import threading
 from time import time
 from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from xl import common, event
+from xl import common, event, sqlitedbm
 from xl.nls import gettext as _
+from xl.trax.index import TagIndex
 from xl.trax.track import Track
+from xl.trax.trackstore import TrackStore
 
 logger = logging.getLogger(__name__)
 
@@ -76,6 +79,9 @@ class TrackDB:
             of :class:`Track` objects.
     :param load_first: Set to True if this collection should be
             loaded before any tracks are created.
+    :param lazy: Set to True to restore tracks as lightweight handles
+            whose tags are only read from the database when first
+            accessed.
     """
 
     def __init__(
@@ -84,6 +90,7 @@ class TrackDB:
         location: str = "",
         pickle_attrs: List[str] = [],
         loadfirst: bool = False,
+        lazy: bool = False,
     ):
         """
         Sets up the trackDB.
@@ -102,6 +109,11 @@ class TrackDB:
 
         self.name = name
         self.location = location
+        self.lazy = lazy
+        #: Read-only store used to hydrate lazily restored tracks
+        self._lazy_db: Optional[sqlitedbm.SqliteDbm] = None
+        self._lazy_store: Optional[TrackStore] = None
+        self._lazy_lock = threading.Lock()
         self._dirty = False
         self.tracks: Dict[str, TrackHolder] = {}  # key is URI of the track
         self.pickle_attrs = pickle_attrs
@@ -109,8 +121,12 @@ class TrackDB:
         self._saving = False
         #: Number to use for the next `tracks-*` database key
         self._key = 0
-        self._dbversion = 2.0
+        self._dbversion = 3.0
         self._deleted_keys = []
+        #: Keys of tracks that were added but have not been saved yet
+        self._unsaved_keys = set()
+        #: Created on the first search, see get_tag_index()
+        self._tag_index: Optional[TagIndex] = None
         if location:
             self.load_from_location()
             self._timeout_save()
@@ -163,14 +179,35 @@ class TrackDB:
 
         :param location: the location to save to
         """
+        if location != self.location:
+            # Lazily restored tracks can only be hydrated from the old
+            # location, and the new one has none of the tracks yet.
+            for holder in self.tracks.values():
+                holder._track._detach()
+            self._close_lazy_db()
+            self._unsaved_keys = {holder._key for holder in self.tracks.values()}
         self.location = location
         self._dirty = True
 
+    def close(self) -> None:
+        """
+        Releases the database connection used by lazily restored tracks.
+        It is opened again if they need their tags later.
+        """
+        self._close_lazy_db()
+
+    def _close_lazy_db(self) -> None:
+        with self._lazy_lock:
+            if self._lazy_db is not None:
+                self._lazy_db.close()
+            self._lazy_db = None
+            self._lazy_store = None
+
     @common.synchronized
     def load_from_location(self, location: Optional[str] = None):
         """
-        Restores :class:`TrackDB` state from the pickled representation
-        stored at the specified location.
+        Restores :class:`TrackDB` state from the database stored at the
+        specified location.
 
         :param location: the location to load the data from
         """
@@ -202,20 +239,14 @@ class TrackDB:
         for attr in self.pickle_attrs:
             try:
                 if 'tracks' == attr:
-                    data = {}
-                    for k in (x for x in pdata.keys() if x.startswith("tracks-")):
-                        p = pdata[k]
-                        tr = Track(_unpickles=p[0])
-                        loc = tr.get_loc_for_io()
-                        if loc not in data:
-                            data[loc] = TrackHolder(tr, p[1], **p[2])
-                        else:
-                            logger.warning("Duplicate track found: %s", loc)
-                            # presumably the second track was written because of an error,
-                            # so use the first track found.
-                            del pdata[k]
-
-                    setattr(self, attr, data)
+                    # the replaced tracks won't be hydrated anymore
+                    self._close_lazy_db()
+                    # lazy tracks are hydrated from our own location only
+                    lazy = self.lazy and location == self.location
+                    store = TrackStore(pdata.dict.conn)
+                    setattr(self, attr, self._load_tracks(store, lazy))
+                    # the index refers to the tracks that were replaced
+                    self._tag_index = None
                 else:
                     setattr(self, attr, pdata.get(attr, getattr(self, attr)))
             except Exception:
@@ -226,11 +257,52 @@ class TrackDB:
 
         self._dirty = False
 
+    def _load_tracks(self, store: TrackStore, lazy: bool) -> Dict[str, TrackHolder]:
+        """
+        Restores the tracks kept in the relational tables of the DB
+        """
+        data = {}
+        duplicates = []
+        if lazy:
+            rows = (
+                (key, Track._restore(loc, key=key, loader=self._load_track_tags), attrs)
+                for key, loc, attrs in store.load_locations()
+            )
+        else:
+            rows = (
+                (key, Track._restore(loc, tags), attrs)
+                for key, loc, tags, attrs in store.load()
+            )
+        for key, tr, attrs in rows:
+            loc = tr.get_loc_for_io()
+            if loc not in data:
+                data[loc] = TrackHolder(tr, key, **attrs)
+            else:
+                logger.warning("Duplicate track found: %s", loc)
+                # presumably the second track was written because of an error,
+                # so use the first track found.
+                duplicates.append(key)
+        if duplicates:
+            store.delete(duplicates)
+        return data
+
+    def _load_track_tags(self, key: int) -> Optional[Dict]:
+        """
+        Loader for lazily restored tracks
+        """
+        with self._lazy_lock:
+            if self._lazy_store is None:
+                self._lazy_db = sqlitedbm.SqliteDbm(self.location, mode='ro')
+                self._lazy_store = TrackStore(self._lazy_db.conn)
+            return self._lazy_store.load_tags(key)
+
     @common.synchronized
     def save_to_location(self, location: Optional[str] = None):
         """
-        Saves a pickled representation of this :class:`TrackDB` to the
-        specified location.
+        Saves this :class:`TrackDB` to the specified location.
+
+        Only tracks that were added or changed since the last save are
+        written, unless saving to a location other than our own.
 
         :param location: the location to save the data to
         """
@@ -262,32 +334,41 @@ class TrackDB:
             logger.exception("Failed to open music DB for writing.")
             return
 
+        own_location = location == self.location
+        if own_location:
+            to_save = [
+                track
+                for track in self.tracks.values()
+                if track._track._dirty or track._key in self._unsaved_keys
+            ]
+        else:
+            to_save = list(self.tracks.values())
+
+        store = TrackStore(pdata.dict.conn)
+        if own_location:
+            store.delete(self._deleted_keys)
+            self._deleted_keys = []
+
         for attr in self.pickle_attrs:
-            # bad hack to allow saving of lists/dicts of Tracks
+            # tracks live in their own tables, only changed ones are written
             if 'tracks' == attr:
-                for k, track in self.tracks.items():
-                    key = "tracks-%s" % track._key
-                    if track._track._dirty or key not in pdata:
-                        pdata[key] = (
-                            track._track._pickles(),
-                            track._key,
-                            deepcopy(track._attrs),
-                        )
+                store.save(
+                    (track._key, track._track._pickles(), track._attrs)
+                    for track in to_save
+                )
+                if own_location:
+                    self._unsaved_keys = set()
             else:
                 pdata[attr] = deepcopy(getattr(self, attr))
 
         pdata['_dbversion'] = self._dbversion
 
-        for key in self._deleted_keys:
-            key = "tracks-%s" % key
-            if key in pdata:
-                del pdata[key]
-
         pdata.sync()
         pdata.close()
 
-        for track in self.tracks.values():
-            track._track._dirty = False
+        if own_location:
+            for track in to_save:
+                track._track._dirty = False
 
         self._dirty = False
         self._saving = False
@@ -342,6 +423,7 @@ class TrackDB:
                 continue
             locations += [location]
             self.tracks[location] = TrackHolder(tr, self._key)
+            self._unsaved_keys.add(self._key)
             self._key += 1
 
         if locations:
@@ -366,7 +448,11 @@ class TrackDB:
         for tr in tracks:
             location = tr.get_loc_for_io()
             locations += [location]
-            self._deleted_keys.append(self.tracks[location]._key)
+            # the track may live on elsewhere, e.g. in a playlist
+            tr._detach()
+            key = self.tracks[location]._key
+            self._deleted_keys.append(key)
+            self._unsaved_keys.discard(key)
             del self.tracks[location]
 
         event.log_event('tracks_removed', self, locations)
@@ -375,3 +461,14 @@ class TrackDB:
 
     def get_tracks(self) -> List[Track]:
         return list(self)
+
+    @common.synchronized
+    def get_tag_index(self) -> TagIndex:
+        """
+        Returns the index used by :func:`xl.trax.search_tracks` to avoid
+        looking at every track of this database. It is created on first
+        use and kept up to date from then on.
+        """
+        if self._tag_index is None:
+            self._tag_index = TagIndex(self)
+        return self._tag_index
@@ -0,0 +1,305 @@
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+#
+# The developers of the Exaile media player hereby grant permission
+# for non-GPL compatible GStreamer and Exaile plugins to be used and
+# distributed together with GStreamer and Exaile. This permission is
+# above and beyond the permissions granted by the GPL license by which
+# Exaile is covered. If you modify this code, you may extend this
+# exception to your version of the code, but you are not obligated to
+# do so. If you do not wish to do so, delete this exception statement
+# from your version.
+
+"""
+Relational storage for the tracks of a :class:`xl.trax.TrackDB`.
+
+Tracks are stored in two tables which live next to the ``Dict`` table of
+:class:`xl.sqlitedbm.SqliteDbm`, so a TrackDB still occupies a single file:
+
+* ``Tracks`` has one row per track, keyed by the TrackDB key, with indexed
+  columns for the location and the tags most often queried.
+* ``Tags`` has one row per tag value, so a track's tags can be loaded without
+  unpickling anything.
+"""
+
+__all__ = ['TrackStore']
+
+
+import itertools
+import operator
+import pickle
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from xl import common
+
+#: Tags that get their own indexed column in the Tracks table
+INDEXED_TAGS = ('artist', 'album', 'albumartist', 'genre', 'date')
+
+# Special values of Tags.pos; list items use their index (>= 0)
+_POS_SCALAR = -1  # value is stored as a native SQLite value
+_POS_PICKLED = -2  # value is stored as a pickled BLOB
+
+_NATIVE_TYPES = (str, int, float, bytes)
+
+#: (key, tags, attrs) as kept by a TrackDB for each track
+TrackRow = Tuple[int, Dict[str, Any], Dict[str, Any]]
+
+#: Columns of the Tracks table that have an index
+INDEXED_COLUMNS = ('loc', 'modified') + INDEXED_TAGS
+
+_CREATE_TRACKS = """
+    CREATE TABLE IF NOT EXISTS Tracks (
+        key INTEGER PRIMARY KEY NOT NULL,
+        loc TEXT NOT NULL,
+        artist TEXT,
+        album TEXT,
+        albumartist TEXT,
+        genre TEXT,
+        date TEXT,
+        modified REAL,
+        attrs BLOB
+    )
+"""
+
+# Tags are always read and written per track, so cluster them by key.
+_CREATE_TAGS = """
+    CREATE TABLE IF NOT EXISTS Tags (
+        key INTEGER NOT NULL,
+        tag TEXT NOT NULL,
+        pos INTEGER NOT NULL,
+        value,
+        PRIMARY KEY (key, tag, pos)
+    ) WITHOUT ROWID
+"""
+
+
+def _is_native(value: Any) -> bool:
+    # bool is an int subclass but would not survive the round trip
+    return isinstance(value, _NATIVE_TYPES) and not isinstance(value, bool)
+
+
+def _encode_value(value: Any) -> List[Tuple[int, Any]]:
+    """
+    Converts a tag value into a list of (pos, value) rows
+    """
+    if value is None or _is_native(value):
+        return [(_POS_SCALAR, value)]
+    if isinstance(value, list) and value and all(_is_native(v) for v in value):
+        return list(enumerate(value))
+    return [(_POS_PICKLED, pickle.dumps(value, protocol=common.PICKLE_PROTOCOL))]
+
+
+def _decode_value(rows: List[Tuple[int, Any]]) -> Any:
+    """
+    Inverse of _encode_value; rows must be sorted by pos
+    """
+    pos, value = rows[0]
+    if pos == _POS_SCALAR:
+        return value
+    if pos == _POS_PICKLED:
+        return pickle.loads(value)
+    return [v for _pos, v in rows]
+
+
+def _column_value(value: Any) -> Optional[str]:
+    """
+    Flattens a tag value into the text stored in an indexed column
+    """
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return '\0'.join(str(v) for v in value)
+    return str(value)
+
+
+class TrackStore:
+    """
+    Stores track tags in a relational schema inside a SQLite database.
+
+    All writes of a single call happen in one transaction, and only the
+    tracks passed in are touched, so saving a handful of changed tracks does
+    not rewrite the rest of the collection.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        """
+        :param conn: An open connection, typically the one owned by the
+            :class:`xl.sqlitedbm.SqliteDbm` of a TrackDB shelf.
+        """
+        self.conn = conn
+        with self._transaction():
+            conn.execute(_CREATE_TRACKS)
+            conn.execute(_CREATE_TAGS)
+            for column in INDEXED_COLUMNS:
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS Tracks_%s ON Tracks (%s)"
+                    % (column, column)
+                )
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM Tracks").fetchone()[0]
+
+    def load(self) -> Iterator[Tuple[int, str, Dict[str, Any], Dict[str, Any]]]:
+        """
+        Loads all stored tracks.
+
+        :returns: generator of (key, location, tags, attrs)
+        """
+        tracks = self.conn.execute("SELECT key, loc, attrs FROM Tracks ORDER BY key")
+        tags = self.conn.execute(
+            "SELECT key, tag, pos, value FROM Tags ORDER BY key, tag, pos"
+        )
+        tags_by_key = itertools.groupby(tags, operator.itemgetter(0))
+        current_key, current_rows = next(tags_by_key, (None, iter(())))
+
+        for key, loc, attrs in tracks:
+            # Both cursors are ordered by key, so walk them in lockstep.
+            while current_key is not None and current_key < key:
+                current_key, current_rows = next(tags_by_key, (None, iter(())))
+            if current_key == key:
+                trtags = self._decode_tags(current_rows)
+            else:
+                trtags = {}
+            trtags['__loc'] = loc
+            yield key, loc, trtags, (pickle.loads(attrs) if attrs else {})
+
+    def load_locations(self) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+        """
+        Loads all stored tracks without their tags.
+
+        :returns: generator of (key, location, attrs)
+        """
+        for key, loc, attrs in self.conn.execute(
+            "SELECT key, loc, attrs FROM Tracks ORDER BY key"
+        ):
+            yield key, loc, (pickle.loads(attrs) if attrs else {})
+
+    def load_tags(self, key: int) -> Optional[Dict[str, Any]]:
+        """
+        Loads the tags of a single track.
+
+        :returns: the tags, or None if the key is not stored
+        """
+        row = self.conn.execute("SELECT loc FROM Tracks WHERE key = ?", (key,))
+        row = row.fetchone()
+        if row is None:
+            return None
+        rows = self.conn.execute(
+            "SELECT key, tag, pos, value FROM Tags WHERE key = ? ORDER BY tag, pos",
+            (key,),
+        )
+        trtags = self._decode_tags(rows)
+        trtags['__loc'] = row[0]
+        return trtags
+
+    @staticmethod
+    def _decode_tags(rows: Iterable[Tuple[int, str, int, Any]]) -> Dict[str, Any]:
+        trtags = {}
+        for tag, tagrows in itertools.groupby(rows, operator.itemgetter(1)):
+            trtags[tag] = _decode_value(
+                [(pos, value) for _k, _t, pos, value in tagrows]
+            )
+        return trtags
+
+    def save(self, rows: Iterable[TrackRow]) -> int:
+        """
+        Inserts or replaces tracks.
+
+        :param rows: (key, tags, attrs) for each track to write
+        :returns: number of tracks written
+        """
+        count = 0
+        conn = self.conn
+        with self._transaction():
+            for key, trtags, attrs in rows:
+                conn.execute("DELETE FROM Tags WHERE key = ?", (key,))
+                conn.executemany(
+                    "INSERT INTO Tags VALUES (?, ?, ?, ?)",
+                    (
+                        (key, tag, pos, value)
+                        for tag, tagvalue in trtags.items()
+                        if tag != '__loc'
+                        for pos, value in _encode_value(tagvalue)
+                    ),
+                )
+                modified = trtags.get('__modified')
+                if not isinstance(modified, (int, float)):
+                    modified = None
+                if attrs:
+                    attrs = pickle.dumps(attrs, protocol=common.PICKLE_PROTOCOL)
+                else:
+                    attrs = None
+                columns = [_column_value(trtags.get(tag)) for tag in INDEXED_TAGS]
+                conn.execute(
+                    "REPLACE INTO Tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, trtags['__loc'], *columns, modified, attrs),
+                )
+                count += 1
+        return count
+
+    def delete(self, keys: Iterable[int]) -> None:
+        """
+        Removes tracks. Keys that are not stored are ignored.
+        """
+        params = [(key,) for key in keys]
+        with self._transaction():
+            self.conn.executemany("DELETE FROM Tags WHERE key = ?", params)
+            self.conn.executemany("DELETE FROM Tracks WHERE key = ?", params)
+
+    def find_keys(self, column: str, value: Any) -> List[int]:
+        """
+        Looks up tracks by one of the indexed columns.
+
+        :param column: ``loc``, ``modified``, or one of `INDEXED_TAGS`
+        :param value: the value to look up; lists are matched against the
+            flattened column value
+        """
+        if column not in INDEXED_COLUMNS:
+            raise ValueError("Column %r is not indexed" % column)
+        if column != 'modified':
+            value = _column_value(value)
+        cursor = self.conn.execute(
+            "SELECT key FROM Tracks WHERE %s = ?" % column, (value,)
+        )
+        return [row[0] for row in cursor]
+
+
+class _Transaction:
+    """
+    Context manager that wraps statements in a transaction, unless the
+    connection is already inside one.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.owned = False
+
+    def __enter__(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+            self.owned = True
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.owned:
+            if exc_type is None:
+                self.conn.execute("COMMIT")
+            else:
+                self.conn.execute("ROLLBACK")
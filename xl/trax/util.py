@@ -24,6 +24,7 @@
 # do so. If you do not wish to do so, delete this exception statement
 # from your version.
 
+import logging
 from typing import Callable, Iterable, List, Optional, TypeVar
 
 from gi.repository import Gio
@@ -33,6 +34,8 @@ from xl import metadata
 from xl.trax.track import Track
 from xl.trax.search import search_tracks, TracksMatcher
 
+logger = logging.getLogger(__name__)
+
 _T = TypeVar('_T')
 
 
@@ -66,36 +69,111 @@ def get_tracks_from_uri(uri: str) -> List[Track]:
     :returns: the retrieved tracks
     :rtype: list of :class:`xl.trax.Track`
     """
-    tracks = []
+    return get_tracks_from_uris([uri])
 
-    gloc = Gio.File.new_for_uri(uri)
 
-    # don't do advanced checking on streaming-type uris as it can fail or
-    # otherwise be terribly slow.
-    # TODO: move uri definition somewhere more common for easy reuse?
-    if gloc.get_uri_scheme() in ('http', 'mms', 'cdda'):
-        return [Track(uri)]
+def get_tracks_from_uris(uris: Iterable[str], reread: bool = False) -> List[Track]:
+    """
+    Returns all valid tracks located at the given uris, reading the tags
+    of new files concurrently
 
-    try:
-        file_type = gloc.query_info(
-            "standard::type", Gio.FileQueryInfoFlags.NONE, None
-        ).get_file_type()
-    except GLib.Error:  # cdda track, nonexistent file, etc.
-        return []
-    if file_type == Gio.FileType.DIRECTORY:
-        # TODO: refactor Library so we dont need the collection obj
-        from xl.collection import Library, Collection
-
-        tracks = Collection('scanner')
-        lib = Library(uri)
-        lib.set_collection(tracks)
-        lib.rescan()
-        tracks = tracks.get_tracks()
-    else:
-        tracks = [Track(uri)]
+    :param uris: the uris to retrieve the tracks from
+    :param reread: whether to read the tags of tracks that already
+        existed as well, e.g. because their files changed
+    :returns: the retrieved tracks, in the order of *uris*
+    """
+    tracks = []
+    new_tracks = []
+    known_tracks = []
+    for uri in uris:
+        gloc = Gio.File.new_for_uri(uri)
+
+        # don't do advanced checking on streaming-type uris as it can fail or
+        # otherwise be terribly slow.
+        # TODO: move uri definition somewhere more common for easy reuse?
+        if gloc.get_uri_scheme() in ('http', 'mms', 'cdda'):
+            tracks.append(Track(uri))
+            continue
+
+        try:
+            file_type = gloc.query_info(
+                "standard::type", Gio.FileQueryInfoFlags.NONE, None
+            ).get_file_type()
+        except GLib.Error:  # cdda track, nonexistent file, etc.
+            continue
+        if file_type == Gio.FileType.DIRECTORY:
+            tracks.extend(_get_tracks_from_directory(uri))
+            continue
+
+        tr = Track(uri, scan=False)
+        # Existing tracks are returned as they are, like Track(uri) does
+        if tr._init:
+            new_tracks.append(tr)
+        elif reread:
+            known_tracks.append(tr)
+        tracks.append(tr)
+    read_tracks_tags(new_tracks, notify_changed=False)
+    read_tracks_tags(known_tracks)
     return tracks
 
 
+def _get_tracks_from_directory(uri: str) -> List[Track]:
+    # TODO: refactor Library so we dont need the collection obj
+    from xl.collection import Library, Collection
+
+    tracks = Collection('scanner')
+    lib = Library(uri)
+    lib.set_collection(tracks)
+    lib.rescan()
+    return tracks.get_tracks()
+
+
+def read_tracks_tags(
+    tracks: Iterable[Track],
+    force: bool = True,
+    notify_changed: bool = True,
+    workers: Optional[int] = None,
+) -> None:
+    """
+    Reads the tags of many tracks concurrently, like calling
+    :meth:`Track.read_tags` on each of them.
+
+    Files are read on worker threads, the tracks themselves are only
+    updated from the calling thread.
+
+    :param force: If not True, then only read the tags of files that
+        have been modified
+    :param workers: number of reader threads, see
+        :func:`xl.metadata.read_tags_many`
+    """
+    bylocation = {}
+    modified = {}
+    hints = {}
+    for tr in tracks:
+        if not tr.is_supported():
+            tr._scan_valid = False
+            continue
+        loc = tr.get_loc_for_io()
+        bylocation[loc] = tr
+        hint = tr.get_tag_raw('__format')
+        if hint is not None:
+            hints[loc] = hint
+        if not force:
+            modified[loc] = tr.get_tag_raw('__modified') or 0
+    if not bylocation:
+        return
+
+    for result in metadata.read_tags_many(bylocation, workers, modified, hints):
+        tr = bylocation[result.uri]
+        try:
+            if result.error is not None:
+                raise result.error
+            tr._apply_file(result.format, result.tags, notify_changed=notify_changed)
+        except Exception:
+            tr._scan_valid = False
+            logger.exception("Error reading tags for %s", result.uri)
+
+
 def sort_tracks(
     fields: Iterable[str],
     items: Iterable[_T],
@@ -113,13 +191,23 @@ def sort_tracks(
         from an item in the *items* iterable
     :param reverse: whether to sort in reversed order
     """
+    fields = list(fields)
+    items = list(items)
     if trackfunc is None:
-        trackfunc = lambda tr: tr
-    keyfunc = lambda tr: [
-        trackfunc(tr).get_tag_sort(field, artist_compilations=artist_compilations)
-        for field in fields
+        tracks = items
+    else:
+        tracks = map(trackfunc, items)
+    # Build all keys in one pass; Track caches its sort keys, so re-sorting
+    # the same tracks by another column only computes the new column.
+    keys = [
+        tuple(
+            tr.get_tag_sort(field, artist_compilations=artist_compilations)
+            for field in fields
+        )
+        for tr in tracks
     ]
-    return sorted(items, key=keyfunc, reverse=reverse)
+    order = sorted(range(len(items)), key=keys.__getitem__, reverse=reverse)
+    return [items[i] for i in order]
 
 
 def sort_result_tracks(fields, trackiter, reverse=False, artist_compilations=False):
@@ -43,7 +43,7 @@ from xl.covers import MANAGER as COVER_MANAGER
 from xl.nls import gettext as _
 from xlgui.widgets import dialogs, menu
 from xlgui import guiutil
-from xlgui.guiutil import pixbuf_from_data
+from xlgui.guiutil import get_cover_thumbnail, pixbuf_from_data
 
 logger = logging.getLogger(__name__)
 
@@ -170,7 +170,7 @@ class CoverManager(GObject.Object):
 
         outstanding = []
         # Speed up the following loop
-        get_cover = COVER_MANAGER.get_cover
+        get_db_string = COVER_MANAGER.get_db_string
         default_cover_pixbuf = self.default_cover_pixbuf
         cover_size = self.cover_size
 
@@ -180,14 +180,14 @@ class CoverManager(GObject.Object):
             if self.stopper.is_set():
                 return
 
-            cover_data = get_cover(self.album_tracks[album][0], set_only=True)
-            cover_pixbuf = pixbuf_from_data(cover_data) if cover_data else None
+            # Only covers set in the db, like get_cover(set_only=True);
+            # scaled covers are cached, so full-size ones are rarely decoded
+            db_string = get_db_string(self.album_tracks[album][0])
+            thumbnail_pixbuf = None
+            if db_string:
+                thumbnail_pixbuf = get_cover_thumbnail(db_string, cover_size, True)
 
-            try:
-                thumbnail_pixbuf = cover_pixbuf.scale_simple(
-                    *cover_size, interp_type=GdkPixbuf.InterpType.BILINEAR
-                )
-            except AttributeError:  # cover_pixbuf is None
+            if thumbnail_pixbuf is None:
                 thumbnail_pixbuf = default_cover_pixbuf
                 outstanding.append(album)
 
@@ -580,7 +580,13 @@ class CoverWidget(Gtk.EventBox):
             if not cover_data:
                 return
 
-            GLib.idle_add(self.on_cover_chosen, None, track, cover_data)
+            pixbuf = None
+            db_string = COVER_MANAGER.get_db_string(track)
+            if db_string:
+                width = settings.get_option('gui/cover_width', 100)
+                pixbuf = get_cover_thumbnail(db_string, (width, width))
+
+            GLib.idle_add(self.on_cover_chosen, None, track, cover_data, pixbuf)
 
         if track is not None:
             __get_cover()
@@ -735,17 +741,20 @@ class CoverWidget(Gtk.EventBox):
                 self.image.set_from_pixbuf(pixbuf)
                 COVER_MANAGER.set_cover(self.__track, db_string, self.cover_data)
 
-    def on_cover_chosen(self, object, track, cover_data):
+    def on_cover_chosen(self, object, track, cover_data, pixbuf=None):
         """
         Called when a cover is selected
         from the coverchooser
+
+        :param pixbuf: the cover already scaled to the cover width, if any
         """
 
         if self.__track != track:
             return
 
-        width = settings.get_option('gui/cover_width', 100)
-        pixbuf = pixbuf_from_data(cover_data, (width, width))
+        if pixbuf is None:
+            width = settings.get_option('gui/cover_width', 100)
+            pixbuf = pixbuf_from_data(cover_data, (width, width))
         self.image.set_from_pixbuf(pixbuf)
         self.set_drag_source_enabled(True)
         self.cover_data = cover_data
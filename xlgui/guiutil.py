@@ -37,7 +37,7 @@ from gi.repository import GLib
 from gi.repository import Gtk
 from gi.repository import Pango
 
-from xl import settings, xdg
+from xl import covers, settings, xdg
 from xl.nls import gettext as _
 
 # Required for xlgui.get_controller()
@@ -214,6 +214,47 @@ def pixbuf_from_data(
     return pixbuf
 
 
+def get_cover_thumbnail(
+    db_string: str, size: Tuple[int, int], fill: bool = False
+) -> Optional[GdkPixbuf.Pixbuf]:
+    """
+    Returns a cover scaled to the given size. Scaled covers are kept in
+    the thumbnail cache of :data:`xl.covers.MANAGER`, so full-size covers
+    only need to be decoded once per size, as long as they don't change.
+
+    :param db_string: The db_string identifying the cover
+    :param size: Size to scale to
+    :param fill: Whether to stretch the cover to *size*
+        instead of keeping its ratio
+
+    :returns: the scaled cover, or None if the cover cannot be loaded
+    """
+    thumbnails = covers.MANAGER.thumbnails
+    stamp = covers.MANAGER.get_thumbnail_stamp(db_string)
+    if stamp is not None:
+        data = thumbnails.get(db_string, size, fill, stamp)
+        if data is not None:
+            pixbuf = pixbuf_from_data(data)
+            if pixbuf is not None:
+                return pixbuf
+
+    data = covers.MANAGER.get_cover_data(db_string)
+    if fill:
+        pixbuf = pixbuf_from_data(data, size, keep_ratio=False, upscale=True)
+    else:
+        pixbuf = pixbuf_from_data(data, size)
+    if pixbuf is None or stamp is None:
+        return pixbuf
+
+    try:
+        _success, data = pixbuf.save_to_bufferv('png', [], [])
+    except GLib.Error as e:
+        logger.warning('Failed to store cover thumbnail: %s', e.message)
+    else:
+        thumbnails.add(db_string, size, data, fill, stamp)
+    return pixbuf
+
+
 class ScalableImageWidget(Gtk.Image):
     """
     Custom resizable image widget
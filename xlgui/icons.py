@@ -36,7 +36,7 @@ from typing import Optional, Union
 from gi.repository import GdkPixbuf, GLib, Gtk
 
 from xl import common, covers, settings
-from xlgui.guiutil import pixbuf_from_data
+from xlgui.guiutil import get_cover_thumbnail
 
 logger = logging.getLogger(__name__)
 
@@ -736,20 +736,28 @@ class IconManager:
         """
         Get drag cover icon (stacked covers pixbuf)
         Asynchronous load covers for tracks taking at most 0.333 seconds
-        :param tracks: iterable for tracks (xl.trax.Track)
+        :param tracks: iterable of groups of tracks (xl.trax.Track), e.g.
+            one group per selected row; each group contributes the first
+            cover not shown yet
         :return: GdkPixbuf.Pixbuf or None if none found
         """
         cover_width = settings.get_option('gui/cover_width', 100)
-        as_pixbuf = lambda data: pixbuf_from_data(
-            data=data, size=(cover_width, cover_width)
+        as_pixbuf = lambda db_string: get_cover_thumbnail(
+            db_string, (cover_width, cover_width)
         )
-        get_cover_for_tracks = covers.MANAGER.get_cover_for_tracks
-        db_string_list = []
-        cover_for_tracks = lambda tracks: get_cover_for_tracks(tracks, db_string_list)
-        filtered_covers = filter(
-            None, map(cover_for_tracks, tracks)
-        )  # Remove None cover tracks
-        async_loader = common.AsyncLoader(map(as_pixbuf, filtered_covers))
+        get_db_string = covers.MANAGER.get_db_string
+
+        def db_strings():
+            seen = set()
+            for group in tracks:
+                for track in group:
+                    db_string = get_db_string(track)
+                    if db_string and db_string not in seen:
+                        seen.add(db_string)
+                        yield db_string
+                        break
+
+        async_loader = common.AsyncLoader(map(as_pixbuf, db_strings()))
         async_loader.end(0.333)
         return self.__create_drag_cover_icon(async_loader.result, cover_width)
 
@@ -29,6 +29,7 @@ from gi.repository import GdkPixbuf
 from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
+import bisect
 import itertools
 import logging
 
@@ -45,6 +46,10 @@ logger = logging.getLogger(__name__)
 # TODO: come up with a more customizable way to handle this
 SEARCH_TAGS = ("artist", "albumartist", "album", "title")
 
+# checked for every node or tag change
+_DISPLAY_TRACK_COUNTS = settings.bind_option('gui/display_track_counts', True)
+_SYNC_ON_TAG_CHANGE = settings.bind_option('gui/sync_on_tag_change', True)
+
 
 def first_meaningful_char(s):
     # Keep explicit str() conversion in case we ever end up receiving
@@ -77,7 +82,9 @@ class Order:
     def __init__(self, name, levels, use_compilations=True):
         self.__name = name
         self.__levels = [self.__parse_level(l) for l in levels]
-        self.__formatters = [formatter.TrackFormatter(l[1]) for l in self.__levels]
+        self.__formatters = [
+            formatter.TrackFormatter(l[1], cache=True) for l in self.__levels
+        ]
         self.__use_compilations = use_compilations
 
     @staticmethod
@@ -119,6 +126,148 @@ class Order:
         return self.__formatters[level].format(track)
 
 
+class FacetNode:
+    """
+    A node of the collection tree: the tracks that share the values of
+    one level of an Order, below the values of the parent node.
+
+    The children of a node are created from its tracks the first time
+    they are needed, so expanding a node never has to search the
+    collection again.
+    """
+
+    __slots__ = ('order', 'level', 'label', 'query', 'tracks', '_children')
+
+    def __init__(self, order, level, label, query, tracks):
+        """
+        :param order: the Order the tree is arranged by
+        :param level: the level of the order this node belongs to, -1
+            for the root
+        :param label: the text to display
+        :param query: the search terms matching the tracks of this node,
+            relative to its parent
+        :param tracks: the SearchResultTracks below this node, sorted by
+            the first level of the order
+        """
+        self.order = order
+        self.level = level
+        self.label = label
+        self.query = query
+        self.tracks = tracks
+        self._children = None
+
+    def is_leaf(self):
+        return self.level == len(self.order) - 1
+
+    def get_children(self):
+        """
+        :returns: the nodes of the next level, in display order
+        """
+        if self._children is None:
+            if self.is_leaf():
+                self._children = []
+            else:
+                self._children = self.__group(self.level + 1)
+        return self._children
+
+    def __group(self, level):
+        order = self.order
+        tags = order.get_sort_tags(level)
+        tracks = self.tracks
+        # the tracks are already sorted by the first level
+        if level > 0:
+            tracks = trax.sort_result_tracks(tags, tracks)
+        bottom = level == len(order) - 1
+
+        children = []
+        node = None
+        last_val = None
+        for srtr in tracks:
+            track = srtr.track
+            # The value returned by get_tag_sort() may be of other
+            # typa than str (e.g., an int for track number), hence
+            # explicit conversion via str() is necessary.
+            stagval = " ".join([str(track.get_tag_sort(x)) for x in tags])
+            if node is None or last_val != stagval or bottom:
+                tagval = order.format_track(level, track)
+                match_query = " ".join(
+                    [track.get_tag_search(t, format=True) for t in tags]
+                )
+                if bottom:
+                    match_query += " " + track.get_tag_search("__loc", format=True)
+
+                # Different *sort tags can cause stagval to not match
+                # but the below code will produce identical entries in
+                # the displayed tree.  This condition checks to ensure
+                # that new entries are added if and only if they will
+                # display different results, avoiding that problem.
+                if (
+                    node is None
+                    or match_query != node.query
+                    or tagval != node.label
+                    or bottom
+                ):
+                    last_val = stagval
+                    node = FacetNode(order, level, tagval, match_query, [])
+                    children.append(node)
+            node.tracks.append(srtr)
+        return children
+
+
+class SortedTracks:
+    """
+    A list of items kept sorted by a key, so that single items can be
+    added and removed without sorting everything again.
+
+    The items are exposed as a plain list, which must not be modified
+    directly.
+    """
+
+    def __init__(self, items=(), keys=None, keyfunc=None):
+        """
+        :param items: the initial items
+        :param keys: the keys of the items if they are already sorted
+        :param keyfunc: a function computing the key of an item, used
+            to sort the items if no keys are given
+        """
+        items = list(items)
+        if keys is None:
+            keys = [keyfunc(item) for item in items]
+            order = sorted(range(len(items)), key=keys.__getitem__)
+            items = [items[i] for i in order]
+            keys = [keys[i] for i in order]
+        self.items = items
+        self.keys = list(keys)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, key):
+        """
+        Inserts an item after the items with the same key
+        """
+        position = bisect.bisect_right(self.keys, key)
+        self.keys.insert(position, key)
+        self.items.insert(position, item)
+
+    def remove(self, key, predicate):
+        """
+        Removes the first item with `key` for which `predicate` is true
+
+        :returns: the removed item, or None
+        """
+        position = bisect.bisect_left(self.keys, key)
+        keys = self.keys
+        while position < len(keys) and keys[position] == key:
+            item = self.items[position]
+            if predicate(item):
+                del keys[position]
+                del self.items[position]
+                return item
+            position += 1
+        return None
+
+
 DEFAULT_ORDERS = [
     # fmt: off
     Order(_("Artist"),
@@ -211,6 +360,20 @@ class CollectionPanel(panel.Panel):
         self.order = None
         self.tracks = []
         self.sorted_tracks = []
+        #: FacetNode holding the tracks shown for the current filter
+        self.root = None
+        self._search_session = None
+        #: SortedTracks of all tracks, and of the SearchResultTracks shown
+        self._sorted = SortedTracks()
+        self._results = SortedTracks()
+        #: location -> sort key of each track in self._sorted
+        self._sort_keys = {}
+        self._matcher = None
+        # changes to apply to the tree the next time it is refreshed
+        self._added_locs = set()
+        self._removed_locs = set()
+        self._changed_tracks = set()
+        self._reload_needed = False
 
         event.add_ui_callback(
             self._check_collection_empty, 'libraries_modified', collection
@@ -272,6 +435,7 @@ class CollectionPanel(panel.Panel):
         )
         self.tree.connect('key-release-event', self.on_key_released)
         event.add_ui_callback(self.refresh_tags_in_tree, 'track_tags_changed')
+        event.add_ui_callback(self.refresh_batch_in_tree, 'tracks_tags_changed')
         event.add_ui_callback(
             self.refresh_tracks_in_tree, 'tracks_added', self.collection
         )
@@ -436,11 +600,10 @@ class CollectionPanel(panel.Panel):
         """
         finds tracks matching a given iter.
         """
-        self.load_subtree(iter)
-        search = self.get_node_search_terms(iter)
-        matcher = trax.TracksMatcher(search)
-        srtrs = trax.search_tracks(self.tracks, [matcher])
-        return [x.track for x in srtrs]
+        node = self.model.get_value(iter, 2)
+        if node is None:
+            return []
+        return [x.track for x in node.tracks]
 
     def append_to_playlist(self, item=None, event=None, replace=False):
         """
@@ -484,22 +647,48 @@ class CollectionPanel(panel.Panel):
 
         queries = []
         while node:
-            queries.append(self.model.get_value(node, 2))
+            queries.append(self.model.get_value(node, 2).query)
             node = self.model.iter_parent(node)
 
         return " ".join(queries)
 
     def refresh_tags_in_tree(self, type, track, tags):
         if (
-            settings.get_option('gui/sync_on_tag_change', True)
+            _SYNC_ON_TAG_CHANGE.value
             and bool(tags & self.order.all_sort_tags())
             and self.collection.loc_is_member(track.get_loc_for_io())
         ):
+            self._track_changed(track, tags)
+            self._refresh_tags_in_tree()
+
+    def refresh_batch_in_tree(self, type, obj, changes):
+        if not _SYNC_ON_TAG_CHANGE.value:
+            return
+        sort_tags = self.order.all_sort_tags()
+        refresh = False
+        for track, tags in changes.items():
+            if tags & sort_tags and self.collection.loc_is_member(
+                track.get_loc_for_io()
+            ):
+                self._track_changed(track, tags)
+                refresh = True
+        if refresh:
             self._refresh_tags_in_tree()
 
     def refresh_tracks_in_tree(self, type, obj, loc):
+        if type == 'tracks_added':
+            self._added_locs.update(loc)
+        else:
+            self._removed_locs.update(loc)
+            self._added_locs.difference_update(loc)
         self._refresh_tags_in_tree()
 
+    def _track_changed(self, track, tags):
+        if '__loc' in tags:
+            # the old location is needed to find the track
+            self._reload_needed = True
+        self._changed_tracks.add(track)
+
     @common.glib_wait(500)
     def _refresh_tags_in_tree(self):
         """
@@ -510,17 +699,156 @@ class CollectionPanel(panel.Panel):
         # so we delay it until we're done scanning.
         if self.collection._scanning:
             return True
-        self.resort_tracks()
-        self.load_tree()
+        if (
+            self._reload_needed
+            or self.root is None
+            or not (self._added_locs or self._removed_locs or self._changed_tracks)
+        ):
+            self.resort_tracks()
+            self.load_tree()
+        else:
+            self._update_tree()
         return False
 
+    def _sort_key(self, track):
+        return tuple(track.get_tag_sort(tag) for tag in self.order.get_sort_tags(0))
+
     def resort_tracks(self):
-        # import time
-        # print("sorting...", time.clock())
-        self.sorted_tracks = trax.sort_tracks(
-            self.order.get_sort_tags(0), self.collection.get_tracks()
+        self._sorted = SortedTracks(
+            self.collection.get_tracks(), keyfunc=self._sort_key
         )
-        # print("sorted.", time.clock())
+        self._sort_keys = {
+            track.get_loc_for_io(): key
+            for track, key in zip(self._sorted.items, self._sorted.keys)
+        }
+        self.sorted_tracks = self._sorted.items
+        self._search_session = None
+        self._added_locs.clear()
+        self._removed_locs.clear()
+        self._changed_tracks.clear()
+        self._reload_needed = False
+
+    def _update_tree(self):
+        """
+        Applies the tracks added, removed or changed since the tree was
+        loaded, only touching the rows of the nodes that changed.
+        """
+        added = self._added_locs
+        removed = self._removed_locs
+        changed = self._changed_tracks
+        self._added_locs = set()
+        self._removed_locs = set()
+        self._changed_tracks = set()
+
+        added.update(track.get_loc_for_io() for track in changed)
+        for loc in removed | added:
+            key = self._sort_keys.pop(loc, None)
+            if key is None:
+                continue
+            self._sorted.remove(key, lambda tr: tr.get_loc_for_io() == loc)
+            self._results.remove(key, lambda srtr: srtr.track.get_loc_for_io() == loc)
+
+        tracks = []
+        for loc in added - removed:
+            track = self.collection.get_track_by_loc(loc)
+            if track is not None:
+                key = self._sort_key(track)
+                self._sort_keys[loc] = key
+                self._sorted.add(track, key)
+                tracks.append(track)
+        for srtr in trax.search_tracks(tracks, [self._matcher]):
+            self._results.add(srtr, self._sort_keys[srtr.track.get_loc_for_io()])
+        if self._search_session is not None:
+            self._search_session.reset()
+
+        root = FacetNode(self.order, -1, None, "", self.tracks)
+        self._patch_subtree(None, root)
+        self.root = root
+
+    def _patch_subtree(self, parent, node):
+        """
+        Updates the rows below `parent` to show the children of `node`.
+        Rows of children that are still there are kept along with their
+        own rows, so they stay expanded.
+        """
+        model = self.model
+        children = node.get_children()
+        keys = {(child.query, child.label) for child in children}
+        rows = {}
+        itr = model.iter_children(parent)
+        while itr is not None:
+            current = itr
+            itr = model.iter_next(itr)
+            child = model.get_value(current, 2)
+            key = None if child is None else (child.query, child.label)
+            if key in keys and key not in rows:
+                rows[key] = current
+            else:
+                # separators are added again afterwards
+                model.remove(current)
+
+        depth = node.level + 1
+        image = self._get_level_image(depth)
+        itr = model.iter_children(parent)
+        for i, child in enumerate(children):
+            row = rows.pop((child.query, child.label), None)
+            if (
+                row is not None
+                and itr is not None
+                and model.get_path(row) == model.get_path(itr)
+            ):
+                itr = model.iter_next(itr)
+                old = model.get_value(row, 2)
+                if len(old.tracks) == len(child.tracks) and all(
+                    a is b for a, b in zip(old.tracks, child.tracks)
+                ):
+                    children[i] = old
+                    continue
+                model.set_value(row, 1, self._get_node_label(child))
+                model.set_value(row, 2, child)
+                # nodes that were never expanded load their children later
+                if old._children is not None:
+                    self._patch_subtree(row, child)
+            else:
+                if row is not None:
+                    model.remove(row)
+                row = model.insert_before(
+                    parent, itr, [image, self._get_node_label(child), child]
+                )
+                if not child.is_leaf():
+                    model.append(row, [None, None, None])
+
+        if depth == 0:
+            self._add_separators()
+
+    def _get_level_image(self, depth):
+        tags = self.order.get_sort_tags(depth)
+        try:
+            return getattr(self, "%s_image" % tags[-1])
+        except Exception:
+            return None
+
+    def _get_node_label(self, node):
+        if node.is_leaf() or not _DISPLAY_TRACK_COUNTS.value:
+            return node.label
+        return "%s (%s)" % (node.label, len(node.tracks))
+
+    def _add_separators(self):
+        """
+        Separates the top level nodes by their first character
+        """
+        if not settings.get_option('gui/draw_separators', True):
+            return
+        tag = self.order.get_sort_tags(0)[0]
+        last_char = None
+        itr = self.model.iter_children(None)
+        while itr is not None:
+            node = self.model.get_value(itr, 2)
+            char = first_meaningful_char(node.tracks[0].track.get_tag_sort(tag))
+            if last_char is not None and char != last_char and last_char != '':
+                self.model.insert_before(None, itr, [None, None, None])
+            last_char = char
+            itr = self.model.iter_next(itr)
 
     def load_tree(self):
         """
@@ -549,11 +877,26 @@ class CollectionPanel(panel.Panel):
         tags += self.order.all_search_tags()
         tags = list(set(tags))  # uniquify list to speed up search
 
-        self.tracks = list(
-            trax.search_tracks_from_string(
-                self.sorted_tracks, keyword, case_sensitive=False, keyword_tags=tags
+        # typing into the filter box mostly narrows down the search, which
+        # the session handles by only searching the previous results
+        session = self._search_session
+        if session is None or set(session.keyword_tags) != set(tags):
+            session = self._search_session = trax.SearchSession(
+                self.sorted_tracks,
+                case_sensitive=False,
+                keyword_tags=tags,
+                index=self.collection.get_tag_index(),
             )
+        self._matcher = trax.TracksMatcher(
+            keyword, case_sensitive=False, keyword_tags=tags
+        )
+        results = session.search(keyword)
+        self._results = SortedTracks(
+            results,
+            keys=[self._sort_keys[srtr.track.get_loc_for_io()] for srtr in results],
         )
+        self.tracks = self._results.items
+        self.root = FacetNode(self.order, -1, None, "", self.tracks)
 
         self.load_subtree(None)
 
@@ -578,7 +921,7 @@ class CollectionPanel(panel.Panel):
                 return
             value = self.model.get_value(iter, 1)
             if not value:
-                value = self.model.get_value(iter, 2)
+                value = self.model.get_value(iter, 2).query
 
             if value == name:
                 self.tree.expand_row(self.model.get_path(iter), False)
@@ -597,135 +940,52 @@ class CollectionPanel(panel.Panel):
 
         @param node: the node
         """
-        previously_loaded = False  # was the subtree already loaded
         iter_sep = None
         if parent is None:
-            depth = 0
+            node = self.root
         else:
+            iter_sep = self.model.iter_children(parent)
             if (
                 self.model.iter_n_children(parent) != 1
-                or self.model.get_value(self.model.iter_children(parent), 1) is not None
+                or self.model.get_value(iter_sep, 1) is not None
             ):
-                previously_loaded = True
-            iter_sep = self.model.iter_children(parent)
-            depth = self.model.iter_depth(parent) + 1
-        if previously_loaded:
-            return
+                return  # the subtree was already loaded
+            node = self.model.get_value(parent, 2)
 
-        search = self.get_node_search_terms(parent)
-
-        try:
-            tags = self.order.get_sort_tags(depth)
-            matchers = [trax.TracksMatcher(search)]
-            srtrs = trax.search_tracks(self.tracks, matchers)
-            # sort only if we are not on top level, because tracks are
-            # already sorted by fist order
-            if depth > 0:
-                srtrs = trax.sort_result_tracks(tags, srtrs)
-        except IndexError:
+        if node.is_leaf():
             return  # at the bottom of the tree
-        try:
-            image = getattr(self, "%s_image" % tags[-1])
-        except Exception:
-            image = None
-        bottom = False
-        if depth == len(self.order) - 1:
-            bottom = True
-
-        display_counts = settings.get_option('gui/display_track_counts', True)
-        draw_seps = settings.get_option('gui/draw_separators', True)
-        last_char = ''
-        last_val = ''
-        last_dval = ''
-        last_matchq = ''
-        count = 0
-        first = True
-        path = None
-        expanded = False
+        depth = node.level + 1
+        image = self._get_level_image(depth)
+
+        # nodes with tracks that matched the keyword on the tags of a
+        # deeper level get expanded
+        expand_tags = []
+        if settings.get_option("gui/expand_enabled", True) and len(
+            self.keyword.strip()
+        ) >= settings.get_option("gui/expand_minimum_term_length", 2):
+            for i in range(depth + 1, len(self.order)):
+                expand_tags.extend(self.order.get_sort_tags(i))
         to_expand = []
 
-        for srtr in srtrs:
-            # The value returned by get_tag_sort() may be of other
-            # typa than str (e.g., an int for track number), hence
-            # explicit conversion via str() is necessary.
-            stagvals = [str(srtr.track.get_tag_sort(x)) for x in tags]
-            stagval = " ".join(stagvals)
-            if last_val != stagval or bottom:
-                tagval = self.order.format_track(depth, srtr.track)
-                match_query = " ".join(
-                    [srtr.track.get_tag_search(t, format=True) for t in tags]
-                )
-                if bottom:
-                    match_query += " " + srtr.track.get_tag_search("__loc", format=True)
-
-                # Different *sort tags can cause stagval to not match
-                # but the below code will produce identical entries in
-                # the displayed tree.  This condition checks to ensure
-                # that new entries are added if and only if they will
-                # display different results, avoiding that problem.
-                if match_query != last_matchq or tagval != last_dval or bottom:
-                    if display_counts and path and not bottom:
-                        iter = self.model.get_iter(path)
-                        val = self.model.get_value(iter, 1)
-                        val = "%s (%s)" % (val, count)
-                        self.model.set_value(iter, 1, val)
-                        count = 0
-
-                    last_val = stagval
-                    last_dval = tagval
-                    if depth == 0 and draw_seps:
-                        val = srtr.track.get_tag_sort(tags[0])
-                        char = first_meaningful_char(val)
-                        if first:
-                            last_char = char
-                        else:
-                            if char != last_char and last_char != '':
-                                self.model.append(parent, [None, None, None])
-                            last_char = char
-                    first = False
-
-                    last_matchq = match_query
-                    iter = self.model.append(parent, [image, tagval, match_query])
-                    path = self.model.get_path(iter)
-                    expanded = False
-                    if not bottom:
-                        self.model.append(iter, [None, None, None])
-            count += 1
-            if not expanded:
-                alltags = []
-                for i in range(depth + 1, len(self.order)):
-                    alltags.extend(self.order.get_sort_tags(i))
-                for t in alltags:
-                    if t in srtr.on_tags:
-                        # keep original path intact for following block
-                        newpath = path
-                        if depth > 0:
-                            # for some reason, nested iters are always
-                            # off by one in the terminal entry.
-                            newpath = Gtk.TreePath.new_from_indices(
-                                newpath[:-1] + [newpath[-1] - 1]
-                            )
-                        to_expand.append(newpath)
-                        expanded = True
-
-        if display_counts and path and not bottom:
-            iter = self.model.get_iter(path)
-            val = self.model.get_value(iter, 1)
-            val = "%s (%s)" % (val, count)
-            self.model.set_value(iter, 1, val)
-            count = 0
-
-        if (
-            settings.get_option("gui/expand_enabled", True)
-            and len(to_expand) < settings.get_option("gui/expand_maximum_results", 100)
-            and len(self.keyword.strip())
-            >= settings.get_option("gui/expand_minimum_term_length", 2)
-        ):
-            for row in to_expand:
-                GLib.idle_add(self.tree.expand_row, row, False)
+        for child in node.get_children():
+            iter = self.model.append(
+                parent, [image, self._get_node_label(child), child]
+            )
+            if not child.is_leaf():
+                self.model.append(iter, [None, None, None])
+                if expand_tags and any(
+                    t in srtr.on_tags for srtr in child.tracks for t in expand_tags
+                ):
+                    to_expand.append(iter)
 
         if iter_sep is not None:
             self.model.remove(iter_sep)
+        if depth == 0:
+            self._add_separators()
+
+        if len(to_expand) < settings.get_option("gui/expand_maximum_results", 100):
+            for iter in to_expand:
+                GLib.idle_add(self.tree.expand_row, self.model.get_path(iter), False)
 
 
 class CollectionDragTreeView(DragTreeView):
@@ -795,9 +1055,10 @@ class CollectionDragTreeView(DragTreeView):
         :return: list of tracks [xl.trax.Track]
         """
         it = self.get_model().get_iter(path)
-        search = self.container.get_node_search_terms(it)
-        matcher = trax.TracksMatcher(search)
-        for i in trax.search_tracks(self.container.tracks, [matcher]):
+        node = self.get_model().get_value(it, 2)
+        if node is None:
+            return
+        for i in node.tracks:
             yield i.track
 
 
@@ -42,7 +42,7 @@ from gi.repository import Pango
 
 from xl.nls import gettext as _
 from xl.metadata import CoverImage
-from xl import common, settings, trax, xdg
+from xl import common, event, settings, trax, xdg
 
 from xlgui.widgets import dialogs
 from xlgui.guiutil import GtkTemplate
@@ -203,52 +203,54 @@ class TrackPropertiesDialog(GObject.Object):
     def _tags_write(self, data):
         errors = []
         dialog = SavingProgressWindow(self.dialog, len(data))
-        for n, trackdata in data:
-            track = self.tracks[n]
-            poplist = []
+        # deliver the tag changes of all tracks at once
+        with event.batch():
+            for n, trackdata in data:
+                track = self.tracks[n]
+                poplist = []
 
-            try:
-                for tag in trackdata:
-                    if not tag.startswith("__"):
-                        if tag in ("tracknumber", "discnumber") and trackdata[tag] == [
-                            "0/0"
-                        ]:
-                            poplist.append(tag)
-                            continue
-                        self._write_tag(track, tag, trackdata[tag])
-                    elif tag in ('__startoffset', '__stopoffset'):
-                        try:
-                            offset = int(trackdata[tag][0])
-                        except ValueError:
-                            poplist.append(tag)
+                try:
+                    for tag in trackdata:
+                        if not tag.startswith("__"):
+                            if tag in ("tracknumber", "discnumber") and trackdata[
+                                tag
+                            ] == ["0/0"]:
+                                poplist.append(tag)
+                                continue
+                            self._write_tag(track, tag, trackdata[tag])
+                        elif tag in ('__startoffset', '__stopoffset'):
+                            try:
+                                offset = int(trackdata[tag][0])
+                            except ValueError:
+                                poplist.append(tag)
+                            else:
+                                track.set_tag_raw(tag, offset)
+
+                    # In case a tag has been removed..
+                    for tag in track.list_tags():
+                        if tag in tag_data:
+                            if tag_data[tag] is not None:
+                                try:
+                                    trackdata[tag]
+                                except KeyError:
+                                    poplist.append(tag)
                         else:
-                            track.set_tag_raw(tag, offset)
-
-                # In case a tag has been removed..
-                for tag in track.list_tags():
-                    if tag in tag_data:
-                        if tag_data[tag] is not None:
                             try:
                                 trackdata[tag]
                             except KeyError:
                                 poplist.append(tag)
-                    else:
-                        try:
-                            trackdata[tag]
-                        except KeyError:
-                            poplist.append(tag)
 
-                for tag in poplist:
-                    self._write_tag(track, tag, None)
+                    for tag in poplist:
+                        self._write_tag(track, tag, None)
 
-                if not track.write_tags():
+                    if not track.write_tags():
+                        errors.append(track.get_loc_for_io())
+                except Exception:
+                    logger.warning("Error saving track", exc_info=True)
                     errors.append(track.get_loc_for_io())
-            except Exception:
-                logger.warning("Error saving track", exc_info=True)
-                errors.append(track.get_loc_for_io())
 
-            trax.track._CACHER.remove(track)
-            dialog.step()
+                trax.track._CACHER.remove(track)
+                dialog.step()
         dialog.destroy()
 
         if len(errors) > 0:
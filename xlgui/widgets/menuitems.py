@@ -36,7 +36,7 @@ from gi.repository import GLib
 from gi.repository import Gtk
 
 
-from xl import common, player, playlist, settings, trax
+from xl import common, event, player, playlist, settings, trax
 from xl.nls import gettext as _
 from xlgui.widgets import dialogs, rating, menu
 from xlgui import panel, properties
@@ -101,8 +101,9 @@ class RatingMenuItem(menu.MenuItem):
         Passes the 'rating-changed' signal
         """
         tracks = self.get_tracks_func(parent, context)
-        for track in tracks:
-            track.set_rating(rating)
+        with event.batch():
+            for track in tracks:
+                track.set_rating(rating)
 
 
 def _enqueue_cb(widget, name, parent, context, get_tracks_func):
@@ -31,6 +31,8 @@ from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Pango
 
+import bisect
+import collections
 import logging
 import sys
 
@@ -45,6 +47,9 @@ from xlgui import guiutil, icons
 
 logger = logging.getLogger(__name__)
 
+# checked for every tag change
+_SYNC_ON_TAG_CHANGE = settings.bind_option('gui/sync_on_tag_change', True)
+
 
 def default_get_playlist_func(parent, context):
     return player.QUEUE.current_playlist
@@ -871,6 +876,11 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         self.selection.set_mode(Gtk.SelectionMode.MULTIPLE)
 
         self._filter_matcher = None
+        #: track -> whether it matches the current filter. Computed for the
+        #: whole playlist when the filter changes; tracks that are missing,
+        #: e.g. because they were added or changed since, are checked when
+        #: their row is filtered.
+        self._filter_visible = {}
 
         self._sort_columns = list(common.BASE_SORT_TAGS)  # Column sort order
 
@@ -896,6 +906,12 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         )
 
         event.add_ui_callback(self.on_option_set, "gui_option_set", destroy_with=self)
+        event.add_ui_callback(
+            self.on_track_tags_changed, "track_tags_changed", destroy_with=self
+        )
+        event.add_ui_callback(
+            self.on_tracks_tags_changed, "tracks_tags_changed", destroy_with=self
+        )
         event.add_ui_callback(
             self.on_playback_start,
             "playback_track_start",
@@ -940,27 +956,49 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         default columns.
         """
 
+        previous = self._filter_matcher
         if filter_string is None:
             self._filter_matcher = None
+            self._filter_visible = {}
             self._refilter()
+            return
+
+        # Merge default columns and currently enabled columns
+        keyword_tags = set(
+            playlist_columns.DEFAULT_COLUMNS + [c.name for c in self.get_columns()[1:]]
+        )
+        matcher = trax.TracksMatcher(
+            filter_string, case_sensitive=False, keyword_tags=keyword_tags
+        )
+        logger.debug("Filtering playlist %r by %r.", self.playlist.name, filter_string)
+
+        # Tracks that did not match the previous filter can't match the new
+        # one if it only narrows it down, so only the others are checked.
+        # Otherwise the playlist's index picks the tracks worth checking.
+        visible = dict.fromkeys(self.playlist, False)
+        if (
+            previous is None
+            or previous.keyword_tags != keyword_tags
+            or not trax.is_refinement(filter_string, previous.search_string)
+        ):
+            results = trax.search_tracks(self.playlist, [matcher])
         else:
-            # Merge default columns and currently enabled columns
-            keyword_tags = set(
-                playlist_columns.DEFAULT_COLUMNS
-                + [c.name for c in self.get_columns()[1:]]
-            )
-            self._filter_matcher = trax.TracksMatcher(
-                filter_string, case_sensitive=False, keyword_tags=keyword_tags
-            )
-            logger.debug(
-                "Filtering playlist %r by %r.", self.playlist.name, filter_string
-            )
-            self._refilter()
-            logger.debug(
-                "Filtering playlist %r by %r completed.",
-                self.playlist.name,
-                filter_string,
+            previous_visible = self._filter_visible
+            candidates = [tr for tr in visible if previous_visible.get(tr, True)]
+            results = trax.search_tracks(
+                candidates, [matcher], index=self.playlist.get_tag_index()
             )
+        for srtr in results:
+            visible[srtr.track] = True
+
+        self._filter_matcher = matcher
+        self._filter_visible = visible
+        self._refilter()
+        logger.debug(
+            "Filtering playlist %r by %r completed.",
+            self.playlist.name,
+            filter_string,
+        )
 
     def get_selection_count(self):
         """
@@ -1174,27 +1212,20 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
 
     def _setup_models(self):
         self.model = PlaylistModel(self.playlist, [], self.player, self)
-        self.__setup_model_hook = self.model.connect(
-            'data-loading', self._on_after_model_loading
-        )
+        self.model.connect('row-inserted', self.on_row_inserted)
 
         self.modelfilter = self.model.filter_new()
         self.modelfilter.set_visible_func(self._modelfilter_visible_func)
         self.set_model(self.modelfilter)
 
-    def _on_after_model_loading(self, ar1, now_loading):
-        """
-        This is necessary to ensure that row-insert is connected after the initial loading
-        due to threaded PlaylistModel::_load_data_thread and playlists greater than 500 tracks
-        """
-        if not now_loading:
-            self.model.connect('row-inserted', self.on_row_inserted)
-            self.model.disconnect(self.__setup_model_hook)
-
     def _modelfilter_visible_func(self, model, iter, data):
         if self._filter_matcher is not None:
             track = model.get_value(iter, 0)
-            return self._filter_matcher.match(trax.SearchResultTrack(track))
+            visible = self._filter_visible.get(track)
+            if visible is None:
+                visible = self._filter_matcher.match(trax.SearchResultTrack(track))
+                self._filter_visible[track] = visible
+            return visible
         return True
 
     def on_header_button_press(
@@ -1270,6 +1301,14 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         if data == "gui/columns" or data == 'gui/playlist_font':
             self._refresh_columns()
 
+    def on_track_tags_changed(self, type, track, tags):
+        # the track may (not) match the filter now
+        self._filter_visible.pop(track, None)
+
+    def on_tracks_tags_changed(self, type, obj, changes):
+        for track in changes:
+            self._filter_visible.pop(track, None)
+
     def on_playback_start(self, type, player, track):
         if (
             player.queue.current_playlist == self.playlist
@@ -1673,11 +1712,17 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         elif target == "text/uri-list":
             uris = selection.get_uris()
             tracks = []
+            # consecutive files are read together, so that their tags
+            # are read concurrently
+            files = []
             for uri in uris:
                 if is_valid_playlist(uri):
+                    tracks.extend(trax.get_tracks_from_uris(files))
+                    files = []
                     tracks.extend(import_playlist(uri))
                 else:
-                    tracks.extend(trax.get_tracks_from_uri(uri))
+                    files.append(uri)
+            tracks.extend(trax.get_tracks_from_uris(files))
             sort_by, reverse = self.get_sort_by()
             tracks = trax.sort_tracks(
                 sort_by, tracks, reverse=reverse, artist_compilations=True
@@ -1808,9 +1853,9 @@ class PlaylistView(AutoScrollTreeView, providers.ProviderHandler):
         )
 
 
-class PlaylistModel(Gtk.ListStore):
+class PlaylistModel(GObject.Object, Gtk.TreeModel):
     """
-    This ListStore contains all the information needed to render a playlist
+    Tree model that displays the tracks of a playlist. It is used primarily
     via a PlaylistView. There are five columns:
 
     * xl.trax.Track
@@ -1819,9 +1864,16 @@ class PlaylistModel(Gtk.ListStore):
     * boolean (indicates whether row is sensitive)
     * Pango.Weight (indicates if row is the playing track or not)
 
-    The cache keys correspond to the tags rendered by each column. When a
-    track changes, the row's corresponding cache is cleared and the row
-    change event is fired.
+    Nothing is stored per row: values are computed when the view asks for
+    them, which it only does for visible rows since the view uses fixed
+    height mode. The Gtk.TreeModelFilter the view puts on top of this
+    model still visits every row when it is attached, so opening a large
+    playlist takes linear time, but only in cheap calls that neither read
+    tags nor build row caches.
+
+    The cache keys correspond to the tags rendered by each column. Caches
+    are kept per track for the most recently displayed tracks only. When a
+    track changes, its cache is dropped and the row change event is fired.
 
     The cache keys are populated by the playlist columns. This arrangement
     ensures that we don't have to recreate the playlist model each time the
@@ -1841,18 +1893,37 @@ class PlaylistModel(Gtk.ListStore):
 
     PARAM_COLS = (COL_PIXBUF, COL_SENSITIVE, COL_WEIGHT)
 
+    #: Number of tracks whose tag cache is kept
+    CACHE_SIZE = 1000
+
     def __init__(self, playlist, column_names, player, parent):
-        # columns: Track, Pixbuf, dict (cache)
-        Gtk.ListStore.__init__(
-            self, object, object, GdkPixbuf.Pixbuf, bool, Pango.Weight
-        )
+        GObject.Object.__init__(self)
         self.playlist = playlist
         self.player = player
 
         self._set_columns(column_names)
 
+        # Rows are added synchronously now; this is kept for compatibility
+        # with users of the 'data-loading' signal
         self.data_loading = False
-        self.data_load_queue = []
+
+        # The tracks as of the last playlist event we handled. Events are
+        # delivered asynchronously, so the playlist itself may already be
+        # ahead of the rows the view knows about.
+        self._tracks = list(playlist)
+        # incremented whenever rows are inserted or deleted
+        self._stamp = 0
+        # track -> tag cache, least recently used first
+        self._caches = collections.OrderedDict()
+        # track -> positions of its rows; None when it needs to be rebuilt
+        self._positions = None
+        self._column_types = (
+            GObject.TYPE_PYOBJECT,
+            GObject.TYPE_PYOBJECT,
+            GdkPixbuf.Pixbuf.__gtype__,
+            GObject.TYPE_BOOLEAN,
+            Pango.Weight.__gtype__,
+        )
 
         self._redraw_timer = None
         self._redraw_queue = []
@@ -1905,13 +1976,100 @@ class PlaylistModel(Gtk.ListStore):
         event.add_ui_callback(
             self.on_track_tags_changed, "track_tags_changed", destroy_with=parent
         )
+        event.add_ui_callback(
+            self.on_tracks_tags_changed, "tracks_tags_changed", destroy_with=parent
+        )
 
         event.add_ui_callback(self.on_option_set, "gui_option_set", destroy_with=parent)
 
         self._setup_icons()
-        self.on_tracks_added(
-            None, self.playlist, list(enumerate(self.playlist))
-        )  # populate the list
+
+    ### Gtk.TreeModel interface ###
+
+    def _get_iter(self, position):
+        itr = Gtk.TreeIter()
+        itr.stamp = self._stamp
+        # NULL user_data is not allowed, so offset by one
+        itr.user_data = position + 1
+        return itr
+
+    def _get_position(self, itr):
+        if itr is None or itr.stamp != self._stamp or not itr.user_data:
+            return -1
+        return itr.user_data - 1
+
+    def do_get_flags(self):
+        return Gtk.TreeModelFlags.LIST_ONLY
+
+    def do_get_n_columns(self):
+        return len(self._column_types)
+
+    def do_get_column_type(self, column):
+        return self._column_types[column]
+
+    def do_get_iter(self, path):
+        indices = path.get_indices()
+        if len(indices) == 1 and 0 <= indices[0] < len(self._tracks):
+            return True, self._get_iter(indices[0])
+        return False, None
+
+    def do_get_path(self, itr):
+        return Gtk.TreePath((self._get_position(itr),))
+
+    def do_get_value(self, itr, column):
+        position = self._get_position(itr)
+        track = self._tracks[position]
+        if column == self.COL_TRACK:
+            return track
+        if column == self.COL_CACHE:
+            caches = self._caches
+            try:
+                cache = caches[track]
+                caches.move_to_end(track)
+            except KeyError:
+                cache = caches[track] = {}
+                if len(caches) > self.CACHE_SIZE:
+                    caches.popitem(last=False)
+            return cache
+        return self._compute_row_params(position)[column - self.COL_PIXBUF]
+
+    def do_iter_next(self, itr):
+        position = self._get_position(itr)
+        if position < 0 or position + 1 >= len(self._tracks):
+            return False
+        itr.user_data = position + 2
+        return True
+
+    def do_iter_previous(self, itr):
+        position = self._get_position(itr)
+        if position <= 0:
+            return False
+        itr.user_data = position
+        return True
+
+    def do_iter_children(self, parent):
+        if parent is None and self._tracks:
+            return True, self._get_iter(0)
+        return False, None
+
+    def do_iter_has_child(self, itr):
+        return False
+
+    def do_iter_n_children(self, itr):
+        if itr is None:
+            return len(self._tracks)
+        return 0
+
+    def do_iter_nth_child(self, parent, n):
+        if parent is None and 0 <= n < len(self._tracks):
+            return True, self._get_iter(n)
+        return False, None
+
+    def do_iter_parent(self, child):
+        return False, None
+
+    def _row_changed(self, position):
+        self.row_changed(Gtk.TreePath((position,)), self._get_iter(position))
 
     def _set_columns(self, column_names):
         self.column_names = set(column_names)
@@ -1960,12 +2118,8 @@ class PlaylistModel(Gtk.ListStore):
 
     def _refresh_icons(self):
         self._setup_icons()
-        itr = self.get_iter_first()
-        position = 0
-        while itr:
-            self.set(itr, self.PARAM_COLS, self._compute_row_params(position))
-            itr = self.iter_next(itr)
-            position += 1
+        for position in range(len(self._tracks)):
+            self._row_changed(position)
 
     def on_option_set(self, typ, obj, data):
         if data == "gui/playlist_font":
@@ -1991,7 +2145,7 @@ class PlaylistModel(Gtk.ListStore):
         if playlist is self.player.queue.current_playlist:
             if (
                 playlist.current_position == rowidx
-                and playlist[rowidx] == self.player.current
+                and self._tracks[rowidx] == self.player.current
             ):
                 # this row is the current track, set a special icon
                 state = self.player.get_state()
@@ -2017,20 +2171,71 @@ class PlaylistModel(Gtk.ListStore):
         return pixbuf, sensitive, weight
 
     def update_row_params(self, position):
-        itr = self.iter_nth_child(None, position)
-        if itr is not None:
-            self.set(itr, self.PARAM_COLS, self._compute_row_params(position))
+        if 0 <= position < len(self._tracks):
+            self._row_changed(position)
 
     ### Event callbacks to keep the model in sync with the playlist ###
 
+    def _get_positions(self, track):
+        """
+        :returns: the positions of the rows showing track
+        """
+        if self._positions is None:
+            positions = collections.defaultdict(list)
+            for position, tr in enumerate(self._tracks):
+                positions[tr].append(position)
+            self._positions = positions
+        return self._positions.get(track, ())
+
+    def _forget_positions(self, start):
+        """
+        Drops the recorded positions of the rows from start on, before
+        rows are inserted or deleted there
+        """
+        positions = self._positions
+        for track in set(self._tracks[start:]):
+            rows = positions[track]
+            # the positions of each track are sorted
+            del rows[bisect.bisect_left(rows, start) :]
+            if not rows:
+                del positions[track]
+
+    def _record_positions(self, start):
+        """
+        Records the positions of the rows from start on, once rows were
+        inserted or deleted there
+        """
+        positions = self._positions
+        for position in range(start, len(self._tracks)):
+            positions[self._tracks[position]].append(position)
+
     def on_tracks_added(self, event_type, playlist, tracks):
-        self._load_data(tracks)
+        if not tracks:
+            return
+        # only the rows after the first insertion move; appending moves none
+        start = min(position for position, _track in tracks)
+        if self._positions is not None:
+            self._forget_positions(start)
+        for position, track in tracks:
+            self._tracks.insert(position, track)
+            self._stamp += 1
+            self.row_inserted(Gtk.TreePath((position,)), self._get_iter(position))
+        if self._positions is not None:
+            self._record_positions(start)
 
     def on_tracks_removed(self, event_type, playlist, tracks):
-        for position, track in reversed(tracks):
-            if position < 0:
-                continue
-            self.remove(self.iter_nth_child(None, position))
+        positions = [position for position, _track in tracks if position >= 0]
+        if not positions:
+            return
+        start = min(positions)
+        if self._positions is not None:
+            self._forget_positions(start)
+        for position in reversed(positions):
+            del self._tracks[position]
+            self._stamp += 1
+            self.row_deleted(Gtk.TreePath((position,)))
+        if self._positions is not None:
+            self._record_positions(start)
 
     def on_current_position_changed(self, event_type, playlist, positions):
         for position in positions:
@@ -2039,18 +2244,17 @@ class PlaylistModel(Gtk.ListStore):
             self.update_row_params(position)
 
     def on_spat_position_changed(self, event_type, playlist, positions):
-        pos = min(positions)
-
-        if pos < 0:
-            pos = 0
-            itr = self.get_iter_first()
-        else:
-            itr = self.iter_nth_child(None, pos)
-
-        while itr:
-            self.set(itr, self.PARAM_COLS, self._compute_row_params(pos))
-            itr = self.iter_next(itr)
-            pos += 1
+        # Rows before both positions keep their state, and so do rows after
+        # both unless the stop was only just set or cleared
+        start = min(positions)
+        end = max(positions) + 1
+        if end <= 0:
+            return
+        if start < 0:
+            start = end - 1
+            end = len(self._tracks)
+        for position in range(start, min(end, len(self._tracks))):
+            self._row_changed(position)
 
     def on_playback_state_change(self, event_type, player_obj, track):
         position = self.playlist.current_position
@@ -2059,11 +2263,7 @@ class PlaylistModel(Gtk.ListStore):
         self.update_row_params(position)
 
     def on_track_tags_changed(self, type, track, tags):
-        if (
-            not track
-            or not settings.get_option('gui/sync_on_tag_change', True)
-            or not (tags & self.column_names)
-        ):
+        if not track or not _SYNC_ON_TAG_CHANGE.value or not (tags & self.column_names):
             return
 
         if self._redraw_timer:
@@ -2071,69 +2271,25 @@ class PlaylistModel(Gtk.ListStore):
         self._redraw_queue.append(track)
         self._redraw_timer = GLib.timeout_add(100, self._on_track_tags_changed)
 
+    def on_tracks_tags_changed(self, type, obj, changes):
+        if not _SYNC_ON_TAG_CHANGE.value:
+            return
+        column_names = self.column_names
+        tracks = [track for track, tags in changes.items() if tags & column_names]
+        if not tracks:
+            return
+
+        if self._redraw_timer:
+            GLib.source_remove(self._redraw_timer)
+        self._redraw_queue.extend(tracks)
+        self._redraw_timer = GLib.timeout_add(100, self._on_track_tags_changed)
+
     def _on_track_tags_changed(self):
         self._redraw_timer = None
         redraw_queue = set(self._redraw_queue)
         self._redraw_queue = []
 
-        COL_TRACK = self.COL_TRACK
-        COL_CACHE = self.COL_CACHE
-
-        for row in self:
-            if row[COL_TRACK] in redraw_queue:
-                row[COL_CACHE].clear()
-                self.row_changed(row.path, row.iter)
-
-    #
-    # Loading data into the playlist:
-    #
-    # - Profiler reveals that most of the playlist loading time is spent in two
-    #   places
-    #   - Formatting values
-    #   - Converting them to GValue objects for insert into the treeview
-    #
-    # Now, the program is annoyingly blocked when this happens, so we need to
-    # process new tracks on a different thread, and show some kind of loading
-    # indicator instead. That's what these four functions help us do.
-    #
-
-    def _load_data(self, tracks):
-        # Don't allow race condition between adds.. there's probably a race
-        # condition for removal
-        if self.data_loading:
-            self.data_load_queue.extend(tracks)
-            return
-
-        self.data_loading = True
-        self.emit('data-loading', True)
-
-        if len(tracks) > 500:
-            self._load_data_thread(tracks)
-        else:
-            render_data = self._load_data_fn(tracks)
-            self._load_data_done(render_data)
-
-    @common.threaded
-    def _load_data_thread(self, tracks):
-        render_data = self._load_data_fn(tracks)
-        GLib.idle_add(self._load_data_done, render_data)
-
-    def _load_data_fn(self, tracks):
-        indices = (0, 1, 2, 3, 4)
-        return [
-            (position, indices, (track, {}) + self._compute_row_params(position))
-            for position, track in tracks
-        ]
-
-    def _load_data_done(self, render_data):
-        for args in render_data:
-            self.insert_with_valuesv(*args)
-
-        self.data_loading = False
-        self.emit('data-loading', False)
-
-        if self.data_load_queue:
-            tracks = self.data_load_queue
-            self.data_load_queue = []
-
-            self._load_data(tracks)
+        for track in redraw_queue:
+            self._caches.pop(track, None)
+            for position in self._get_positions(track):
+                self._row_changed(position)
@@ -29,6 +29,7 @@ from gi.repository import GLib
 from gi.repository import Gtk
 from gi.repository import Pango
 
+import functools
 import logging
 import time
 
@@ -44,12 +45,20 @@ logger = logging.getLogger(__name__)
 DEFAULT_COLUMNS = ['tracknumber', 'title', 'album', 'artist', '__length']
 
 
+@functools.lru_cache(maxsize=None)
+def _get_tag_formatter(tag):
+    """
+    Returns a formatter for a single tag, shared by all columns of it
+    """
+    return TrackFormatter('$%s' % tag)
+
+
 class Column(Gtk.TreeViewColumn):
     name = ''
     display = ''
     menu_title = classproperty(lambda c: c.display)
     renderer = Gtk.CellRendererText
-    formatter = classproperty(lambda c: TrackFormatter('$%s' % c.name))
+    formatter = classproperty(lambda c: _get_tag_formatter(c.name))
     size = 10  # default size
     autoexpand = False  # whether to expand to fit space in Autosize mode
     datatype = str